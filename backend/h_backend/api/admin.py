@@ -1,5 +1,87 @@
-from django.contrib import admin
-from .models import Category, Product, Slide, CompanyInfo, CompanyLogo, Cart, CartItem
+from django import forms
+from django.contrib import admin, messages
+from django.conf import settings
+from django.contrib.admin import helpers
+from django.core.exceptions import PermissionDenied
+from django.db.models import F
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .bulk import PriceOutOfRange, update_products
+from .cache import deferred_invalidation
+from .importer import ProductImport, describe_change, detect_format, read_rows
+from .models import Category, Product, ProductBulkChange, Slide, CompanyInfo, CompanyLogo, Cart, CartItem
+from .pagination import EstimatedCountPaginator
+from .parsers import text_stream
+
+
+# Changed rows listed on the import page
+IMPORT_PREVIEW_ROWS = 200
+
+
+class ProductImportForm(forms.Form):
+    """Upload form for the product import page"""
+    file = forms.FileField(help_text='CSV with a header row, or NDJSON (.ndjson / .jsonl)')
+    dry_run = forms.BooleanField(
+        required=False,
+        initial=True,
+        help_text='Only show what would change',
+    )
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        try:
+            upload.import_format = detect_format(upload.name)
+        except ValueError as exc:
+            raise forms.ValidationError(str(exc))
+        # Check the whole file decodes before importing any of it
+        try:
+            for line in text_stream(upload):
+                pass
+        except UnicodeDecodeError as exc:
+            raise forms.ValidationError('The file is not {} text: {}'.format(settings.DEFAULT_CHARSET, exc))
+        upload.seek(0)
+        return upload
+
+
+class PriceAdjustmentForm(forms.Form):
+    """Intermediate form of the "Adjust prices" action"""
+    percent = forms.DecimalField(
+        required=False,
+        max_digits=7,
+        decimal_places=3,
+        min_value=-100,
+        help_text='e.g. 7.5 for a 7.5% rise, -10 for a 10% cut',
+    )
+    amount = forms.DecimalField(
+        required=False,
+        max_digits=10,
+        decimal_places=2,
+        help_text='Ksh added to every price (negative to subtract)',
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        given = [name for name in ('percent', 'amount') if cleaned_data.get(name) is not None]
+        if len(given) != 1:
+            raise forms.ValidationError('Enter either a percentage or an amount.')
+        return cleaned_data
+
+
+def flag_action(flag, value, description):
+    """Admin action setting `flag` to `value` on the selected products in one UPDATE"""
+    def action(modeladmin, request, queryset):
+        change = update_products(
+            queryset,
+            flags={flag: value},
+            user=request.user,
+            source='admin',
+            scope=modeladmin.action_scope(request),
+        )
+        modeladmin.message_user(request, f"{description}: {change.product_count} products.", messages.SUCCESS)
+    action.__name__ = '{}_{}'.format('set' if value else 'clear', flag)
+    action.short_description = description
+    return action
 
 
 @admin.register(Category)
@@ -32,7 +114,11 @@ class ProductAdmin(admin.ModelAdmin):
     list_filter = ['category', 'is_featured', 'is_bestseller', 'is_active', 'created_at']
     search_fields = ['name', 'company', 'description']
     list_editable = ['is_featured', 'is_bestseller', 'is_active']
+    list_select_related = ['category']
     readonly_fields = ['created_at', 'updated_at']
+    # Skip the unfiltered COUNT(*) shown next to filtered results
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     
     fieldsets = (
         ('Basic Information', {
@@ -53,6 +139,106 @@ class ProductAdmin(admin.ModelAdmin):
     )
     
     list_per_page = 20
+    actions = [
+        flag_action('is_featured', True, 'Mark selected products as featured'),
+        flag_action('is_featured', False, 'Remove selected products from featured'),
+        flag_action('is_bestseller', True, 'Mark selected products as bestsellers'),
+        flag_action('is_bestseller', False, 'Remove selected products from bestsellers'),
+        flag_action('is_active', True, 'Activate selected products'),
+        flag_action('is_active', False, 'Deactivate selected products'),
+        'adjust_prices',
+    ]
+    
+    def changelist_view(self, request, extra_context=None):
+        # list_editable saves the rows one by one; bump the caches once
+        with deferred_invalidation():
+            return super().changelist_view(request, extra_context)
+    
+    def action_scope(self, request):
+        """How an action's products were chosen, for the audit record"""
+        return {
+            'filters': {key: value for key, value in request.GET.items()},
+            'select_across': request.POST.get('select_across') == '1',
+        }
+    
+    def adjust_prices(self, request, queryset):
+        """Raise or cut the selected products' prices, in one UPDATE"""
+        form = PriceAdjustmentForm(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            try:
+                change = update_products(
+                    queryset,
+                    percent=form.cleaned_data['percent'],
+                    amount=form.cleaned_data['amount'],
+                    user=request.user,
+                    source='admin',
+                    scope=self.action_scope(request),
+                )
+            except PriceOutOfRange as exc:
+                form.add_error(None, str(exc))
+            else:
+                self.message_user(request, f"Adjusted the prices of {change.product_count} products.", messages.SUCCESS)
+                return None
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Adjust prices',
+            'form': form,
+            'queryset': queryset,
+            'count': queryset.count(),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+        }
+        return TemplateResponse(request, 'admin/api/product/adjust_prices.html', context)
+    adjust_prices.short_description = 'Adjust prices of selected products'
+    
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_view), name='api_product_import'),
+        ]
+        return urls + super().get_urls()
+    
+    def import_view(self, request):
+        """Upload a supplier price list (see api/importer.py)"""
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+        
+        form = ProductImportForm(request.POST or None, request.FILES or None)
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import products',
+            'form': form,
+        }
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            dry_run = form.cleaned_data['dry_run']
+            changes, errors = [], []
+            
+            def on_row(line, action, product, row_changes):
+                if action != 'unchanged' and len(changes) < IMPORT_PREVIEW_ROWS:
+                    changes.append(describe_change(line, action, product, row_changes))
+            
+            def on_error(line, message):
+                if len(errors) < IMPORT_PREVIEW_ROWS:
+                    errors.append('line {}: {}'.format(line, message))
+            
+            report = ProductImport(dry_run=dry_run, on_row=on_row, on_error=on_error).run(
+                read_rows(upload, upload.import_format)
+            )
+            if not dry_run:
+                level = messages.WARNING if report['errors'] else messages.SUCCESS
+                self.message_user(request, (
+                    'Created {created} and updated {updated} products ({unchanged} unchanged, '
+                    '{errors} rows skipped) in {seconds:.1f}s.'
+                ).format(**report), level)
+                for error in errors[:10]:
+                    self.message_user(request, error, messages.WARNING)
+                return redirect('admin:api_product_changelist')
+            context.update(report=report, changes=changes, errors=errors)
+        return TemplateResponse(request, 'admin/api/product/import.html', context)
 
 
 @admin.register(Slide)
@@ -122,7 +308,7 @@ class CompanyLogoAdmin(admin.ModelAdmin):
     list_filter = ['is_active']
     search_fields = ['name']
     list_editable = ['order', 'is_active']
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'updated_at']
     
     fieldsets = (
         ('Logo Information', {
@@ -133,12 +319,32 @@ class CompanyLogoAdmin(admin.ModelAdmin):
             'description': 'Lower order numbers appear first in the scrolling section.'
         }),
         ('Timestamps', {
-            'fields': ('created_at',),
+            'fields': ('created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
 
 
+@admin.register(ProductBulkChange)
+class ProductBulkChangeAdmin(admin.ModelAdmin):
+    """
+    Read-only audit log of bulk price and flag changes
+    """
+    list_display = ['created_at', 'user', 'source', 'price_percent', 'price_amount', 'flags', 'product_count']
+    list_filter = ['source', 'created_at']
+    list_select_related = ['user']
+    readonly_fields = [
+        'created_at', 'user', 'source', 'scope', 'price_percent', 'price_amount',
+        'flags', 'product_count', 'product_ids',
+    ]
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 # ============================================
 # NEW CART ADMIN
 # ============================================
@@ -152,6 +358,9 @@ class CartItemInline(admin.TabularInline):
     readonly_fields = ['product', 'quantity', 'total_price', 'created_at']
     can_delete = True
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+    
     def total_price(self, obj):
         """Display calculated total price"""
         return f"Ksh {obj.total_price}"
@@ -168,6 +377,8 @@ class CartAdmin(admin.ModelAdmin):
     readonly_fields = ['session_key', 'created_at', 'updated_at', 'item_count', 'total_price_display']
     list_filter = ['created_at', 'updated_at']
     inlines = [CartItemInline]
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     
     fieldsets = (
         ('Cart Information', {
@@ -184,9 +395,10 @@ class CartAdmin(admin.ModelAdmin):
     session_key_short.short_description = 'Session'
     
     def total_price_display(self, obj):
-        """Display formatted total price"""
+        """Display formatted total price (stored on the cart, no item queries)"""
         return f"Ksh {obj.total_price}"
     total_price_display.short_description = 'Total Price'
+    total_price_display.admin_order_field = 'total_amount'
     
     def has_add_permission(self, request):
         """Carts should only be created through the API"""
@@ -202,6 +414,9 @@ class CartItemAdmin(admin.ModelAdmin):
     list_filter = ['created_at', 'updated_at']
     search_fields = ['cart__session_key', 'product__name']
     readonly_fields = ['cart', 'product', 'quantity', 'total_price_display', 'created_at', 'updated_at']
+    list_select_related = ['cart', 'product']
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
     
     fieldsets = (
         ('Cart Item Information', {
@@ -212,15 +427,22 @@ class CartItemAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Line totals come from the joined product row, and can be sorted on
+        return super().get_queryset(request).annotate(line_total=F('quantity') * F('product__price'))
+    
     def cart_session(self, obj):
         """Display cart session key (shortened)"""
         return f"{obj.cart.session_key[:8]}..."
     cart_session.short_description = 'Cart Session'
+    cart_session.admin_order_field = 'cart__session_key'
     
     def total_price_display(self, obj):
         """Display formatted total price"""
-        return f"Ksh {obj.total_price}"
+        total = getattr(obj, 'line_total', None)
+        return f"Ksh {total if total is not None else obj.total_price}"
     total_price_display.short_description = 'Total Price'
+    total_price_display.admin_order_field = 'line_total'
     
     def has_add_permission(self, request):
         """Cart items should only be created through the API"""
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Register signal handlers
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.models.signals import post_migrate
+        from . import purge, signals
+
+        post_migrate.connect(signals.restore_search_backend, sender=self)
+
+        # Periodic purge of expired sessions and abandoned carts
+        if getattr(settings, 'PURGE_INTERVAL', None):
+            request_started.connect(purge.start_purge_job, dispatch_uid='api.purge')
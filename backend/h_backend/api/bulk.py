@@ -0,0 +1,102 @@
+"""
+Set-based price and flag updates for many products at once.
+
+A change is one UPDATE over the products in scope, whatever their
+number, plus a ProductBulkChange audit record. QuerySet.update() skips
+Product.save() and its signals, so the change applies the cart
+price-change policy and invalidates the catalog caches itself, once.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, F, Max, Value
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .cache import invalidate_catalog_cache, invalidate_home_snapshot
+from .carts import prices_changed
+from .models import Product, ProductBulkChange
+
+
+PRODUCT_FLAGS = ('is_featured', 'is_bestseller', 'is_active')
+
+
+class PriceOutOfRange(ValueError):
+    """A price change that would take a price beyond what Product.price holds"""
+
+
+def price_expression(percent=None, amount=None):
+    """
+    New price after a percentage or absolute adjustment, rounded to the
+    cent and never below zero
+    """
+    price_field = Product._meta.get_field('price')
+    money = DecimalField(max_digits=price_field.max_digits, decimal_places=price_field.decimal_places)
+    if percent is not None:
+        factor = Value((Decimal(100) + Decimal(percent)) / Decimal(100), output_field=DecimalField())
+        price = Round(F('price') * factor, 2, output_field=money)
+    else:
+        price = F('price') + Value(Decimal(amount), output_field=money)
+    return Greatest(price, Value(Decimal('0'), output_field=money), output_field=money)
+
+
+def check_price_range(ids, price):
+    """
+    Raise PriceOutOfRange if the `price` expression takes any of the
+    products `ids` beyond the digits of Product.price, which some
+    databases would refuse mid-UPDATE and others store as is
+    """
+    price_field = Product._meta.get_field('price')
+    limit = Decimal(10) ** (price_field.max_digits - price_field.decimal_places)
+    highest = Product.objects.filter(pk__in=ids).aggregate(
+        price=Max(price, output_field=DecimalField())
+    )['price']
+    if highest is not None and highest >= limit:
+        raise PriceOutOfRange('The new prices would reach {}; prices must stay below {}'.format(
+            round(Decimal(highest), price_field.decimal_places), limit
+        ))
+
+
+def update_products(queryset, percent=None, amount=None, flags=None, user=None, source='api', scope=None):
+    """
+    Adjust the prices of the products in `queryset` by `percent` or by
+    `amount`, and/or set `flags` ({'is_featured': True, ...}), in one
+    UPDATE. Returns the ProductBulkChange recorded. Raises
+    PriceOutOfRange, changing nothing, if a new price would not fit.
+    """
+    if percent is not None and amount is not None:
+        raise ValueError('Give a percentage or an amount, not both')
+    flags = {name: bool(value) for name, value in (flags or {}).items()}
+    unknown = set(flags) - set(PRODUCT_FLAGS)
+    if unknown:
+        raise ValueError('Unknown flags: {}'.format(', '.join(sorted(unknown))))
+    reprice = percent is not None or amount is not None
+    if not reprice and not flags:
+        raise ValueError('Nothing to change')
+
+    fields = dict(flags, updated_at=timezone.now())
+    if reprice:
+        fields['price'] = price_expression(percent, amount)
+
+    with transaction.atomic():
+        # Lock the rows in scope, so the ids audited are the ids updated
+        in_scope = Product.objects.filter(pk__in=queryset.values('pk')).select_for_update()
+        ids = list(in_scope.order_by('pk').values_list('pk', flat=True))
+        if ids and reprice:
+            check_price_range(ids, fields['price'])
+        if ids:
+            Product.objects.filter(pk__in=ids).update(**fields)
+            if reprice:
+                prices_changed(ids)
+            transaction.on_commit(invalidate_catalog_cache)
+            transaction.on_commit(invalidate_home_snapshot)
+        return ProductBulkChange.objects.create(
+            user=user if user is not None and user.is_authenticated else None,
+            source=source,
+            scope=scope or {},
+            price_percent=percent,
+            price_amount=amount,
+            flags=flags,
+            product_count=len(ids),
+            product_ids=ids,
+        )
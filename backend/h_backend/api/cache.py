@@ -0,0 +1,289 @@
+"""
+Server-side caching helpers for the public catalog API.
+
+Cached entries are keyed by a generation number that is bumped whenever
+the underlying rows change (see api/signals.py). Bumping a generation
+orphans every entry built from the old data, so stale entries simply age
+out of the cache instead of having to be hunted down and deleted.
+"""
+import hashlib
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .models import Category, Product, Slide, CompanyInfo, CompanyLogo
+
+
+HOME_GENERATION_KEY = 'api:home:generation'
+HOME_SNAPSHOT_TIMEOUT = getattr(settings, 'HOME_SNAPSHOT_TIMEOUT', 60 * 60 * 24)
+
+CATALOG_GENERATION_KEY = 'api:catalog:generation'
+CATALOG_CACHE_TIMEOUT = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+
+STATS_KEY_PREFIX = 'api:stats:'
+
+
+UNSHARED_CACHE_WARNING = (
+    'The cache is local to this process (CACHE_LOCATION is not set), so the '
+    'running web workers will not see this invalidation: they keep serving '
+    'cached catalog responses and the homepage snapshot until those expire. '
+    'Set CACHE_LOCATION for both, or restart the web workers.'
+)
+
+
+def cache_is_shared():
+    """
+    Whether the default cache is shared with other processes. Caches
+    invalidated by a management command only reach the web workers
+    through a shared cache.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def get_generation(key):
+    """Return the current generation number stored under `key`"""
+    generation = cache.get(key)
+    if generation is None:
+        # Seed from the clock so a generation lost to eviction or a restart
+        # never collides with one that was handed out before.
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+_deferred = threading.local()
+
+
+def bump_generation(key):
+    """Invalidate everything cached under the current generation of `key`"""
+    pending = getattr(_deferred, 'keys', None)
+    if pending is not None:
+        pending.add(key)
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), None)
+
+
+@contextmanager
+def deferred_invalidation():
+    """
+    Collapse the generation bumps made in this thread inside the block
+    into one per key, made when the block exits. For changes that save
+    many rows one by one.
+    """
+    if getattr(_deferred, 'keys', None) is not None:
+        yield
+        return
+    _deferred.keys = set()
+    try:
+        yield
+    finally:
+        keys, _deferred.keys = _deferred.keys, None
+        for key in keys:
+            bump_generation(key)
+
+
+# ============================================
+# COUNTERS
+# ============================================
+
+# Counters are kept per process and added to the cache every
+# STATS_FLUSH_EVERY increments, so counting costs no cache write per
+# request. Only a shared cache (CACHE_LOCATION) adds up the workers and
+# lets the cache_stats command see them; on the local-memory default each
+# worker reports its own counters through GET /api/cache-stats/.
+STATS_FLUSH_EVERY = 100
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def increment_stat(name, delta=1):
+    """Add `delta` to a named counter"""
+    with _stats_lock:
+        _stats[name] += delta
+        if sum(_stats.values()) < STATS_FLUSH_EVERY:
+            return
+    flush_stats()
+
+
+def flush_stats():
+    """Add this process's pending counts to the counters in the cache"""
+    with _stats_lock:
+        pending = dict(_stats)
+        _stats.clear()
+    for name, delta in pending.items():
+        key = STATS_KEY_PREFIX + name
+        if not cache.add(key, delta, None):
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                cache.set(key, delta, None)
+
+
+def get_stat(name):
+    with _stats_lock:
+        pending = _stats[name]
+    return cache.get(STATS_KEY_PREFIX + name, 0) + pending
+
+
+def reset_stats(*names):
+    with _stats_lock:
+        for name in names:
+            _stats.pop(name, None)
+    cache.delete_many([STATS_KEY_PREFIX + name for name in names])
+
+
+def collect_stats():
+    """
+    Every counter, as reported by the cache_stats command and
+    GET /api/cache-stats/
+    """
+    from .images import image_urls
+
+    return {
+        'catalog': catalog_cache_stats(),
+        'image_urls': image_urls.stats(),
+        'carts': {
+            'virtual_reads': get_stat('cart:virtual_reads'),
+            'writes_avoided': get_stat('cart:writes_avoided'),
+        },
+    }
+
+
+# ============================================
+# HOMEPAGE SNAPSHOT
+# ============================================
+
+def build_home_snapshot(request):
+    """
+    Serialize every section of the homepage in one pass.
+    Each product list is capped at one page, matching what the
+    individual endpoints return on their first page.
+    """
+    # Imported here to keep serializers free to import from this module
+    from .serializers import (
+        CategorySerializer,
+        ProductListSerializer,
+        SlideSerializer,
+        CompanyInfoSerializer,
+        CompanyLogoSerializer,
+    )
+
+    context = {'request': request}
+    page_size = api_settings.PAGE_SIZE
+    products = Product.objects.filter(is_active=True).select_related('category')
+
+    return {
+        'slides': SlideSerializer(
+            Slide.objects.filter(is_active=True), many=True, context=context
+        ).data,
+        'company_logos': CompanyLogoSerializer(
+            CompanyLogo.objects.filter(is_active=True), many=True, context=context
+        ).data,
+        'featured_products': ProductListSerializer(
+            products.filter(is_featured=True)[:page_size], many=True, context=context
+        ).data,
+        'latest_products': ProductListSerializer(
+            products[:8], many=True, context=context
+        ).data,
+        'bestseller_products': ProductListSerializer(
+            products.filter(is_bestseller=True)[:page_size], many=True, context=context
+        ).data,
+        'categories': CategorySerializer(
+            Category.objects.all(), many=True, context=context
+        ).data,
+        'company_info': CompanyInfoSerializer(CompanyInfo.load()).data,
+    }
+
+
+def get_home_snapshot(request):
+    """
+    Return the homepage snapshot, rebuilding it only if the catalog
+    changed since it was last built.
+    Image URLs are absolute, so snapshots are kept per scheme and host.
+    """
+    key = 'api:home:{}:{}://{}'.format(
+        get_generation(HOME_GENERATION_KEY),
+        request.scheme,
+        request.get_host(),
+    )
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_home_snapshot(request)
+        cache.set(key, snapshot, HOME_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def invalidate_home_snapshot():
+    bump_generation(HOME_GENERATION_KEY)
+
+
+# ============================================
+# CATALOG RESPONSE CACHE
+# ============================================
+
+def catalog_cache_key(request):
+    """
+    Build the cache key for a catalog GET request.
+    Covers the catalog generation, scheme and host (serialized image and
+    pagination URLs are absolute), path and every query parameter.
+    """
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    )
+    raw = '{}|{}'.format(request.build_absolute_uri(request.path), params)
+    digest = hashlib.md5(raw.encode('utf-8')).hexdigest()
+    return 'api:catalog:{}:{}'.format(get_generation(CATALOG_GENERATION_KEY), digest)
+
+
+def invalidate_catalog_cache():
+    bump_generation(CATALOG_GENERATION_KEY)
+
+
+def catalog_cache_stats():
+    """Return hit/miss counters for the catalog response cache"""
+    hits = get_stat('catalog:hits')
+    misses = get_stat('catalog:misses')
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+class CachedCatalogMixin:
+    """
+    Caches the serialized data of successful GET responses until the
+    catalog changes. Adds an X-Cache header reporting HIT or MISS.
+    """
+    cache_timeout = CATALOG_CACHE_TIMEOUT
+
+    def get(self, request, *args, **kwargs):
+        key = catalog_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            increment_stat('catalog:hits')
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        increment_stat('catalog:misses')
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
@@ -0,0 +1,342 @@
+"""
+Pluggable storage for session carts.
+
+The cart views talk to a store chosen by the CART_STORAGE_BACKEND
+setting:
+
+- DatabaseCartStore (default) reads and writes Cart/CartItem directly,
+  one atomic statement per change (see api/carts.py).
+- CacheCartStore keeps each working cart as a snapshot in Django's
+  cache and persists changed carts to Cart/CartItem in batches
+  (write-behind). Every change for a session runs under a per-session
+  cache lock and is written to the cache before the response, so a
+  session always reads its own writes. The cache must be shared by
+  every worker process (e.g. CACHE_LOCATION), or sessions would see
+  different carts depending on the worker.
+
+With CacheCartStore, cart lines are identified by their product id:
+the `id` of each item, and the `item_id` accepted by PUT and DELETE,
+is the product id. The cart `id` is null until the cart has been
+loaded from the database.
+"""
+import atexit
+import functools
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+
+from . import carts
+from .models import Cart, CartItem, Product
+from .serializers import CartItemSerializer, CartSerializer
+from .tasks import run_in_background
+
+
+DEFAULT_CART_STORAGE_BACKEND = 'api.cart_storage.DatabaseCartStore'
+
+
+@functools.lru_cache(maxsize=None)
+def get_cart_store():
+    """Return the configured cart store (one instance per process)"""
+    backend = getattr(settings, 'CART_STORAGE_BACKEND', DEFAULT_CART_STORAGE_BACKEND)
+    return import_string(backend)()
+
+
+def reset_cart_store(setting, **kwargs):
+    if setting == 'CART_STORAGE_BACKEND':
+        get_cart_store().flush()
+        get_cart_store.cache_clear()
+
+setting_changed.connect(reset_cart_store)
+
+
+def delta_data(version, item_count, total_price, items, removed):
+    """The body of a ?response=delta cart response"""
+    return {
+        'version': version,
+        'item_count': item_count,
+        'total_price': float(total_price),
+        'items': items,
+        'removed': sorted(removed),
+    }
+
+
+# ============================================
+# DATABASE
+# ============================================
+
+class DatabaseCartStore:
+    """
+    Reads and writes Cart/CartItem directly. Carts are Cart instances.
+    """
+    def find(self, session_key):
+        """Return the cart for `session_key`, or None. Never writes."""
+        return Cart.objects.filter(session_key=session_key).first()
+
+    def get_or_create(self, session_key):
+        return carts.get_cart(session_key)
+
+    def validator_state(self, cart):
+        """A (key, last modified) pair for the cart's ETag"""
+        return (cart.pk, cart.updated_at)
+
+    def apply(self, cart, operations):
+        """Apply add/set/remove operations keyed by product id"""
+        carts.apply_operations(cart, operations)
+
+    def set_quantity(self, cart, item_id, quantity):
+        """Change one line; returns its product id, or None if not in the cart"""
+        product_id = self._line_product(cart, item_id)
+        if product_id is None or not carts.set_quantity(cart, item_id, quantity):
+            return None
+        return product_id
+
+    def remove_item(self, cart, item_id):
+        """Remove one line; returns its product id, or None if not in the cart"""
+        product_id = self._line_product(cart, item_id)
+        if product_id is None or not carts.remove_item(cart, item_id):
+            return None
+        return product_id
+
+    def representation(self, cart, request):
+        cart = Cart.objects.with_items().get(pk=cart.pk)
+        return CartSerializer(cart, context={'request': request}).data
+
+    def delta(self, cart, request, product_ids):
+        cart = Cart.objects.get(pk=cart.pk)
+        items = list(CartItem.objects.filter(
+            cart=cart, product_id__in=product_ids
+        ).select_related('product__category'))
+        return delta_data(
+            cart.version,
+            cart.item_count,
+            cart.total_price,
+            CartItemSerializer(items, many=True, context={'request': request}).data,
+            set(product_ids) - {item.product_id for item in items},
+        )
+
+    def flush(self):
+        """Nothing is buffered"""
+
+    def _line_product(self, cart, item_id):
+        return CartItem.objects.filter(pk=item_id, cart=cart).values_list('product_id', flat=True).first()
+
+
+# ============================================
+# CACHE WITH WRITE-BEHIND
+# ============================================
+
+class CachedCart:
+    """A session's cart as held by CacheCartStore"""
+    def __init__(self, session_key, snapshot):
+        self.session_key = session_key
+        self.snapshot = snapshot
+
+
+class CacheCartStore:
+    """
+    Keeps working carts in the cache as snapshots:
+
+        {'id': <Cart pk or None>, 'version': 3, 'created_at': ...,
+         'updated_at': ..., 'lines': {product_id: (quantity, added_at)}}
+
+    Changed snapshots are also kept in a per-process buffer until they
+    are written to the database, CART_WRITE_BEHIND_DELAY seconds after
+    the first pending change or as soon as CART_WRITE_BEHIND_BATCH carts
+    are pending. The buffer also covers a snapshot evicted from the
+    cache before it was written. Pending carts are flushed at exit;
+    changes can only be lost if the process dies in between.
+    """
+    key_prefix = 'api:cart:'
+    timeout = 60 * 60 * 24
+    lock_timeout = 5
+
+    def __init__(self):
+        self.delay = getattr(settings, 'CART_WRITE_BEHIND_DELAY', 2)
+        self.batch_size = getattr(settings, 'CART_WRITE_BEHIND_BATCH', 200)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    def find(self, session_key):
+        snapshot = self._load(session_key)
+        return CachedCart(session_key, snapshot) if snapshot is not None else None
+
+    def get_or_create(self, session_key):
+        cart = self.find(session_key)
+        if cart is None:
+            now = timezone.now()
+            cart = CachedCart(session_key, {
+                'id': None, 'version': 0, 'created_at': now, 'updated_at': now, 'lines': {},
+            })
+        return cart
+
+    def validator_state(self, cart):
+        return (cart.snapshot['version'], cart.snapshot['updated_at'])
+
+    def apply(self, cart, operations):
+        def change(lines, now):
+            for operation in operations:
+                product_id = operation['product_id']
+                quantity, added = lines.get(product_id, (0, now))
+                if operation['op'] == 'add':
+                    lines[product_id] = (quantity + operation['quantity'], added)
+                elif operation['op'] == 'set' and operation['quantity']:
+                    lines[product_id] = (operation['quantity'], added)
+                else:
+                    lines.pop(product_id, None)
+            return True
+        self._change(cart, change)
+
+    def set_quantity(self, cart, item_id, quantity):
+        product_id = self._product_id(item_id)
+
+        def change(lines, now):
+            if product_id not in lines:
+                return False
+            if quantity:
+                lines[product_id] = (quantity, lines[product_id][1])
+            else:
+                del lines[product_id]
+            return True
+        return product_id if self._change(cart, change) else None
+
+    def remove_item(self, cart, item_id):
+        product_id = self._product_id(item_id)
+
+        def change(lines, now):
+            return lines.pop(product_id, None) is not None
+        return product_id if self._change(cart, change) else None
+
+    def representation(self, cart, request):
+        items, item_count, total_price = self._items(cart)
+        snapshot = cart.snapshot
+        timestamp = serializers.DateTimeField()
+        data = {
+            'id': snapshot['id'],
+            'session_key': cart.session_key,
+            'version': snapshot['version'],
+            'items': CartItemSerializer(items, many=True, context={'request': request}).data,
+            'item_count': item_count,
+            'total_price': float(total_price),
+            'created_at': timestamp.to_representation(snapshot['created_at']),
+            'updated_at': timestamp.to_representation(snapshot['updated_at']),
+        }
+        return {name: data[name] for name in CartSerializer.Meta.fields}
+
+    def delta(self, cart, request, product_ids):
+        items, item_count, total_price = self._items(cart)
+        changed = [item for item in items if item.product_id in product_ids]
+        return delta_data(
+            cart.snapshot['version'],
+            item_count,
+            total_price,
+            CartItemSerializer(changed, many=True, context={'request': request}).data,
+            set(product_ids) - {item.product_id for item in changed},
+        )
+
+    def flush(self):
+        """Write every pending cart to the database now"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+
+        # Another worker may hold newer changes to the same cart
+        shared = cache.get_many([self._key(session_key) for session_key in pending])
+        snapshots = {}
+        for session_key, snapshot in pending.items():
+            latest = shared.get(self._key(session_key))
+            if latest is not None and latest['version'] > snapshot['version']:
+                snapshot = latest
+            snapshots[session_key] = snapshot
+
+        try:
+            carts.save_snapshots(snapshots)
+        except Exception:
+            # Keep the changes for the next attempt unless newer ones arrived
+            with self._lock:
+                for session_key, snapshot in snapshots.items():
+                    self._pending.setdefault(session_key, snapshot)
+                self._schedule()
+            raise
+
+    # --------------------------------------------
+
+    def _key(self, session_key):
+        return self.key_prefix + session_key
+
+    def _load(self, session_key):
+        snapshot = cache.get(self._key(session_key))
+        if snapshot is None:
+            snapshot = self._pending.get(session_key) or carts.load_snapshot(session_key)
+            # Readers load outside the session lock: never replace a
+            # snapshot that a change stored in the meantime
+            if snapshot is not None and not cache.add(self._key(session_key), snapshot, self.timeout):
+                snapshot = cache.get(self._key(session_key), snapshot)
+        return snapshot
+
+    def _change(self, cart, change):
+        """
+        Apply `change(lines, now)` to the latest snapshot of `cart` under
+        the session lock. `change` returns False when nothing changed.
+        """
+        lock = self._key(cart.session_key) + ':lock'
+        while not cache.add(lock, 1, self.lock_timeout):
+            time.sleep(0.005)
+        try:
+            snapshot = self._load(cart.session_key) or cart.snapshot
+            snapshot = dict(snapshot, lines=dict(snapshot['lines']))
+            now = timezone.now()
+            if not change(snapshot['lines'], now):
+                cart.snapshot = snapshot
+                return False
+            snapshot['version'] += 1
+            snapshot['updated_at'] = now
+            cache.set(self._key(cart.session_key), snapshot, self.timeout)
+        finally:
+            cache.delete(lock)
+
+        cart.snapshot = snapshot
+        with self._lock:
+            self._pending[cart.session_key] = snapshot
+            if len(self._pending) >= self.batch_size:
+                run_in_background(self.flush)
+            else:
+                self._schedule()
+        return True
+
+    def _schedule(self):
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, run_in_background, [self.flush])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _items(self, cart):
+        """Unsaved CartItems for the snapshot, newest first, with totals"""
+        lines = cart.snapshot['lines']
+        products = Product.objects.select_related('category').in_bulk(list(lines))
+        items = [
+            CartItem(id=product_id, product=products[product_id], quantity=quantity, created_at=added)
+            for product_id, (quantity, added) in sorted(lines.items(), key=lambda line: line[1][1], reverse=True)
+            if product_id in products
+        ]
+        item_count = sum(item.quantity for item in items)
+        total_price = sum((item.total_price for item in items), Decimal('0'))
+        return items, item_count, total_price
+
+    def _product_id(self, item_id):
+        try:
+            return int(item_id)
+        except (TypeError, ValueError):
+            return None
@@ -0,0 +1,381 @@
+"""
+Atomic cart mutations.
+
+Every change to a cart line is a single statement, so concurrent
+requests for the same session cannot lose updates or trip the
+(cart, product) unique constraint:
+
+- adds are one INSERT ... ON CONFLICT DO UPDATE that increments the
+  stored quantity, on databases that support it (SQLite 3.24+,
+  PostgreSQL), and an F() update with an insert fallback elsewhere
+- quantity changes are a single UPDATE
+- batches (apply_operations) collapse to at most one bulk statement each
+  for adds, sets and removals, and touch the cart once
+- removals are raw DELETEs, which skip CartItem's post_delete handler
+
+These bypass CartItem.save(), so they touch Cart.updated_at and
+Cart.version themselves (see signals.cart_item_changed for the ORM path).
+Fallbacks that do save lines one by one run inside bulk_change(), so
+the per-line handler stays out of the way and the cart is touched once.
+
+Each change also keeps Cart.item_count and Cart.total_amount current,
+in the same transaction: adds apply the known difference with F()
+expressions, other changes recompute the totals from the cart's lines.
+The cart row is locked first, so concurrent changes to one cart are
+applied one after the other and the totals cannot drift.
+"""
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+
+# Rows per INSERT; keeps the parameter count under SQLite's limit
+UPSERT_BATCH_SIZE = 150
+
+
+_bulk = threading.local()
+
+
+@contextmanager
+def bulk_change():
+    """
+    Mark a change that touches the cart itself once it is done: CartItem
+    saves and deletes in this thread inside the block skip the per-line
+    refresh in signals.cart_item_changed
+    """
+    if getattr(_bulk, 'active', False):
+        yield
+        return
+    _bulk.active = True
+    try:
+        yield
+    finally:
+        _bulk.active = False
+
+
+def in_bulk_change():
+    return getattr(_bulk, 'active', False)
+
+
+def get_cart(session_key):
+    """Return the cart for `session_key`, creating it if needed"""
+    # get_or_create() retries the lookup when a concurrent request
+    # creates the same cart first
+    cart, created = Cart.objects.get_or_create(session_key=session_key)
+    return cart
+
+
+def lock_cart(cart):
+    """Lock the cart row until the end of the current transaction"""
+    carts = Cart.objects.filter(pk=cart.pk)
+    if connection.features.has_select_for_update:
+        list(carts.select_for_update().values_list('pk', flat=True))
+    else:
+        # SQLite locks the whole database on the first write, and a
+        # transaction that read first cannot wait for that lock
+        carts.update(version=F('version'))
+
+
+def touch_cart(cart, quantity=None, amount=None):
+    """
+    Record a change to the cart's lines: new updated_at, next version and
+    new totals. Pass the change in item count and amount when it is
+    known; otherwise the totals are recomputed from the lines.
+    """
+    carts = Cart.objects.filter(pk=cart.pk)
+    fields = {'updated_at': timezone.now(), 'version': F('version') + 1}
+    if quantity is None:
+        carts.refresh_totals(**fields)
+    else:
+        carts.update(
+            item_count=F('item_count') + quantity,
+            total_amount=F('total_amount') + amount,
+            **fields
+        )
+
+
+def add_items(cart, lines, touch=True):
+    """
+    Add quantities to `cart`. `lines` is an iterable of
+    (product_id, quantity) pairs; repeated products are summed.
+    With touch=False the caller touches the cart itself.
+    """
+    totals = Counter()
+    for product_id, quantity in lines:
+        totals[int(product_id)] += quantity
+    if not totals:
+        return
+
+    with transaction.atomic(), bulk_change():
+        lock_cart(cart)
+        if connection.features.supports_update_conflicts_with_target:
+            _upsert(cart, list(totals.items()))
+            if touch:
+                prices = dict(Product.objects.filter(pk__in=totals).values_list('pk', 'price'))
+                touch_cart(
+                    cart,
+                    quantity=sum(totals.values()),
+                    amount=sum(prices[product_id] * quantity for product_id, quantity in totals.items()),
+                )
+        else:
+            for product_id, quantity in totals.items():
+                _increment(cart, product_id, quantity)
+            if touch:
+                touch_cart(cart)
+
+
+def _upsert(cart, lines):
+    quote = connection.ops.quote_name
+    column = {
+        name: quote(CartItem._meta.get_field(name).column)
+        for name in ('cart', 'product', 'quantity', 'created_at', 'updated_at')
+    }
+    table = quote(CartItem._meta.db_table)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(lines), UPSERT_BATCH_SIZE):
+            batch = lines[start:start + UPSERT_BATCH_SIZE]
+            cursor.execute(
+                'INSERT INTO {table} ({columns}) VALUES {rows} '
+                'ON CONFLICT ({cart}, {product}) DO UPDATE SET '
+                '{quantity} = {table}.{quantity} + excluded.{quantity}, '
+                '{updated_at} = excluded.{updated_at}'.format(
+                    table=table,
+                    columns=', '.join(column.values()),
+                    rows=', '.join(['(%s, %s, %s, %s, %s)'] * len(batch)),
+                    **column,
+                ),
+                [
+                    value
+                    for product_id, quantity in batch
+                    for value in (cart.pk, product_id, quantity, now, now)
+                ],
+            )
+
+
+def _increment(cart, product_id, quantity):
+    items = CartItem.objects.filter(cart=cart, product_id=product_id)
+    if items.update(quantity=F('quantity') + quantity, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product_id=product_id, quantity=quantity)
+    except IntegrityError:
+        # Another request created the line between our UPDATE and INSERT
+        items.update(quantity=F('quantity') + quantity, updated_at=timezone.now())
+
+
+def set_quantity(cart, item_id, quantity):
+    """
+    Set the quantity of one line, removing it when `quantity` is 0.
+    Returns False when the line is not in this cart.
+    """
+    if quantity == 0:
+        return remove_item(cart, item_id)
+    with transaction.atomic():
+        lock_cart(cart)
+        items = CartItem.objects.filter(pk=item_id, cart=cart)
+        if not items.update(quantity=quantity, updated_at=timezone.now()):
+            return False
+        touch_cart(cart)
+    return True
+
+
+def remove_item(cart, item_id):
+    """Remove one line. Returns False when it is not in this cart."""
+    with transaction.atomic():
+        lock_cart(cart)
+        deleted = _delete_lines(CartItem.objects.filter(pk=item_id, cart=cart))
+        if deleted:
+            touch_cart(cart)
+    return bool(deleted)
+
+
+def _delete_lines(items):
+    # A raw DELETE skips post_delete (signals.cart_item_changed), which
+    # would refresh the totals and bump the version once per line
+    return items._raw_delete(items.db)
+
+
+def set_items(cart, lines, touch=True):
+    """Set absolute quantities for (product_id, quantity) pairs, creating lines as needed"""
+    lines = dict(lines)
+    if not lines:
+        return
+    with transaction.atomic(), bulk_change():
+        lock_cart(cart)
+        _set_quantities([
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in lines.items()
+        ])
+        if touch:
+            touch_cart(cart)
+
+
+def _set_quantities(items):
+    """Upsert unsaved CartItems by (cart, product), overwriting their quantity"""
+    if connection.features.supports_update_conflicts_with_target:
+        CartItem.objects.bulk_create(
+            items,
+            update_conflicts=True,
+            unique_fields=['cart', 'product'],
+            update_fields=['quantity', 'updated_at'],
+            batch_size=UPSERT_BATCH_SIZE,
+        )
+    else:
+        for item in items:
+            CartItem.objects.update_or_create(
+                cart_id=item.cart_id, product_id=item.product_id, defaults={'quantity': item.quantity}
+            )
+
+
+def remove_products(cart, product_ids, touch=True):
+    """
+    Remove the lines for `product_ids`; products not in the cart are
+    ignored. Returns the number of lines removed.
+    """
+    if not product_ids:
+        return 0
+    with transaction.atomic():
+        lock_cart(cart)
+        deleted = _delete_lines(CartItem.objects.filter(cart=cart, product_id__in=product_ids))
+        if deleted and touch:
+            touch_cart(cart)
+    return deleted
+
+
+def apply_operations(cart, operations):
+    """
+    Apply a list of {'op', 'product_id', 'quantity'} operations in order,
+    as one transaction. Operations on the same product are folded first,
+    so the whole batch costs one upsert per kind of change and a single
+    touch of the cart (one version bump, one recompute of the totals):
+
+    - add: increase the quantity (creating the line)
+    - set: replace the quantity; 0 removes the line
+    - remove: remove the line
+    """
+    changes = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        kind, quantity = changes.get(product_id, ('add', 0))
+        if operation['op'] == 'add':
+            changes[product_id] = (kind, quantity + operation['quantity'])
+        elif operation['op'] == 'set':
+            changes[product_id] = ('set', operation['quantity'])
+        else:
+            changes[product_id] = ('set', 0)
+
+    with transaction.atomic():
+        add_items(cart, [
+            (product_id, quantity)
+            for product_id, (kind, quantity) in changes.items()
+            if kind == 'add' and quantity
+        ], touch=False)
+        set_items(cart, [
+            (product_id, quantity)
+            for product_id, (kind, quantity) in changes.items()
+            if kind == 'set' and quantity
+        ], touch=False)
+        remove_products(cart, [
+            product_id
+            for product_id, (kind, quantity) in changes.items()
+            if kind == 'set' and not quantity
+        ], touch=False)
+        if changes:
+            touch_cart(cart)
+
+
+def save_snapshots(snapshots):
+    """
+    Persist whole carts in one transaction. `snapshots` maps session
+    keys to {'version', 'updated_at', 'lines': {product_id: (quantity, added)}}
+    as kept by cart_storage.CacheCartStore. Missing carts are created,
+    lines not in a snapshot are deleted and the rest are upserted;
+    lines for products that no longer exist are skipped.
+    """
+    if not snapshots:
+        return
+    with transaction.atomic(), bulk_change():
+        Cart.objects.bulk_create(
+            [Cart(session_key=session_key) for session_key in snapshots],
+            ignore_conflicts=True,
+        )
+        carts = Cart.objects.in_bulk(list(snapshots), field_name='session_key')
+
+        wanted = {
+            carts[session_key].pk: snapshot['lines']
+            for session_key, snapshot in snapshots.items()
+        }
+        products = set(Product.objects.filter(
+            pk__in={product_id for lines in wanted.values() for product_id in lines}
+        ).values_list('pk', flat=True))
+
+        stale = [
+            pk
+            for pk, cart_id, product_id in CartItem.objects.filter(
+                cart_id__in=wanted
+            ).values_list('pk', 'cart_id', 'product_id')
+            if product_id not in wanted[cart_id]
+        ]
+        if stale:
+            _delete_lines(CartItem.objects.filter(pk__in=stale))
+
+        _set_quantities([
+            CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            for cart_id, lines in wanted.items()
+            for product_id, (quantity, added) in lines.items()
+            if product_id in products
+        ])
+
+        # Written last, so the snapshot's version is the one stored
+        for session_key, cart in carts.items():
+            cart.version = snapshots[session_key]['version']
+            cart.updated_at = snapshots[session_key]['updated_at']
+        Cart.objects.bulk_update(carts.values(), ['version', 'updated_at'])
+        Cart.objects.filter(pk__in=wanted).refresh_totals()
+
+
+def load_snapshot(session_key):
+    """Read a stored cart as a snapshot (see save_snapshots), or None"""
+    cart = Cart.objects.filter(session_key=session_key).first()
+    if cart is None:
+        return None
+    return {
+        'id': cart.pk,
+        'version': cart.version,
+        'created_at': cart.created_at,
+        'updated_at': cart.updated_at,
+        'lines': {
+            product_id: (quantity, added)
+            for product_id, quantity, added in cart.items.values_list('product_id', 'quantity', 'created_at')
+        },
+    }
+
+
+def reprice_carts(product_ids):
+    """
+    Recompute the totals of every cart holding one of `product_ids`,
+    after their prices changed. Returns the number of carts updated.
+    """
+    return Cart.objects.filter(items__product_id__in=product_ids).refresh_totals()
+
+
+def prices_changed(product_ids):
+    """
+    Apply CART_PRICE_CHANGE_POLICY after the prices of `product_ids`
+    changed: 'reprice' (default) recomputes the totals of the carts
+    holding them straight away, 'reconcile' leaves them to the
+    reconcile_carts command. Returns the number of carts repriced.
+    """
+    if not product_ids or getattr(settings, 'CART_PRICE_CHANGE_POLICY', 'reprice') != 'reprice':
+        return 0
+    return reprice_carts(product_ids)
@@ -0,0 +1,126 @@
+"""
+Conditional GET support (ETag / Last-Modified) for the public API.
+
+Validators are derived from MAX(updated_at) and COUNT(*) of the tables a
+response is built from. The aggregates are cached until the homepage
+generation moves (it is bumped on every catalog change), and for at most
+CATALOG_STATE_TIMEOUT seconds, so changes made by other processes are
+picked up even when the cache is not shared. A typical request computes
+its validators without touching the database. When the client already
+holds the current representation the view answers 304 before anything
+is serialized.
+
+Responses carrying validators are sent with Cache-Control: no-cache, so
+browsers revalidate them every time instead of caching them
+heuristically from Last-Modified.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .cache import HOME_GENERATION_KEY, get_generation
+from .models import Category, Product
+
+
+CATALOG_STATE_TIMEOUT = getattr(settings, 'CATALOG_STATE_TIMEOUT', 10)
+
+
+def table_state(queryset):
+    """Return (row count, latest updated_at) for a queryset"""
+    state = queryset.aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+    return state['count'], state['last_modified']
+
+
+def cached_table_state(model):
+    """
+    Return `table_state()` for a whole catalog table, reusing the cached
+    value until the catalog changes. The short timeout bounds how long a
+    process keeps the old state after a change it was not told about
+    (another worker or a management command on a per-process cache).
+    """
+    key = 'api:state:{}:{}'.format(get_generation(HOME_GENERATION_KEY), model._meta.label_lower)
+    state = cache.get(key)
+    if state is None:
+        state = table_state(model.objects.all())
+        cache.set(key, state, CATALOG_STATE_TIMEOUT)
+    return state
+
+
+def build_validators(request, states):
+    """
+    Turn a list of table states into a strong ETag and a Last-Modified
+    timestamp. The negotiated format is part of the ETag because JSON
+    and the browsable API share a URL.
+    """
+    fingerprint = [request.accepted_renderer.format]
+    last_modified = None
+    for count, modified in states:
+        fingerprint.append('{}:{}'.format(count, modified.isoformat() if modified else ''))
+        if modified and (last_modified is None or modified > last_modified):
+            last_modified = modified
+
+    etag = '"{}"'.format(hashlib.md5('|'.join(fingerprint).encode('utf-8')).hexdigest())
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return etag, timestamp
+
+
+def set_validators(response, etag, last_modified):
+    """Add the ETag and Last-Modified headers, and require revalidation"""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+class NotModified(Exception):
+    """Raised from `initial()` to short-circuit the handler with a 304"""
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag and Last-Modified headers to GET responses and answers
+    matching If-None-Match / If-Modified-Since requests with 304.
+
+    The check runs in `initial()`, before the handler, so it also covers
+    views that implement `get()` themselves. Views list the catalog
+    models their response depends on in `validator_models`, or override
+    `get_validator_states()`.
+    """
+    validator_models = ()
+    validators = None
+
+    def get_validator_states(self, request):
+        return [cached_table_state(model) for model in self.validator_models]
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        self.validators = build_validators(request, self.get_validator_states(request))
+        etag, last_modified = self.validators
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.validators is not None and response.status_code in (200, 304):
+            set_validators(response, *self.validators)
+        return response
+
+
+# Product responses embed category name and slug
+PRODUCT_VALIDATORS = (Product, Category)
@@ -0,0 +1,164 @@
+"""
+Streaming catalog export.
+
+Products are read with .iterator(chunk_size=...), so only one chunk of
+rows is in memory at a time (a server-side cursor on PostgreSQL), and
+written out as they are read. The output is grouped into blocks of
+about EXPORT_BUFFER_SIZE bytes and can be gzipped on the fly, so memory
+use stays flat whatever the size of the catalog.
+
+Formats:
+
+- csv: every product, with the columns the importer reads (see
+  api/importer.py), plus timestamps
+- ndjson: the same, one JSON object per line
+- merchant: active products as a tab-separated Google Merchant Center
+  feed, linking to the store's category pages. The feed has no quoting:
+  runs of whitespace in every column, tabs and newlines included, are
+  collapsed to one space, and a separator that got through anyway
+  stops the export with csv.Error rather than shifting columns.
+"""
+import csv
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .images import image_url
+from .models import Product
+
+
+EXPORT_COLUMNS = (
+    'id', 'name', 'company', 'category', 'price', 'description',
+    'is_featured', 'is_bestseller', 'is_active', 'created_at', 'updated_at',
+)
+MERCHANT_COLUMNS = (
+    'id', 'title', 'description', 'link', 'image_link', 'availability',
+    'price', 'brand', 'condition', 'product_type',
+)
+# format: (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'merchant': ('text/tab-separated-values', 'tsv'),
+}
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+
+
+class Echo:
+    """File-like object whose write() returns what it was given, for csv.writer"""
+    def write(self, value):
+        return value
+
+
+class CatalogExport:
+    """
+    Iterable of the encoded export, in blocks of bytes. Counts the
+    products written in `rows`.
+
+    `build_url(url)` makes image URLs absolute (e.g.
+    request.build_absolute_uri); by default they are left as storage
+    returns them.
+    """
+    def __init__(self, format, build_url=None, compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+        if format not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format: {}'.format(format))
+        self.format = format
+        self.build_url = build_url
+        self.compress = compress
+        self.chunk_size = chunk_size
+        self.rows = 0
+
+    @property
+    def content_type(self):
+        return EXPORT_FORMATS[self.format][0]
+
+    def filename(self, stem):
+        return '{}.{}'.format(stem, EXPORT_FORMATS[self.format][1])
+
+    def __iter__(self):
+        blocks = self.blocks()
+        return self.gzip(blocks) if self.compress else blocks
+
+    def queryset(self):
+        products = Product.objects.select_related('category').order_by('pk')
+        if self.format == 'merchant':
+            return products.filter(is_active=True).only(
+                'name', 'company', 'price', 'description', 'thumbnail', 'image_1',
+                'category__name', 'category__slug',
+            )
+        return products.only(*(column for column in EXPORT_COLUMNS if column != 'category'), 'category__slug')
+
+    def lines(self):
+        """The export as a sequence of text lines"""
+        products = self.queryset().iterator(chunk_size=self.chunk_size)
+
+        if self.format == 'ndjson':
+            for product in products:
+                self.rows += 1
+                yield json.dumps(dict(zip(EXPORT_COLUMNS, self.row(product))), cls=DjangoJSONEncoder) + '\n'
+            return
+
+        if self.format == 'merchant':
+            writer = csv.writer(
+                Echo(), delimiter='\t', lineterminator='\n', quoting=csv.QUOTE_NONE, quotechar=None
+            )
+            yield writer.writerow(MERCHANT_COLUMNS)
+            row = self.merchant_row
+        else:
+            writer = csv.writer(Echo(), lineterminator='\n')
+            yield writer.writerow(EXPORT_COLUMNS)
+            row = self.row
+        for product in products:
+            self.rows += 1
+            yield writer.writerow(row(product))
+
+    def row(self, product):
+        return (
+            product.pk, product.name, product.company, product.category.slug,
+            product.price, product.description or '', product.is_featured,
+            product.is_bestseller, product.is_active,
+            product.created_at.isoformat(), product.updated_at.isoformat(),
+        )
+
+    def merchant_row(self, product):
+        image = image_url(product.thumbnail or product.image_1)
+        if image and self.build_url:
+            image = self.build_url(image)
+        row = (
+            product.pk,
+            product.name,
+            product.description or product.name,
+            '{}/products/{}'.format(settings.STORE_URL.rstrip('/'), product.category.slug),
+            image or '',
+            'in_stock',
+            '{} {}'.format(product.price, settings.STORE_CURRENCY),
+            product.company,
+            'new',
+            product.category.name,
+        )
+        # Tabs and newlines would break the feed's rows
+        return tuple(' '.join(str(value).split()) for value in row)
+
+    def blocks(self):
+        """Encoded lines, joined into blocks of about EXPORT_BUFFER_SIZE bytes"""
+        buffer, size = [], 0
+        for line in self.lines():
+            data = line.encode('utf-8')
+            buffer.append(data)
+            size += len(data)
+            if size >= EXPORT_BUFFER_SIZE:
+                yield b''.join(buffer)
+                buffer, size = [], 0
+        if buffer:
+            yield b''.join(buffer)
+
+    def gzip(self, blocks):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for block in blocks:
+            data = compressor.compress(block)
+            if data:
+                yield data
+        yield compressor.flush()
@@ -0,0 +1,147 @@
+"""
+Image URL resolution shared by every serializer.
+
+Building an image URL means a storage.url() call (with Cloudinary, a
+signed URL is built) followed by request.build_absolute_uri(). Results
+are kept in a bounded per-process LRU keyed by (stored file name,
+storage, scheme and host). Django never reuses a name for different
+content unless a file is deleted and uploaded again, and the handlers in
+api/signals.py evict the names a save replaces or a delete removes.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import models
+
+from .cache import get_stat, increment_stat, reset_stats
+
+
+IMAGE_URL_CACHE_SIZE = getattr(settings, 'IMAGE_URL_CACHE_SIZE', 10000)
+
+# Local counters are published to the shared cache in batches, so the
+# stats cover every worker without a cache write per lookup
+STATS_FLUSH_EVERY = 1000
+
+
+class ImageURLResolver:
+    """
+    Thread-safe LRU of absolute image URLs with hit/miss counters
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending_hits = 0
+        self._pending_misses = 0
+
+    def resolve(self, name, request=None, storage=default_storage):
+        if not name:
+            return None
+
+        key = (name, storage, request_origin(request))
+        with self._lock:
+            url = self._entries.get(key)
+            if url is not None:
+                self._entries.move_to_end(key)
+                self._pending_hits += 1
+                self._maybe_flush()
+                return url
+
+        url = storage.url(name)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+
+        with self._lock:
+            self._entries[key] = url
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            self._pending_misses += 1
+            self._maybe_flush()
+        return url
+
+    def invalidate(self, *names):
+        """Evict every cached URL for the given stored names"""
+        names = {name for name in names if name}
+        if not names:
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in names]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _maybe_flush(self):
+        if self._pending_hits + self._pending_misses >= STATS_FLUSH_EVERY:
+            self.flush_stats()
+
+    def flush_stats(self):
+        hits, misses = self._pending_hits, self._pending_misses
+        self._pending_hits = self._pending_misses = 0
+        if hits:
+            increment_stat('image_urls:hits', hits)
+        if misses:
+            increment_stat('image_urls:misses', misses)
+
+    def stats(self):
+        """Hit/miss counters across all workers, plus this process's LRU size"""
+        with self._lock:
+            self.flush_stats()
+            size = len(self._entries)
+        hits = get_stat('image_urls:hits')
+        misses = get_stat('image_urls:misses')
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else 0.0,
+            'size': size,
+            'maxsize': self.maxsize,
+        }
+
+    def reset_stats(self):
+        with self._lock:
+            self._pending_hits = self._pending_misses = 0
+        reset_stats('image_urls:hits', 'image_urls:misses')
+
+
+image_urls = ImageURLResolver(IMAGE_URL_CACHE_SIZE)
+
+
+def request_origin(request):
+    """Scheme and host of `request`, worked out once per request"""
+    if request is None:
+        return ''
+    try:
+        return request.image_url_origin
+    except AttributeError:
+        origin = '{}://{}'.format(request.scheme, request.get_host())
+        request.image_url_origin = origin
+        return origin
+
+
+def image_url(image, request=None):
+    """
+    Return the URL for an ImageField value, absolute when a request is
+    given, or None when no file is set
+    """
+    if not image:
+        return None
+    return image_urls.resolve(image.name, request, image.storage)
+
+
+def image_fields(model):
+    """Names of the file fields of `model`"""
+    return [field.attname for field in model._meta.concrete_fields if isinstance(field, models.FileField)]
+
+
+def image_field_names(instance):
+    """Stored names of every image on a model instance"""
+    return [
+        getattr(instance, attname).name
+        for attname in image_fields(type(instance))
+        if getattr(instance, attname)
+    ]
@@ -0,0 +1,302 @@
+"""
+Bulk product import from supplier price lists.
+
+Rows are read one at a time from a CSV (with a header row) or NDJSON
+file, so memory use does not depend on the file size, and applied in
+batches: one query finds the batch's existing products, then new rows
+are inserted with bulk_create and changed rows written with
+bulk_update, all in one transaction per batch.
+
+A row updates the product with its `id` column when it has one, and
+otherwise the product with the same name and company; rows that match
+nothing create a product. Columns:
+
+    id, name, company, category (slug), price, description,
+    is_featured, is_bestseller, is_active
+
+Empty cells leave the stored value alone, so a price list with only
+name, company and price columns just updates prices. New products need
+name, company, category and price.
+
+bulk_create and bulk_update skip Product.save() and its signals, so each
+batch invalidates the catalog caches and applies the cart price-change
+policy itself once it commits.
+
+Invalidation goes through the cache, so an import run from the
+import_products command only reaches the web workers when the cache is
+shared (CACHE_LOCATION). On the default per-process cache the workers
+keep serving the old catalog responses and homepage snapshot until they
+expire; the command warns when that is the case.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import invalidate_catalog_cache, invalidate_home_snapshot
+from .carts import prices_changed
+from .models import Category, Product
+from .parsers import text_stream
+
+
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+# Stored fields a row can set, in diff order
+IMPORT_FIELDS = ('name', 'company', 'category_id', 'price', 'description', 'is_featured', 'is_bestseller', 'is_active')
+CREATE_FIELDS = ('name', 'company', 'category_id', 'price')
+BOOLEAN_FIELDS = ('is_featured', 'is_bestseller', 'is_active')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+
+class RowError(ValueError):
+    """A row that cannot be imported; the import carries on without it"""
+
+
+def detect_format(filename):
+    """Return 'csv' or 'ndjson' from a file name's extension"""
+    for extension, format in FORMATS.items():
+        if filename.lower().endswith(extension):
+            return format
+    raise ValueError('Cannot tell the format of {}; expected one of {}'.format(
+        filename, ', '.join(FORMATS)
+    ))
+
+
+def read_rows(stream, format, encoding=None):
+    """
+    Yield (line number, row dict) for each record of a CSV or NDJSON byte
+    stream. Malformed NDJSON lines are yielded as RowError instances;
+    bytes that are not valid in `encoding` raise UnicodeDecodeError.
+    """
+    text = text_stream(stream, encoding)
+
+    if format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as exc:
+            yield line_number, RowError('Invalid JSON: {}'.format(exc))
+            continue
+        if not isinstance(row, dict):
+            row = RowError('Expected a JSON object')
+        yield line_number, row
+
+
+def clean_row(row, categories):
+    """
+    Convert a raw row to {field: value} for the non-empty columns it has.
+    `categories` maps category slugs to ids.
+    """
+    values = {}
+    for column, raw in row.items():
+        if column is None or raw is None:
+            continue
+        raw = raw.strip() if isinstance(raw, str) else raw
+        if raw == '':
+            continue
+        column = column.strip()
+        if column == 'id':
+            try:
+                values['id'] = int(raw)
+            except (TypeError, ValueError):
+                raise RowError('Invalid id: {!r}'.format(raw))
+        elif column in ('name', 'company', 'description'):
+            values[column] = str(raw)
+            max_length = Product._meta.get_field(column).max_length
+            if max_length and len(values[column]) > max_length:
+                raise RowError('{} longer than {} characters'.format(column.capitalize(), max_length))
+        elif column == 'category':
+            if raw not in categories:
+                raise RowError('Unknown category: {!r}'.format(raw))
+            values['category_id'] = categories[raw]
+        elif column == 'price':
+            values['price'] = clean_price(raw)
+        elif column in BOOLEAN_FIELDS:
+            values[column] = parse_boolean(column, raw)
+    return values
+
+
+def clean_price(raw):
+    """A price cell as a Decimal that fits Product.price"""
+    field = Product._meta.get_field('price')
+    limit = Decimal(10) ** (field.max_digits - field.decimal_places)
+    try:
+        price = Decimal(str(raw))
+        if not price.is_finite():
+            raise InvalidOperation
+        # Values far out of range cannot be quantized
+        if abs(price) < limit:
+            price = price.quantize(Decimal(1).scaleb(-field.decimal_places))
+    except InvalidOperation:
+        raise RowError('Invalid price: {!r}'.format(raw))
+    if price < 0:
+        raise RowError('Negative price: {}'.format(raw))
+    if price >= limit:
+        raise RowError('Price too large: {}'.format(raw))
+    return price
+
+
+def parse_boolean(column, raw):
+    if isinstance(raw, bool):
+        return raw
+    value = str(raw).lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RowError('Invalid {}: {!r}'.format(column, raw))
+
+
+def describe_change(line, action, product, changes):
+    """One diff line for an imported row"""
+    label = '{} - {}'.format(product.name, product.company)
+    if action == 'create':
+        return '+ line {}: {}'.format(line, label)
+    if action == 'unchanged':
+        return '= line {}: {}'.format(line, label)
+    return '~ line {}: {}: {}'.format(line, label, ', '.join(
+        '{} {} -> {}'.format(field, old, new) for field, (old, new) in changes.items()
+    ))
+
+
+class ProductImport:
+    """
+    Applies rows to the catalog `batch_size` at a time.
+
+    `on_row(line, action, product, changes)` is called for every row
+    that imports, with action 'create', 'update' or 'unchanged' and, for
+    updates, {field: (old, new)}. `on_error(line, message)` is called for
+    rows that do not. With `dry_run`, nothing is written.
+    """
+    def __init__(self, batch_size=500, dry_run=False, on_row=None, on_error=None, progress=None):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.on_row = on_row
+        self.on_error = on_error
+        self.progress = progress
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.category_slugs = {pk: slug for slug, pk in self.categories.items()}
+
+    def run(self, rows):
+        """Import (line, row) pairs; returns counts per action and the time taken"""
+        self.report = {'rows': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'errors': 0, 'repriced_carts': 0}
+        started = time.perf_counter()
+        batch = []
+        for line, row in rows:
+            self.report['rows'] += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append((line, clean_row(row, self.categories)))
+            except RowError as exc:
+                self.error(line, str(exc))
+            if len(batch) >= self.batch_size:
+                self.apply(batch)
+                batch = []
+                if self.progress:
+                    self.progress(self.report, time.perf_counter() - started)
+        if batch:
+            self.apply(batch)
+        self.report['seconds'] = time.perf_counter() - started
+        return self.report
+
+    def error(self, line, message):
+        self.report['errors'] += 1
+        if self.on_error:
+            self.on_error(line, message)
+
+    def apply(self, batch):
+        """Diff one batch against the database and write it"""
+        by_id, by_key = self.existing(batch)
+        creates, updates, changed_fields, repriced = [], {}, set(), []
+
+        for line, values in batch:
+            if 'id' in values:
+                product = by_id.get(values['id'])
+                if product is None:
+                    self.error(line, 'No product with id {}'.format(values['id']))
+                    continue
+            else:
+                if 'name' not in values or 'company' not in values:
+                    self.error(line, 'A row needs an id, or a name and a company')
+                    continue
+                product = by_key.get((values['name'], values['company']))
+
+            if product is None:
+                missing = [field.replace('_id', '') for field in CREATE_FIELDS if field not in values]
+                if missing:
+                    self.error(line, 'New products need {}'.format(', '.join(missing)))
+                    continue
+                product = Product(**values)
+                creates.append(product)
+                # Later rows for the same product in this batch update it
+                by_key[(product.name, product.company)] = product
+                self.record(line, 'create', product, {})
+                continue
+
+            changes = {
+                field: (getattr(product, field), values[field])
+                for field in IMPORT_FIELDS
+                if field in values and getattr(product, field) != values[field]
+            }
+            if not changes:
+                self.record(line, 'unchanged', product, {})
+                continue
+            for field, (old, new) in changes.items():
+                setattr(product, field, new)
+            if product.pk is not None:
+                updates[product.pk] = product
+                changed_fields.update(changes)
+                if 'price' in changes:
+                    repriced.append(product.pk)
+            self.record(line, 'update', product, changes)
+
+        if self.dry_run or not (creates or updates):
+            return
+        with transaction.atomic():
+            Product.objects.bulk_create(creates)
+            if updates:
+                now = timezone.now()
+                for product in updates.values():
+                    product.updated_at = now
+                Product.objects.bulk_update(updates.values(), sorted(changed_fields) + ['updated_at'])
+            self.report['repriced_carts'] += prices_changed(repriced)
+            transaction.on_commit(invalidate_catalog_cache)
+            transaction.on_commit(invalidate_home_snapshot)
+
+    def existing(self, batch):
+        """The batch's stored products, by id and by (name, company)"""
+        ids = {values['id'] for line, values in batch if 'id' in values}
+        keys = {
+            (values['name'], values['company'])
+            for line, values in batch
+            if 'id' not in values and 'name' in values and 'company' in values
+        }
+        query = Q(pk__in=ids)
+        if keys:
+            query |= Q(name__in={name for name, company in keys}, company__in={company for name, company in keys})
+        products = Product.objects.filter(query).only('pk', *IMPORT_FIELDS)
+        by_id, by_key = {}, {}
+        for product in products:
+            by_id[product.pk] = product
+            by_key.setdefault((product.name, product.company), product)
+        return by_id, by_key
+
+    def record(self, line, action, product, changes):
+        self.report[{'create': 'created', 'update': 'updated', 'unchanged': 'unchanged'}[action]] += 1
+        if self.on_row:
+            if 'category_id' in changes:
+                old, new = changes.pop('category_id')
+                changes['category'] = (self.category_slugs.get(old), self.category_slugs.get(new))
+            self.on_row(line, action, product, changes)
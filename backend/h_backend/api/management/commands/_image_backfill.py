@@ -0,0 +1,128 @@
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from api.cache import invalidate_catalog_cache, invalidate_home_snapshot
+from api.models import Category, Product, Slide, CompanyLogo
+
+
+MODELS = [Category, Product, Slide, CompanyLogo]
+# Rows read and written per query when storing the results
+BATCH_SIZE = 500
+
+
+def init_worker():
+    # Workers started with the spawn method begin with an unconfigured Django
+    django.setup()
+
+
+class ImageBackfillCommand(BaseCommand):
+    """
+    Base for commands that derive a JSON entry per stored image and keep
+    it on a model column. Subclasses set:
+
+    - column: the JSONField holding one entry per image field
+    - noun: what is being built, for messages
+    - stale(instance, force): image fields whose entry needs rebuilding
+    - build(name): build the entry for one stored image (runs in a
+      worker process, so it must be a module-level function)
+    - discard(entry): optional clean-up of an outdated entry
+    """
+    column = None
+    noun = None
+    discard = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate {} even when they are up to date'.format(self.noun),
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            help='Number of worker processes (default: one per CPU core)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        jobs = []
+        for model in MODELS:
+            fields = model.image_variant_fields
+            for instance in model.objects.only('pk', self.column, *fields).iterator():
+                for field_name in self.stale(instance, options['force']):
+                    jobs.append((model, instance.pk, field_name, getattr(instance, field_name).name))
+
+        if not jobs:
+            self.stdout.write('All image {} are up to date.'.format(self.noun))
+            return
+
+        self.stdout.write('Processing {} images with {} workers...'.format(len(jobs), options['workers']))
+
+        # Forked workers must not share the parent's database connections
+        connections.close_all()
+
+        # (model, pk) -> {field name: (image name, new entry)}
+        results = defaultdict(dict)
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+            futures = {
+                pool.submit(self.build, name): (model, pk, field_name, name)
+                for model, pk, field_name, name in jobs
+            }
+            for future in as_completed(futures):
+                model, pk, field_name, name = futures[future]
+                results[model, pk][field_name] = (name, future.result())
+
+        # Store the new entries, then clean up the ones they replace. The
+        # rows are read again in batches: they may have changed or gone
+        # while the images were processed. updated_at feeds the
+        # conditional GET validators, so it has to move for clients to
+        # fetch the new entries instead of getting 304s.
+        now = timezone.now()
+        updated, replaced, unused = 0, [], []
+        for model in MODELS:
+            pks = [pk for row_model, pk in results if row_model is model]
+            for start in range(0, len(pks), BATCH_SIZE):
+                rows = model.objects.only('pk', self.column, *model.image_variant_fields).filter(
+                    pk__in=pks[start:start + BATCH_SIZE]
+                )
+                changed = []
+                for instance in rows:
+                    value = dict(getattr(instance, self.column) or {})
+                    for field_name, (name, entry) in results.pop((model, instance.pk)).items():
+                        if getattr(instance, field_name).name != name:
+                            # Replaced meanwhile; its save scheduled a refresh
+                            unused.append(entry)
+                            continue
+                        replaced.append(value.pop(field_name, None))
+                        if entry is not None:
+                            value[field_name] = entry
+                    setattr(instance, self.column, value)
+                    instance.updated_at = now
+                    changed.append(instance)
+                model.objects.bulk_update(changed, [self.column, 'updated_at'])
+                updated += len(changed)
+
+        # Entries of rows deleted while this ran
+        unused.extend(entry for entries in results.values() for name, entry in entries.values())
+        if self.discard:
+            for entry in replaced + unused:
+                self.discard(entry)
+
+        # bulk_update() sends no signals, so invalidate the caches once here
+        invalidate_catalog_cache()
+        invalidate_home_snapshot()
+
+        self.stdout.write(self.style.SUCCESS(
+            'Updated {} rows ({} images) in {:.1f}s'.format(
+                updated, len(jobs), time.perf_counter() - started
+            )
+        ))
@@ -0,0 +1,254 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Q
+from django.test import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from api.cache import invalidate_catalog_cache
+from api.models import Category, Product
+from api.serializers import ProductCardSerializer, ProductListSerializer, ProductRowSerializer
+from api.search import search_products
+from api.views import ProductListView
+
+
+WORDS = [
+    'cement', 'pipe', 'pvc', 'ppr', 'elbow', 'tee', 'socket', 'valve', 'tap',
+    'mabati', 'sheet', 'gauge', 'roofing', 'nail', 'screw', 'bolt', 'paint',
+    'emulsion', 'gloss', 'primer', 'brush', 'roller', 'cable', 'switch',
+    'breaker', 'bulb', 'tile', 'adhesive', 'grout', 'sand', 'ballast', 'steel',
+    'rebar', 'mesh', 'wire', 'hinge', 'lock', 'padlock', 'tank', 'heater',
+]
+COMPANIES = ['Bamburi', 'Crown', 'Devki', 'Kenpoly', 'Dosho', 'MRM', 'Simba', 'Rhino', 'Tronic']
+SEARCH_TERMS = ['cement', 'pvc pipe', 'crown emulsion', 'gauge mabati sheet', 'pad']
+PAYLOAD_URLS = [
+    '/api/products/',
+    '/api/products/?omit=description',
+    '/api/products/?view=card',
+    '/api/products/?fields=id,name,price',
+]
+SESSION_URLS = ['/api/products/', '/api/products/?view=card', '/api/slides/', '/api/cart/']
+
+
+class Rollback(Exception):
+    """Raised to discard the benchmark catalog"""
+
+
+def seed_catalog(count, batch_size=5000):
+    """Create `count` products with generated names and descriptions"""
+    rng = random.Random(42)
+    category = Category.objects.create(name='Benchmark {}'.format(time.time()))
+    for start in range(0, count, batch_size):
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                name=' '.join(rng.sample(WORDS, 3)).title(),
+                company=rng.choice(COMPANIES),
+                price=rng.randint(50, 50000),
+                description=' '.join(rng.choices(WORDS, k=8)),
+                thumbnail='products/{}.png'.format(rng.randint(1, 500)),
+                image_1='products/{}.png'.format(rng.randint(1, 500)),
+                image_2='products/{}.png'.format(rng.randint(1, 500)),
+            )
+            for _ in range(start, min(start + batch_size, count))
+        ])
+    return category
+
+
+def timed(func, repeat):
+    """Return the median wall time of `func` in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def first_page(queryset):
+    """Mimic what the paginated list view evaluates: COUNT(*) and one page"""
+    def run():
+        queryset.count()
+        list(queryset[:16])
+    return run
+
+
+class Command(BaseCommand):
+    help = (
+        'Run performance benchmarks against a generated catalog. '
+        'Everything is created inside a transaction that is rolled back.'
+    )
+
+    scenarios = ['search', 'payload', 'serializer', 'sessions', 'throughput']
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=self.scenarios)
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument(
+            '--min-speedup',
+            type=float,
+            default=1.5,
+            help='serializer: fail unless the fast path is at least this many times faster',
+        )
+        parser.add_argument('--requests', type=int, default=2000, help='throughput: requests per run')
+
+    def handle(self, *args, **options):
+        handler = getattr(self, 'benchmark_{}'.format(options['scenario']))
+        try:
+            with transaction.atomic():
+                self.stdout.write('Seeding {} products...'.format(options['products']))
+                seed_catalog(options['products'])
+                handler(options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def benchmark_search(self, options):
+        """Compare icontains SearchFilter with the full-text backend"""
+        products = Product.objects.filter(is_active=True).select_related('category')
+        if search_products(products, 'probe') is None:
+            raise CommandError('No full-text index is available on this database.')
+
+        self.stdout.write('{:<22} {:>8} {:>14} {:>14}'.format('term', 'matches', 'icontains ms', 'full-text ms'))
+        for term in SEARCH_TERMS:
+            condition = Q()
+            for word in term.split():
+                condition &= (
+                    Q(name__icontains=word)
+                    | Q(company__icontains=word)
+                    | Q(description__icontains=word)
+                )
+            legacy = products.filter(condition)
+            indexed = search_products(products, term)
+
+            self.stdout.write('{:<22} {:>8} {:>14.1f} {:>14.1f}'.format(
+                term,
+                indexed.count(),
+                timed(first_page(legacy), options['repeat']),
+                timed(first_page(indexed), options['repeat']),
+            ))
+
+    def benchmark_payload(self, options):
+        """Compare response size and latency of a 16-item product page"""
+        client = Client(HTTP_HOST='localhost')
+
+        def fetch(url):
+            def run():
+                # Skip the response cache so every run serializes
+                invalidate_catalog_cache()
+                return client.get(url)
+            return run
+
+        self.stdout.write('{:<38} {:>8} {:>10}'.format('url', 'bytes', 'ms'))
+        for url in PAYLOAD_URLS:
+            response = fetch(url)()
+            if response.status_code != 200:
+                raise CommandError('{} returned {}'.format(url, response.status_code))
+            self.stdout.write('{:<38} {:>8} {:>10.2f}'.format(
+                url,
+                len(response.content),
+                timed(fetch(url), options['repeat']),
+            ))
+
+    def benchmark_serializer(self, options):
+        """
+        Guard the ProductRowSerializer fast path: its output must be
+        byte-identical to the DRF serializer, and it must stay at least
+        --min-speedup times faster
+        """
+        request = Request(RequestFactory().get('/api/products/', HTTP_HOST='localhost'))
+        queryset = Product.objects.select_related('category')
+        renderer = JSONRenderer()
+
+        self.stdout.write('{:<24} {:>12} {:>12} {:>9}'.format('serializer', 'drf ms', 'fast ms', 'speedup'))
+        failures = []
+        for serializer_class in (ProductListSerializer, ProductCardSerializer):
+            template = serializer_class(context={'request': request})
+            rows = ProductRowSerializer(template)
+            values = rows.values(queryset)
+
+            def drf():
+                return renderer.render(
+                    serializer_class(queryset, many=True, context={'request': request}).data
+                )
+
+            def fast():
+                return renderer.render(rows.serialize(values))
+
+            if drf() != fast():
+                raise CommandError('{} fast path output differs'.format(serializer_class.__name__))
+
+            drf_ms = timed(drf, options['repeat'])
+            fast_ms = timed(fast, options['repeat'])
+            speedup = drf_ms / fast_ms
+            self.stdout.write('{:<24} {:>12.1f} {:>12.1f} {:>8.1f}x'.format(
+                serializer_class.__name__, drf_ms, fast_ms, speedup
+            ))
+            if speedup < options['min_speedup']:
+                failures.append(serializer_class.__name__)
+
+        if failures:
+            raise CommandError('Fast path below {}x for: {}'.format(
+                options['min_speedup'], ', '.join(failures)
+            ))
+
+    def benchmark_sessions(self, options):
+        """
+        Guard session writes: once a cart session exists, browsing the
+        catalog and reading the cart must not write django_session again
+        within SESSION_REFRESH_INTERVAL
+        """
+        client = Client(HTTP_HOST='localhost')
+        client.post('/api/cart/batch/', [], content_type='application/json')
+
+        self.stdout.write('{:<28} {:>9} {:>15}'.format('url', 'requests', 'session writes'))
+        failures = []
+        for url in SESSION_URLS:
+            with CaptureQueriesContext(connection) as queries:
+                for _ in range(options['repeat']):
+                    client.get(url)
+            writes = [
+                query for query in queries
+                if 'django_session' in query['sql']
+                and query['sql'].lstrip().split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE')
+            ]
+            self.stdout.write('{:<28} {:>9} {:>15}'.format(url, options['repeat'], len(writes)))
+            if writes:
+                failures.append(url)
+
+        if failures:
+            raise CommandError('Session written by: {}'.format(', '.join(failures)))
+
+    def benchmark_throughput(self, options):
+        """
+        Requests per second for GET /api/products/ (cached page) from a
+        visitor with a session cookie, with the default authentication
+        classes and with the lean catalog configuration
+        """
+        client = Client(HTTP_HOST='localhost')
+        client.post('/api/cart/batch/', [], content_type='application/json')
+        lean = ProductListView.authentication_classes
+        runs = [('full', api_settings.DEFAULT_AUTHENTICATION_CLASSES), ('lean', lean)]
+
+        self.stdout.write('{:<6} {:>10} {:>14}'.format('path', 'req/s', 'queries/req'))
+        try:
+            for name, authentication_classes in runs:
+                ProductListView.authentication_classes = authentication_classes
+                client.get('/api/products/')
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    for _ in range(options['requests']):
+                        client.get('/api/products/')
+                    elapsed = time.perf_counter() - started
+                self.stdout.write('{:<6} {:>10.0f} {:>14.2f}'.format(
+                    name, options['requests'] / elapsed, len(queries) / options['requests']
+                ))
+        finally:
+            ProductListView.authentication_classes = lean
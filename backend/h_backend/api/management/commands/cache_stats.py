@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import cache_is_shared, collect_stats, reset_stats
+from api.images import image_urls
+
+
+class Command(BaseCommand):
+    help = (
+        'Show hit/miss counters for the catalog response cache and image URL '
+        'resolver, and the writes saved by lazy cart creation. The counters '
+        'of the web workers are only visible here with a shared cache '
+        '(CACHE_LOCATION); otherwise use GET /api/cache-stats/ on a worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the counters after printing them',
+        )
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                'The cache is local to this process, so these counters do not include '
+                'the web workers. Set CACHE_LOCATION, or use GET /api/cache-stats/.'
+            ))
+
+        stats = collect_stats()
+        self.stdout.write(
+            'Catalog responses: {hits} hits, {misses} misses ({rate:.1%} hit rate)'.format(
+                hits=stats['catalog']['hits'],
+                misses=stats['catalog']['misses'],
+                rate=stats['catalog']['hit_rate'],
+            )
+        )
+
+        self.stdout.write(
+            'Image URLs: {hits} hits, {misses} misses ({rate:.1%} hit rate)'.format(
+                hits=stats['image_urls']['hits'],
+                misses=stats['image_urls']['misses'],
+                rate=stats['image_urls']['hit_rate'],
+            )
+        )
+
+        self.stdout.write(
+            'Carts: {reads} reads served without a cart, {writes} session/cart rows not created'.format(
+                reads=stats['carts']['virtual_reads'],
+                writes=stats['carts']['writes_avoided'],
+            )
+        )
+
+        if options['reset']:
+            reset_stats('catalog:hits', 'catalog:misses', 'cart:virtual_reads', 'cart:writes_avoided')
+            image_urls.reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
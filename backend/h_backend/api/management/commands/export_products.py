@@ -0,0 +1,64 @@
+import sys
+import time
+from urllib.parse import urljoin
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.exporter import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, CatalogExport
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the catalog as CSV, NDJSON or a Google Merchant feed, streaming '
+        'rows as they are read so memory stays flat.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument(
+            '--output',
+            default='-',
+            help='File to write (default: stdout). A name ending in .gz is gzipped.',
+        )
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help='Products fetched per database round trip (default: {})'.format(EXPORT_CHUNK_SIZE),
+        )
+        parser.add_argument(
+            '--base-url',
+            help='Make image links absolute against this URL, e.g. https://api.example.com',
+        )
+
+    def handle(self, *args, **options):
+        path = options['output']
+        base_url = options['base_url']
+        export = CatalogExport(
+            options['format'],
+            build_url=(lambda url: urljoin(base_url, url)) if base_url else None,
+            compress=options['gzip'] or path.endswith('.gz'),
+            chunk_size=options['chunk_size'],
+        )
+
+        started = time.perf_counter()
+        try:
+            if path == '-':
+                self.write(export, sys.stdout.buffer)
+            else:
+                with open(path, 'wb') as stream:
+                    self.write(export, stream)
+        except OSError as exc:
+            raise CommandError(exc)
+        elapsed = time.perf_counter() - started
+
+        # stdout may be the export itself
+        self.stderr.write(self.style.SUCCESS('Exported {} products in {:.1f}s ({:.0f} rows/s)'.format(
+            export.rows, elapsed, export.rows / elapsed if elapsed else 0
+        )))
+
+    def write(self, export, stream):
+        for block in export:
+            stream.write(block)
+        stream.flush()
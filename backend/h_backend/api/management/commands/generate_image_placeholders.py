@@ -0,0 +1,12 @@
+from api.variants import build_placeholder, stale_placeholder_fields
+
+from ._image_backfill import ImageBackfillCommand
+
+
+class Command(ImageBackfillCommand):
+    help = 'Record intrinsic sizes and low-quality placeholders for existing media, using every CPU core'
+
+    column = 'image_placeholders'
+    noun = 'placeholders'
+    stale = staticmethod(stale_placeholder_fields)
+    build = staticmethod(build_placeholder)
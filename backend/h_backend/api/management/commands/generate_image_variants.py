@@ -0,0 +1,13 @@
+from api.variants import build_variants, delete_variants, stale_fields
+
+from ._image_backfill import ImageBackfillCommand
+
+
+class Command(ImageBackfillCommand):
+    help = 'Create missing responsive image variants for existing media, using every CPU core'
+
+    column = 'image_variants'
+    noun = 'variants'
+    stale = staticmethod(stale_fields)
+    build = staticmethod(build_variants)
+    discard = staticmethod(delete_variants)
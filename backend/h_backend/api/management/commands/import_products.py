@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.cache import UNSHARED_CACHE_WARNING, cache_is_shared
+from api.importer import FORMATS, ProductImport, describe_change, detect_format, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Create and update products from a supplier price list (CSV with a '
+        'header row, or NDJSON). Rows match products by id, or by name and '
+        'company; categories are given by slug.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Price list to import')
+        parser.add_argument(
+            '--format',
+            choices=sorted(set(FORMATS.values())),
+            help='File format (default: from the extension)',
+        )
+        parser.add_argument('--encoding', default=None, help='Text encoding (default: DEFAULT_CHARSET)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows written per transaction (default: 500)')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show the rows that would be created or updated, without writing',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            format = options['format'] or detect_format(options['path'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        verbosity = options['verbosity']
+        dry_run = options['dry_run']
+        if not dry_run and not cache_is_shared():
+            self.stderr.write(self.style.WARNING(UNSHARED_CACHE_WARNING))
+
+        def on_row(line, action, product, changes):
+            if (dry_run and action != 'unchanged') or verbosity > 1:
+                self.stdout.write(describe_change(line, action, product, changes))
+
+        def on_error(line, message):
+            self.stderr.write('! line {}: {}'.format(line, message))
+
+        def progress(report, elapsed):
+            self.stdout.write('{:>9} rows {:>9.0f} rows/s'.format(
+                report['rows'], report['rows'] / elapsed if elapsed else 0
+            ))
+
+        importer = ProductImport(
+            batch_size=options['batch_size'],
+            dry_run=dry_run,
+            on_row=on_row,
+            on_error=on_error,
+            progress=progress if verbosity > 1 else None,
+        )
+        try:
+            with open(options['path'], 'rb') as stream:
+                report = importer.run(read_rows(stream, format, options['encoding']))
+        except OSError as exc:
+            raise CommandError(exc)
+        except (LookupError, UnicodeDecodeError) as exc:
+            raise CommandError('Cannot decode {}: {}. Pass --encoding for files in another encoding{}.'.format(
+                options['path'], exc, '' if dry_run else '; batches before the error were imported'
+            ))
+
+        summary = (
+            '{verb} {created} products, {updated_verb} {updated}, {unchanged} unchanged, '
+            '{errors} rows skipped; {rows} rows in {seconds:.1f}s ({rate:.0f} rows/s)'
+        ).format(
+            verb='Would create' if dry_run else 'Created',
+            updated_verb='would update' if dry_run else 'updated',
+            rate=report['rows'] / report['seconds'] if report['seconds'] else 0,
+            **report
+        )
+        if report['repriced_carts']:
+            summary += '; repriced {} carts'.format(report['repriced_carts'])
+        self.stdout.write(self.style.SUCCESS(summary) if not report['errors'] else self.style.WARNING(summary))
@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.purge import abandoned_carts, expired_sessions, purge
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired sessions and abandoned carts in small batches. '
+        'Safe to interrupt; the next run continues where this one stopped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=getattr(settings, 'CART_RETENTION_DAYS', 30),
+            help='Delete carts unchanged for this many days (default: CART_RETENTION_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=getattr(settings, 'PURGE_BATCH_SIZE', 1000),
+            help='Rows deleted per transaction (default: PURGE_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=getattr(settings, 'PURGE_PAUSE', 0.1),
+            help='Seconds to sleep between batches (default: PURGE_PAUSE)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            now = timezone.now()
+            self.stdout.write('{} expired sessions, {} abandoned carts'.format(
+                expired_sessions(now).count(),
+                abandoned_carts(options['days'], now).count(),
+            ))
+            return
+
+        def progress(kind, deleted, elapsed):
+            self.stdout.write('{:>10} {:>9} deleted {:>9.0f} rows/s'.format(
+                kind, deleted, deleted / elapsed if elapsed else 0
+            ))
+
+        report = purge(
+            days=options['days'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            progress=progress if options['verbosity'] > 1 else None,
+        )
+        rows = report['sessions'] + report['carts'] + report['items']
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted {sessions} sessions, {carts} carts and {items} cart items '
+            'in {seconds:.1f}s ({rate:.0f} rows/s)'.format(
+                rate=rows / report['seconds'] if report['seconds'] else 0,
+                **report
+            )
+        ))
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Find carts whose stored item_count/total_amount disagree with their lines, and repair them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report drifted carts',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Carts repaired per UPDATE (default: 1000)',
+        )
+        parser.add_argument(
+            '--verbose-carts',
+            action='store_true',
+            help='List every drifted cart with its stored and actual totals',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        drifted = Cart.objects.with_drift().order_by('pk')
+
+        if options['verbose_carts']:
+            for cart in drifted.only('pk', 'session_key', 'item_count', 'total_amount'):
+                self.stdout.write('Cart {}: {} items / {} stored, {} items / {} from lines'.format(
+                    cart.pk, cart.item_count, cart.total_amount,
+                    cart.line_item_count, cart.line_total_amount,
+                ))
+
+        ids = list(drifted.values_list('pk', flat=True))
+        if not ids:
+            self.stdout.write('All cart totals match their lines.')
+            return
+        if options['dry_run']:
+            self.stdout.write('{} carts have drifted totals.'.format(len(ids)))
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(ids), batch_size):
+            Cart.objects.filter(pk__in=ids[start:start + batch_size]).refresh_totals()
+
+        self.stdout.write(self.style.SUCCESS('Repaired {} carts in {:.1f}s'.format(
+            len(ids), time.perf_counter() - started
+        )))
@@ -0,0 +1,49 @@
+"""
+Middleware for the API.
+"""
+import time
+
+from django.conf import settings
+
+
+# Session key holding when the session's expiry was last pushed back
+REFRESHED_KEY = '_refreshed_at'
+
+
+class SessionRefreshMiddleware:
+    """
+    Keep cart sessions alive without writing the session on every request.
+
+    With SESSION_SAVE_EVERY_REQUEST off, Django only saves a session (and
+    re-sends its cookie) when its data changes, so a session would expire
+    SESSION_COOKIE_AGE after it was created. For views that set
+    `refresh_session = True`, this marks the session as changed at most
+    once per SESSION_REFRESH_INTERVAL seconds, which saves it with a new
+    expiry: sessions still live SESSION_COOKIE_AGE after the last visit,
+    give or take one interval. Views without the flag (the catalog) never
+    cause a session write.
+
+    Must come after SessionMiddleware in MIDDLEWARE.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'refresh_session', False):
+            self.refresh(request.session)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        request.refresh_session = getattr(view_class, 'refresh_session', False)
+
+    def refresh(self, session):
+        refreshed = session.get(REFRESHED_KEY, 0)
+        # No session, or a stale cookie (loading drops the key of a
+        # session that no longer exists): never create one here
+        if not session.session_key:
+            return
+        now = int(time.time())
+        if now - refreshed >= getattr(settings, 'SESSION_REFRESH_INTERVAL', 60 * 60):
+            session[REFRESHED_KEY] = now
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 19:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_create_superuser'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='companylogo',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
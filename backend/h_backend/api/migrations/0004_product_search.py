@@ -0,0 +1,24 @@
+# Full-text search structures for Product (see api/search.py)
+
+from django.db import migrations
+
+
+def install(apps, schema_editor):
+    from api.search import install_search_backend
+    install_search_backend(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    from api.search import uninstall_search_backend
+    uninstall_search_backend(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_companylogo_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, reverse_code=uninstall),
+    ]
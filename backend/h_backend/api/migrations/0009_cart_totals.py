@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:18
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_totals(apps, schema_editor):
+    """Compute the new columns for existing carts from their lines"""
+    Cart = apps.get_model('api', 'Cart')
+    CartItem = apps.get_model('api', 'CartItem')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    lines = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        item_count=Coalesce(
+            models.Subquery(lines.annotate(total=models.Sum('quantity')).values('total')),
+            0,
+        ),
+        total_amount=Coalesce(
+            models.Subquery(lines.annotate(
+                total=models.Sum(models.F('quantity') * models.F('product__price'), output_field=amount)
+            ).values('total')),
+            models.Value(Decimal('0'), output_field=amount),
+            output_field=amount,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_cart_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=14),
+        ),
+        migrations.RunPython(fill_totals, migrations.RunPython.noop),
+    ]
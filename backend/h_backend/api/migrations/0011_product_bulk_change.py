@@ -0,0 +1,34 @@
+# Generated by Django 5.2.7 on 2026-10-18 20:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_cart_updated_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductBulkChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('admin', 'Admin action'), ('api', 'API')], max_length=10)),
+                ('scope', models.JSONField(blank=True, default=dict)),
+                ('price_percent', models.DecimalField(blank=True, decimal_places=3, max_digits=7, null=True)),
+                ('price_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('flags', models.JSONField(blank=True, default=dict)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('product_ids', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='product_bulk_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -1,17 +1,53 @@
+from decimal import Decimal
+
+from django.conf import settings
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.utils.text import slugify
 
+from .tasks import run_after_commit
+from .variants import refresh_placeholders, refresh_variants, stale_fields, stale_placeholder_fields
+
+
+class ImageVariantsMixin:
+    """
+    Keeps `image_variants` and `image_placeholders` in step with the
+    fields named in `image_variant_fields` (see api/variants.py).
+    Both are computed in the background once the save commits, so
+    uploads never wait for image processing; until then the row keeps
+    its previous entries. Only those tasks write the two columns: saving
+    an instance loaded before they ran leaves them alone.
+    """
+    image_variant_fields = ()
+    task_fields = ('image_variants', 'image_placeholders')
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.task_fields
+            ]
+        super().save(*args, **kwargs)
+        if stale_fields(self):
+            run_after_commit(refresh_variants, type(self), self.pk)
+        if stale_placeholder_fields(self):
+            run_after_commit(refresh_placeholders, type(self), self.pk)
 
-class Category(models.Model):
+
+class Category(ImageVariantsMixin, models.Model):
     """
     Represents a product category (e.g., Plumbing & Piping, Electrical)
     """
     name = models.CharField(max_length=100, unique=True)
     slug = models.SlugField(max_length=100, unique=True, blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    image_variant_fields = ('image',)
+
     class Meta:
         verbose_name_plural = "Categories"
         ordering = ['name']
@@ -25,7 +61,7 @@ class Category(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(ImageVariantsMixin, models.Model):
     """
     Represents a product in the store
     """
@@ -43,6 +79,8 @@ class Product(models.Model):
     thumbnail = models.ImageField(upload_to='products/', blank=True, null=True)
     image_1 = models.ImageField(upload_to='products/', blank=True, null=True)
     image_2 = models.ImageField(upload_to='products/', blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     
     # Product status flags
     is_featured = models.BooleanField(default=False)
@@ -53,18 +91,22 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    image_variant_fields = ('thumbnail', 'image_1', 'image_2')
+
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['category', 'is_active']),
             models.Index(fields=['is_featured']),
+            # Keyset pagination (api.pagination.ProductCursorPagination)
+            models.Index(fields=['-created_at', '-id'], name='api_product_created_id_idx'),
         ]
 
     def __str__(self):
         return f"{self.name} - {self.company}"
 
 
-class Slide(models.Model):
+class Slide(ImageVariantsMixin, models.Model):
     """
     Represents a slide in the homepage hero slider
     """
@@ -74,6 +116,8 @@ class Slide(models.Model):
     button_text = models.CharField(max_length=50, default="Shop Now")
     link = models.CharField(max_length=200, default="#")
     image = models.ImageField(upload_to='slides/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     
     order = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
@@ -81,6 +125,8 @@ class Slide(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    image_variant_fields = ('image',)
+
     class Meta:
         ordering = ['order', '-created_at']
 
@@ -128,16 +174,21 @@ class CompanyInfo(models.Model):
         return "Company Information"
 
 
-class CompanyLogo(models.Model):
+class CompanyLogo(ImageVariantsMixin, models.Model):
     """
     Represents company/partner logos for the scrolling section
     """
     name = models.CharField(max_length=100)
     logo = models.ImageField(upload_to='logos/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_placeholders = models.JSONField(default=dict, blank=True, editable=False)
     order = models.PositiveIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    image_variant_fields = ('logo',)
 
     class Meta:
         ordering = ['order']
@@ -146,34 +197,133 @@ class CompanyLogo(models.Model):
         return self.name
 
 
+# ============================================
+# BULK CATALOG CHANGES
+# ============================================
+
+class ProductBulkChange(models.Model):
+    """
+    Audit record of one set-based price or flag update (see api/bulk.py)
+    """
+    SOURCE_CHOICES = [
+        ('admin', 'Admin action'),
+        ('api', 'API'),
+    ]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='product_bulk_changes'
+    )
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES)
+    # What the change was scoped by, e.g. {"category": "cement"}
+    scope = models.JSONField(default=dict, blank=True)
+    price_percent = models.DecimalField(max_digits=7, decimal_places=3, null=True, blank=True)
+    price_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    # Flags set, e.g. {"is_featured": true}
+    flags = models.JSONField(default=dict, blank=True)
+    product_count = models.PositiveIntegerField(default=0)
+    product_ids = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Bulk change of {self.product_count} products ({self.created_at:%Y-%m-%d %H:%M})"
+
+
 # ============================================
 # NEW CART MODELS FOR ANONYMOUS USERS
 # ============================================
 
+def cart_line_totals():
+    """
+    Expressions computing a cart's item count and total amount from its
+    lines, for use on Cart querysets
+    """
+    lines = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+    return {
+        'item_count': Coalesce(
+            models.Subquery(lines.annotate(total=models.Sum('quantity')).values('total')),
+            0,
+        ),
+        'total_amount': Coalesce(
+            models.Subquery(lines.annotate(
+                total=models.Sum(models.F('quantity') * models.F('product__price'), output_field=amount)
+            ).values('total')),
+            models.Value(Decimal('0'), output_field=amount),
+            output_field=amount,
+        ),
+    }
+
+
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        """
+        Load the items with their products and categories, so a cart
+        serializes in a fixed number of queries however many lines it has
+        """
+        return self.prefetch_related(
+            models.Prefetch('items', queryset=CartItem.objects.select_related('product__category'))
+        )
+
+    def annotate_line_totals(self):
+        """Annotate line_item_count and line_total_amount, computed from the lines"""
+        totals = cart_line_totals()
+        return self.annotate(
+            line_item_count=totals['item_count'],
+            line_total_amount=totals['total_amount'],
+        )
+
+    def with_drift(self):
+        """Carts whose stored totals disagree with their lines"""
+        return self.annotate_line_totals().filter(
+            ~models.Q(item_count=models.F('line_item_count'))
+            | ~models.Q(total_amount=models.F('line_total_amount'))
+        )
+
+    def refresh_totals(self, **fields):
+        """Recompute the stored totals from the lines in one UPDATE"""
+        return self.update(**cart_line_totals(), **fields)
+
+
 class Cart(models.Model):
     """
     Represents a shopping cart linked to an anonymous session.
     No user authentication required - identified by session_key only.
+    
+    item_count and total_amount are kept in step with the lines by
+    every change (see api/carts.py and signals.cart_item_changed);
+    reconcile_carts repairs any drift.
     """
     session_key = models.CharField(max_length=40, unique=True, db_index=True)
+    # Incremented on every change to the cart's lines
+    version = models.PositiveIntegerField(default=0)
+    item_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0'))
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Finds abandoned carts for api/purge.py
+            models.Index(fields=['updated_at'], name='api_cart_updated_idx'),
+        ]
 
     def __str__(self):
         return f"Cart (Session: {self.session_key[:8]}...)"
 
     @property
     def total_price(self):
-        """Calculate total price of all items in cart"""
-        return sum(item.total_price for item in self.items.all())
-
-    @property
-    def item_count(self):
-        """Calculate total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        """Total price of all items in cart"""
+        return self.total_amount
 
 
 class CartItem(models.Model):
@@ -0,0 +1,57 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for product listings, ordered like Product.Meta
+    with id as the tie-breaker. Each page is a range scan that starts
+    from the previous page's last row, so there is no COUNT(*) and no
+    OFFSET, and deep pages cost the same as the first.
+    """
+    ordering = ('-created_at', '-id')
+    page_size_query_param = None
+
+
+def wants_cursor_pagination(request):
+    """
+    Cursor mode is opt-in with ?pagination=cursor. Follow-up links
+    carry a ?cursor= token, which keeps the mode for later pages.
+    """
+    params = request.query_params
+    return params.get('pagination') == 'cursor' or 'cursor' in params
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over very large tables. An unfiltered
+    changelist on PostgreSQL takes its row count from the planner's
+    estimate (pg_class.reltuples) instead of a full COUNT(*), once the
+    table holds at least `threshold` rows. Filtered or searched lists,
+    small tables and other databases are counted exactly.
+    """
+    threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self.estimate(queryset)
+            if estimate is not None and estimate >= self.threshold:
+                return estimate
+        return super().count
+
+    def estimate(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [connection.ops.quote_name(queryset.model._meta.db_table)],
+            )
+            row = cursor.fetchone()
+        # -1 until the table has been analyzed
+        return row[0] if row and row[0] >= 0 else None
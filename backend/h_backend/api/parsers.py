@@ -0,0 +1,34 @@
+import codecs
+import csv
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def text_stream(stream, encoding=None):
+    """Decode a byte stream as it is read (default: DEFAULT_CHARSET)"""
+    encoding = encoding or settings.DEFAULT_CHARSET
+    if codecs.lookup(encoding).name == 'utf-8':
+        # Spreadsheet exports often start with a byte order mark
+        encoding = 'utf-8-sig'
+    return codecs.getreader(encoding)(stream)
+
+
+def read_csv(stream, encoding=None):
+    """Read a CSV byte stream with a header row into a list of dicts"""
+    try:
+        return list(csv.DictReader(text_stream(stream, encoding)))
+    except (csv.Error, UnicodeDecodeError) as exc:
+        raise ParseError('CSV parse error - {}'.format(exc))
+
+
+class CSVParser(BaseParser):
+    """
+    Parses a text/csv body, e.g. a bill of materials with product_id
+    and quantity columns
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return read_csv(stream, (parser_context or {}).get('encoding'))
@@ -0,0 +1,145 @@
+"""
+Batched removal of expired sessions and abandoned carts.
+
+Rows are deleted in small batches, each in its own short transaction,
+so the tables stay usable while a purge runs. The selection is based
+only on the rows' current state, so an interrupted purge simply picks
+up where it stopped the next time it runs.
+
+A cart is abandoned when it has not changed for CART_RETENTION_DAYS
+and, with a database-backed session engine, its session has expired.
+Carts of visitors who are still browsing are kept.
+
+Run it with the purge_carts command, or let every worker schedule it
+with PURGE_INTERVAL (see start_purge_job).
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Cart, CartItem
+from .tasks import run_periodically
+
+
+logger = logging.getLogger(__name__)
+
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+PURGE_LOCK_KEY = 'api:purge:lock'
+
+
+def expired_sessions(now):
+    return Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+
+
+def abandoned_carts(days, now):
+    carts = Cart.objects.filter(updated_at__lt=now - timedelta(days=days))
+    if settings.SESSION_ENGINE in DB_SESSION_ENGINES:
+        live = Session.objects.filter(session_key=OuterRef('session_key'), expire_date__gte=now)
+        carts = carts.exclude(Exists(live))
+    return carts.order_by('updated_at')
+
+
+def delete_sessions(keys):
+    return Session.objects.filter(pk__in=keys)._raw_delete(Session.objects.db)
+
+
+def delete_carts(ids):
+    # Raw deletes skip CartItem's post_delete handler, which would
+    # recompute the totals of a cart that is about to go anyway
+    items = CartItem.objects.filter(cart_id__in=ids)._raw_delete(CartItem.objects.db)
+    carts = Cart.objects.filter(pk__in=ids)._raw_delete(Cart.objects.db)
+    return carts, items
+
+
+def in_batches(queryset, batch_size, pause, delete):
+    """
+    Delete the rows of `queryset` `batch_size` at a time, each batch in
+    its own transaction, sleeping `pause` seconds in between. Yields the
+    result of `delete(pks)` for each batch.
+    """
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        with transaction.atomic():
+            deleted = delete(pks)
+        yield deleted
+        if len(pks) < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
+
+
+def purge(days=None, batch_size=1000, pause=0, progress=None):
+    """
+    Delete expired sessions, then abandoned carts with their lines.
+    `progress(kind, deleted, elapsed)` is called after every batch.
+    Returns the number of rows deleted per table and the time taken.
+    """
+    days = days if days is not None else getattr(settings, 'CART_RETENTION_DAYS', 30)
+    now = timezone.now()
+    started = time.perf_counter()
+    report = {'sessions': 0, 'carts': 0, 'items': 0}
+
+    for deleted in in_batches(expired_sessions(now), batch_size, pause, delete_sessions):
+        report['sessions'] += deleted
+        if progress:
+            progress('sessions', report['sessions'], time.perf_counter() - started)
+
+    for carts, items in in_batches(abandoned_carts(days, now), batch_size, pause, delete_carts):
+        report['carts'] += carts
+        report['items'] += items
+        if progress:
+            progress('carts', report['carts'], time.perf_counter() - started)
+
+    report['seconds'] = time.perf_counter() - started
+    return report
+
+
+# ============================================
+# PERIODIC JOB
+# ============================================
+
+_job_started = False
+_job_lock = threading.Lock()
+
+
+def scheduled_purge():
+    """Run one purge, unless another worker already did this interval"""
+    interval = settings.PURGE_INTERVAL
+    if not cache.add(PURGE_LOCK_KEY, 1, interval):
+        return
+    report = purge(
+        batch_size=getattr(settings, 'PURGE_BATCH_SIZE', 1000),
+        pause=getattr(settings, 'PURGE_PAUSE', 0.1),
+    )
+    logger.info(
+        'Purged %(sessions)d sessions, %(carts)d carts and %(items)d cart items in %(seconds).1fs',
+        report,
+    )
+
+
+def start_purge_job(**kwargs):
+    """
+    request_started receiver: schedule scheduled_purge() every
+    PURGE_INTERVAL seconds in this worker. Connected only when
+    PURGE_INTERVAL is set, and starts the job on the first request so
+    management commands never run it.
+    """
+    global _job_started
+    with _job_lock:
+        if _job_started:
+            return
+        _job_started = True
+    run_periodically(settings.PURGE_INTERVAL, scheduled_purge)
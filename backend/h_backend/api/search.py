@@ -0,0 +1,206 @@
+"""
+Full-text product search.
+
+PostgreSQL keeps a weighted tsvector in a generated `search_document`
+column on api_product, backed by a GIN index. SQLite keeps an
+external-content FTS5 table, api_product_fts, in sync through triggers.
+Both are installed by migration 0004. Any other backend, or an SQLite
+build without FTS5, falls back to DRF's icontains SearchFilter.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from django.db.utils import OperationalError
+from rest_framework import filters
+
+from .models import Product
+
+
+PRODUCT_TABLE = Product._meta.db_table
+FTS_TABLE = 'api_product_fts'
+
+# Bound the size of the query the database has to plan
+MAX_SEARCH_TERMS = 8
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+# Name matches outrank company matches, which outrank description matches
+SQLITE_RANK = 'bm25({fts}, 10.0, 5.0, 1.0)'.format(fts=FTS_TABLE)
+
+SQLITE_FTS_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+        name, company, description,
+        content='{table}', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {fts}(rowid, name, company, description)
+        VALUES (new.id, new.name, new.company, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, name, company, description)
+        VALUES ('delete', old.id, old.name, old.company, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name, company, description ON {table} BEGIN
+        INSERT INTO {fts}({fts}, rowid, name, company, description)
+        VALUES ('delete', old.id, old.name, old.company, old.description);
+        INSERT INTO {fts}(rowid, name, company, description)
+        VALUES (new.id, new.name, new.company, new.description);
+    END
+    """,
+]
+
+POSTGRES_SEARCH_SQL = [
+    """
+    ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_document tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(company, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS {table}_search_document_gin
+    ON {table} USING GIN (search_document)
+    """,
+]
+
+# (alias, database name) -> whether the FTS5 table exists
+_sqlite_fts_available = {}
+
+
+# ============================================
+# SCHEMA
+# ============================================
+
+def install_search_backend(connection):
+    """
+    Create the search structures for `connection`'s backend.
+    Idempotent, so it also runs after every migrate: SQLite drops a
+    table's triggers whenever Django rebuilds that table to alter it.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            for sql in POSTGRES_SEARCH_SQL:
+                cursor.execute(sql.format(table=PRODUCT_TABLE))
+
+    elif connection.vendor == 'sqlite':
+        _sqlite_fts_available.pop(_cache_key(connection), None)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s",
+                [FTS_TABLE + '_a%'],
+            )
+            triggers_missing = cursor.fetchone()[0] < 3
+            try:
+                for sql in SQLITE_FTS_SQL:
+                    cursor.execute(sql.format(fts=FTS_TABLE, table=PRODUCT_TABLE))
+            except OperationalError:
+                # SQLite compiled without FTS5; search uses the fallback
+                return
+            if triggers_missing:
+                # Rows may have changed while the triggers were gone
+                cursor.execute(
+                    "INSERT INTO {fts}({fts}) VALUES ('rebuild')".format(fts=FTS_TABLE)
+                )
+
+
+def uninstall_search_backend(connection):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE {} DROP COLUMN IF EXISTS search_document'.format(PRODUCT_TABLE))
+
+    elif connection.vendor == 'sqlite':
+        _sqlite_fts_available.pop(_cache_key(connection), None)
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute('DROP TRIGGER IF EXISTS {}_{}'.format(FTS_TABLE, suffix))
+            cursor.execute('DROP TABLE IF EXISTS {}'.format(FTS_TABLE))
+
+
+def _cache_key(connection):
+    return connection.alias, connection.settings_dict['NAME']
+
+
+def sqlite_fts_available(connection):
+    key = _cache_key(connection)
+    if key not in _sqlite_fts_available:
+        _sqlite_fts_available[key] = FTS_TABLE in connection.introspection.table_names()
+    return _sqlite_fts_available[key]
+
+
+# ============================================
+# QUERYING
+# ============================================
+
+def search_terms(text):
+    return TERM_RE.findall(text or '')[:MAX_SEARCH_TERMS]
+
+
+def search_products(queryset, text):
+    """
+    Restrict `queryset` to products matching every term in `text` and
+    order them by relevance, newest first among equal ranks.
+    Each term also matches as a prefix ("pip" finds "pipes").
+    Returns None when the database has no full-text index.
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    connection = connections[queryset.db]
+    ordering = ['-search_rank', *Product._meta.ordering]
+
+    if connection.vendor == 'postgresql':
+        tsquery = ' & '.join('{}:*'.format(term) for term in terms)
+        return queryset.filter(
+            RawSQL(
+                "{}.search_document @@ to_tsquery('english', %s)".format(PRODUCT_TABLE),
+                [tsquery],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                "ts_rank({}.search_document, to_tsquery('english', %s))".format(PRODUCT_TABLE),
+                [tsquery],
+                output_field=FloatField(),
+            )
+        ).order_by(*ordering)
+
+    if connection.vendor == 'sqlite' and sqlite_fts_available(connection):
+        # Join the FTS table rather than probing it per row: a correlated
+        # MATCH reloads the term doclists for every product it ranks
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[
+                '{fts} MATCH %s'.format(fts=FTS_TABLE),
+                '{fts}.rowid = "{table}"."id"'.format(fts=FTS_TABLE, table=PRODUCT_TABLE),
+            ],
+            params=[match],
+            # bm25() is lower for better matches, so negate it
+            select={'search_rank': '-' + SQLITE_RANK},
+        ).order_by(*ordering)
+
+    return None
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    SearchFilter that uses the full-text index when there is one and
+    DRF's icontains search over `search_fields` otherwise
+    """
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param, '')
+        results = search_products(queryset, text)
+        if results is None:
+            return super().filter_queryset(request, queryset, view)
+        return results
@@ -1,27 +1,116 @@
+from django.conf import settings
 from rest_framework import serializers
+from .images import image_url, image_urls
+from .bulk import PRODUCT_FLAGS
 from .models import Category, Product, Slide, CompanyInfo, CompanyLogo, Cart, CartItem
 
 
+class SparseFieldsMixin:
+    """
+    Lets clients trim a serializer's output with query parameters:
+    ?fields=id,name,price keeps only the listed fields and
+    ?omit=description drops the listed fields.
+    Only applies to top-level serializers that receive the request in
+    their context, so nested serializers keep their full shape.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or self.parent is not None:
+            return
+
+        fields = _split_param(request.query_params.get('fields'))
+        omit = _split_param(request.query_params.get('omit'))
+        for name in list(self.fields):
+            if (fields and name not in fields) or name in omit:
+                self.fields.pop(name)
+
+
+def _split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+# Method fields that read a model field with a different name
+METHOD_FIELD_SOURCES = {
+    'srcset': 'image_variants',
+    'placeholders': 'image_placeholders',
+}
+
+
+def model_columns(serializer):
+    """
+    Return the model columns `serializer` reads, in the form expected by
+    QuerySet.only(). Method fields are assumed to read the model field
+    of the same name (thumbnail, image_1, ...), if there is one.
+    """
+    model_fields = {field.name for field in serializer.Meta.model._meta.get_fields()}
+    columns = {serializer.Meta.model._meta.pk.name}
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.SerializerMethodField):
+            source = METHOD_FIELD_SOURCES.get(name, name)
+            if source in model_fields:
+                columns.add(source)
+        elif field.source != '*':
+            columns.add(field.source.replace('.', '__'))
+    return columns
+
+
+def build_srcset(variants, request=None):
+    """
+    Turn an `image_variants` value into srcset strings per image field
+    and format, e.g. {"thumbnail": {"webp": "<url> 200w, <url> 400w"}}
+    """
+    srcset = {}
+    for field_name, entry in (variants or {}).items():
+        formats = {}
+        for key in ('webp', 'jpeg'):
+            widths = entry.get(key)
+            if widths:
+                formats[key] = ', '.join(
+                    '{} {}w'.format(image_urls.resolve(widths[width], request), width)
+                    for width in sorted(widths, key=int)
+                )
+        if formats:
+            srcset[field_name] = formats
+    return srcset
+
+
+def build_placeholders(placeholders, fields=None):
+    """
+    Turn an `image_placeholders` value into the public form, e.g.
+    {"thumbnail": {"width": 1200, "height": 900, "lqip": "data:..."}}
+    `fields` limits the output to those image fields.
+    """
+    return {
+        field_name: {key: entry[key] for key in ('width', 'height', 'lqip')}
+        for field_name, entry in (placeholders or {}).items()
+        if 'lqip' in entry and (fields is None or field_name in fields)
+    }
+
+
 class CategorySerializer(serializers.ModelSerializer):
     """
     Serializer for Category model
     """
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    placeholders = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
-        fields = ['id', 'name', 'slug', 'image']
+        fields = ['id', 'name', 'slug', 'image', 'srcset', 'placeholders']
     
     def get_image(self, obj):
-        request = self.context.get('request')
-        if obj.image and hasattr(obj.image, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+        return image_url(obj.image, self.context.get('request'))
+    
+    def get_srcset(self, obj):
+        return build_srcset(obj.image_variants, self.context.get('request'))
+    
+    def get_placeholders(self, obj):
+        return build_placeholders(obj.image_placeholders)
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
     Full Product serializer with category details
     """
@@ -31,6 +120,8 @@ class ProductSerializer(serializers.ModelSerializer):
     thumbnail = serializers.SerializerMethodField()
     image_1 = serializers.SerializerMethodField()
     image_2 = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    placeholders = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
@@ -43,6 +134,8 @@ class ProductSerializer(serializers.ModelSerializer):
             'thumbnail',
             'image_1',
             'image_2',
+            'srcset',
+            'placeholders',
             'category',
             'category_name',
             'category_slug',
@@ -61,24 +154,31 @@ class ProductSerializer(serializers.ModelSerializer):
     def get_image_2(self, obj):
         return self._get_image_url(obj.image_2)
     
+    def get_srcset(self, obj):
+        return build_srcset(obj.image_variants, self.context.get('request'))
+    
+    def get_placeholders(self, obj):
+        return build_placeholders(obj.image_placeholders)
+    
     def _get_image_url(self, image_field):
-        request = self.context.get('request')
-        if image_field and hasattr(image_field, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(image_field.url)
-            return image_field.url
-        return None
+        return image_url(image_field, self.context.get('request'))
 
 
-class ProductListSerializer(serializers.ModelSerializer):
+class ProductListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """
-    Lighter serializer for product lists
+    Lighter serializer for product lists.
+    Only the thumbnail gets a placeholder: lists and cart lines show the
+    thumbnail, and each preview is several hundred bytes.
     """
+    placeholder_fields = ('thumbnail',)
+
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_slug = serializers.CharField(source='category.slug', read_only=True)
     thumbnail = serializers.SerializerMethodField()
     image_1 = serializers.SerializerMethodField()
     image_2 = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    placeholders = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
@@ -91,6 +191,8 @@ class ProductListSerializer(serializers.ModelSerializer):
             'thumbnail',
             'image_1',
             'image_2',
+            'srcset',
+            'placeholders',
             'category_name',
             'category_slug',
             'is_featured',
@@ -98,28 +200,85 @@ class ProductListSerializer(serializers.ModelSerializer):
         ]
     
     def get_thumbnail(self, obj):
-        request = self.context.get('request')
-        if obj.thumbnail and hasattr(obj.thumbnail, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.thumbnail.url)
-            return obj.thumbnail.url
-        return None
+        return image_url(obj.thumbnail, self.context.get('request'))
     
     def get_image_1(self, obj):
-        request = self.context.get('request')
-        if obj.image_1 and hasattr(obj.image_1, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.image_1.url)
-            return obj.image_1.url
-        return None
+        return image_url(obj.image_1, self.context.get('request'))
     
     def get_image_2(self, obj):
-        request = self.context.get('request')
-        if obj.image_2 and hasattr(obj.image_2, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.image_2.url)
-            return obj.image_2.url
-        return None
+        return image_url(obj.image_2, self.context.get('request'))
+    
+    def get_srcset(self, obj):
+        return build_srcset(obj.image_variants, self.context.get('request'))
+    
+    def get_placeholders(self, obj):
+        return build_placeholders(obj.image_placeholders, self.placeholder_fields)
+
+
+class ProductCardSerializer(ProductListSerializer):
+    """
+    Compact product representation for product cards (?view=card)
+    """
+    class Meta(ProductListSerializer.Meta):
+        fields = [
+            'id',
+            'name',
+            'company',
+            'price',
+            'thumbnail',
+            'category_slug',
+        ]
+
+
+class ProductRowSerializer:
+    """
+    Fast read-only path for ProductListSerializer and its subclasses.
+
+    Takes a configured serializer (so ?fields=, ?omit= and ?view=card
+    still apply), reads plain dicts from QuerySet.values() and builds the
+    output without model instances or per-object field introspection.
+    Image URLs come from the shared resolver. The result is identical to
+    what the wrapped serializer produces.
+    """
+    # Output field -> values() lookup, for fields whose source is not
+    # simply the field name
+    lookups = {
+        'category_name': 'category__name',
+        'category_slug': 'category__slug',
+        **METHOD_FIELD_SOURCES,
+    }
+    image_fields = ('thumbnail', 'image_1', 'image_2')
+
+    def __init__(self, serializer):
+        self.request = serializer.context.get('request')
+        self.placeholder_fields = serializer.placeholder_fields
+        self.fields = [
+            (name, self.lookups.get(name, name), field)
+            for name, field in serializer.fields.items()
+        ]
+
+    def values(self, queryset, *extra):
+        """Turn `queryset` into a values() queryset with every needed lookup"""
+        return queryset.values(*[lookup for _, lookup, _ in self.fields], *extra)
+
+    def to_representation(self, row):
+        data = {}
+        for name, lookup, field in self.fields:
+            value = row[lookup]
+            if name in self.image_fields:
+                data[name] = image_urls.resolve(value, self.request)
+            elif name == 'srcset':
+                data[name] = build_srcset(value, self.request)
+            elif name == 'placeholders':
+                data[name] = build_placeholders(value, self.placeholder_fields)
+            elif value is None:
+                data[name] = None
+            else:
+                data[name] = field.to_representation(value)
+        return data
+
+    def serialize(self, rows):
+        return [self.to_representation(row) for row in rows]
 
 
 class SlideSerializer(serializers.ModelSerializer):
@@ -127,6 +286,8 @@ class SlideSerializer(serializers.ModelSerializer):
     Serializer for Slide model
     """
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    placeholders = serializers.SerializerMethodField()
     
     class Meta:
         model = Slide
@@ -138,16 +299,19 @@ class SlideSerializer(serializers.ModelSerializer):
             'button_text',
             'link',
             'image',
+            'srcset',
+            'placeholders',
             'order',
         ]
     
     def get_image(self, obj):
-        request = self.context.get('request')
-        if obj.image and hasattr(obj.image, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.image.url)
-            return obj.image.url
-        return None
+        return image_url(obj.image, self.context.get('request'))
+    
+    def get_srcset(self, obj):
+        return build_srcset(obj.image_variants, self.context.get('request'))
+    
+    def get_placeholders(self, obj):
+        return build_placeholders(obj.image_placeholders)
 
 
 class CompanyInfoSerializer(serializers.ModelSerializer):
@@ -173,18 +337,21 @@ class CompanyLogoSerializer(serializers.ModelSerializer):
     Serializer for Company Logos
     """
     logo = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
+    placeholders = serializers.SerializerMethodField()
     
     class Meta:
         model = CompanyLogo
-        fields = ['id', 'name', 'logo', 'order']
+        fields = ['id', 'name', 'logo', 'srcset', 'placeholders', 'order']
     
     def get_logo(self, obj):
-        request = self.context.get('request')
-        if obj.logo and hasattr(obj.logo, 'url'):
-            if request is not None:
-                return request.build_absolute_uri(obj.logo.url)
-            return obj.logo.url
-        return None
+        return image_url(obj.logo, self.context.get('request'))
+    
+    def get_srcset(self, obj):
+        return build_srcset(obj.image_variants, self.context.get('request'))
+    
+    def get_placeholders(self, obj):
+        return build_placeholders(obj.image_placeholders)
 
 
 # ============================================
@@ -233,13 +400,14 @@ class CartSerializer(serializers.ModelSerializer):
         fields = [
             'id',
             'session_key',
+            'version',
             'items',
             'item_count',
             'total_price',
             'created_at',
             'updated_at',
         ]
-        read_only_fields = ['id', 'session_key', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'session_key', 'version', 'created_at', 'updated_at']
     
     def get_item_count(self, obj):
         """Sum of all quantities in cart"""
@@ -247,4 +415,93 @@ class CartSerializer(serializers.ModelSerializer):
     
     def get_total_price(self, obj):
         """Total price of all items in cart"""
-        return float(obj.total_price)
\ No newline at end of file
+        return float(obj.total_price)
+
+
+# Ids are signed 64-bit integers on every supported database
+MAX_ID = 2 ** 63 - 1
+
+
+def parse_integer(value, min_value, max_value):
+    """
+    `value` (an int or a string of one) if it is an integer from
+    `min_value` to `max_value`, else None. Fractions are refused, not
+    truncated.
+    """
+    try:
+        return serializers.IntegerField(min_value=min_value, max_value=max_value).run_validation(value)
+    except serializers.ValidationError:
+        return None
+
+
+def parse_id(value):
+    """`value` as a positive integer id, or None if it is not one"""
+    return parse_integer(value, 1, MAX_ID)
+
+
+def empty_cart_data():
+    """Representation of a cart that has not been created yet"""
+    data = dict.fromkeys(CartSerializer.Meta.fields)
+    data.update(version=0, items=[], item_count=0, total_price=0.0)
+    return data
+
+
+class CartOperationSerializer(serializers.Serializer):
+    """
+    One line of a batch cart update (see carts.apply_operations).
+    Bill-of-materials rows ({product_id, quantity}) default to 'add'.
+    """
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'], default='add')
+    product_id = serializers.IntegerField(min_value=1, max_value=MAX_ID)
+    quantity = serializers.IntegerField(min_value=0, max_value=settings.CART_MAX_QUANTITY, default=1)
+    
+    def validate(self, attrs):
+        if attrs['op'] == 'add' and attrs['quantity'] < 1:
+            raise serializers.ValidationError({'quantity': 'add needs a positive quantity'})
+        return attrs
+
+
+class ProductBulkUpdateSerializer(serializers.Serializer):
+    """
+    A set-based product update (see api/bulk.py): which products, by
+    ids, category slug and/or company, and what to change
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1, max_value=MAX_ID), required=False, allow_empty=False)
+    category = serializers.SlugRelatedField(slug_field='slug', queryset=Category.objects.all(), required=False)
+    company = serializers.CharField(required=False)
+    price_percent = serializers.DecimalField(max_digits=7, decimal_places=3, min_value=-100, required=False)
+    price_amount = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    is_featured = serializers.BooleanField(required=False)
+    is_bestseller = serializers.BooleanField(required=False)
+    is_active = serializers.BooleanField(required=False)
+    
+    def validate(self, attrs):
+        if not any(name in attrs for name in ('ids', 'category', 'company')):
+            raise serializers.ValidationError('Scope the change by ids, category or company')
+        if 'price_percent' in attrs and 'price_amount' in attrs:
+            raise serializers.ValidationError('Give price_percent or price_amount, not both')
+        if not any(name in attrs for name in ('price_percent', 'price_amount') + PRODUCT_FLAGS):
+            raise serializers.ValidationError('Nothing to change')
+        return attrs
+    
+    def get_queryset(self):
+        filters = {}
+        data = self.validated_data
+        if 'ids' in data:
+            filters['pk__in'] = data['ids']
+        if 'category' in data:
+            filters['category'] = data['category']
+        if 'company' in data:
+            filters['company__iexact'] = data['company']
+        return Product.objects.filter(**filters)
+    
+    def get_scope(self):
+        """The scope, as recorded on the audit record"""
+        data = self.validated_data
+        scope = {name: data[name] for name in ('ids', 'company') if name in data}
+        if 'category' in data:
+            scope['category'] = data['category'].slug
+        return scope
+    
+    def get_flags(self):
+        return {name: self.validated_data[name] for name in PRODUCT_FLAGS if name in self.validated_data}
@@ -0,0 +1,127 @@
+"""
+Signal handlers that keep server-side caches in step with the catalog,
+and carts in step with their lines and prices
+"""
+from django.db import connections, transaction
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import F
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
+
+from .cache import invalidate_home_snapshot, invalidate_catalog_cache
+from .carts import in_bulk_change, prices_changed
+from .images import image_field_names, image_fields, image_urls
+from .models import Category, Product, Slide, CompanyInfo, CompanyLogo, Cart, CartItem
+from .search import install_search_backend
+
+
+HOMEPAGE_MODELS = (Category, Product, Slide, CompanyInfo, CompanyLogo)
+CATALOG_MODELS = (Category, Product)
+IMAGE_MODELS = (Category, Product, Slide, CompanyLogo)
+
+
+def homepage_changed(sender, **kwargs):
+    """Rebuild the homepage snapshot after any homepage row changes"""
+    # Wait for the commit so a concurrent rebuild cannot cache the old rows
+    # under the new generation
+    transaction.on_commit(invalidate_home_snapshot)
+
+
+for model in HOMEPAGE_MODELS:
+    post_save.connect(homepage_changed, sender=model)
+    post_delete.connect(homepage_changed, sender=model)
+
+
+def catalog_changed(sender, **kwargs):
+    """Drop cached catalog responses after a product or category changes"""
+    transaction.on_commit(invalidate_catalog_cache)
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(catalog_changed, sender=model)
+    post_delete.connect(catalog_changed, sender=model)
+
+
+def remember_images(sender, instance, update_fields=None, **kwargs):
+    """Note the stored image names before a row with images is saved"""
+    fields = [name for name in image_fields(sender) if update_fields is None or name in update_fields]
+    instance._stored_images = {}
+    if instance.pk and fields:
+        instance._stored_images = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+
+
+def images_changed(sender, instance, **kwargs):
+    """Forget cached URLs for the images a save replaced, old and new names"""
+    stored = getattr(instance, '_stored_images', None) or {}
+    instance._stored_images = {}
+    names = []
+    for attname, old in stored.items():
+        new = getattr(instance, attname).name
+        if (old or '') != (new or ''):
+            names += [old, new]
+    image_urls.invalidate(*names)
+
+
+def images_deleted(sender, instance, **kwargs):
+    """Forget cached URLs for the images on a deleted row"""
+    image_urls.invalidate(*image_field_names(instance))
+
+
+for model in IMAGE_MODELS:
+    pre_save.connect(remember_images, sender=model)
+    post_save.connect(images_changed, sender=model)
+    post_delete.connect(images_deleted, sender=model)
+
+
+def cart_item_changed(sender, instance, **kwargs):
+    """
+    Touch the parent cart so updated_at, version and the stored totals
+    track its contents. Skipped inside carts.bulk_change(), whose caller
+    touches the cart once for the whole change.
+    """
+    if in_bulk_change():
+        return
+    Cart.objects.filter(pk=instance.cart_id).refresh_totals(
+        updated_at=timezone.now(),
+        version=F('version') + 1,
+    )
+
+
+post_save.connect(cart_item_changed, sender=CartItem)
+post_delete.connect(cart_item_changed, sender=CartItem)
+
+
+def remember_price(sender, instance, update_fields=None, **kwargs):
+    """Note the stored price before a product is saved"""
+    if instance.pk and (update_fields is None or 'price' in update_fields):
+        instance._stored_price = Product.objects.filter(pk=instance.pk).values_list('price', flat=True).first()
+
+
+def price_changed(sender, instance, created, **kwargs):
+    """
+    Apply CART_PRICE_CHANGE_POLICY when a product's price changes:
+    'reprice' (default) recomputes the totals of the carts holding it
+    in the same transaction; 'reconcile' leaves them to reconcile_carts
+    """
+    stored = getattr(instance, '_stored_price', None)
+    instance._stored_price = None
+    if created or stored is None or stored == instance.price:
+        return
+    prices_changed([instance.pk])
+
+
+pre_save.connect(remember_price, sender=Product)
+post_save.connect(price_changed, sender=Product)
+
+
+def restore_search_backend(sender, using, **kwargs):
+    """
+    Reinstall the SQLite FTS triggers, which are lost whenever a migration
+    rebuilds the product table
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    applied = MigrationRecorder(connection).applied_migrations()
+    if ('api', '0004_product_search') in applied:
+        install_search_backend(connection)
@@ -0,0 +1,54 @@
+"""
+In-process background execution for work that must stay off the
+request path, such as image processing after an upload.
+
+Tasks run on a small thread pool once the surrounding transaction has
+committed, so they always see the rows that scheduled them. They are
+best effort: a task lost to a restart is picked up by the matching
+backfill command.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'BACKGROUND_TASK_WORKERS', 2),
+    thread_name_prefix='api-task',
+)
+
+
+def run_in_background(func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` on the background pool now"""
+    _executor.submit(_run, func, args, kwargs)
+
+
+def run_after_commit(func, *args, **kwargs):
+    """Run `func(*args, **kwargs)` on the background pool after commit"""
+    transaction.on_commit(lambda: run_in_background(func, *args, **kwargs))
+
+
+def run_periodically(interval, func):
+    """Call `func()` every `interval` seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval)
+            _run(func, (), {})
+
+    threading.Thread(target=loop, name='api-periodic', daemon=True).start()
+
+
+def _run(func, args, kwargs):
+    try:
+        func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', func.__name__)
+    finally:
+        # Each pool thread gets its own connections; don't leave them open
+        connections.close_all()
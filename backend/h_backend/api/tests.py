@@ -1,3 +1,913 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+
+from . import carts, purge, search
+from .admin import ProductImportForm
+from .cache import invalidate_catalog_cache
+from .cart_storage import get_cart_store
+from .images import ImageURLResolver, image_urls
+from .middleware import REFRESHED_KEY
+from .models import Cart, CartItem, Category, Product, ProductBulkChange
+from .variants import build_variants, refresh_variants
+
+
+# The admin pages need static files, which are only collected for deploys
+ADMIN_STORAGES = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+
+def create_products(count, price=100):
+    category = Category.objects.create(name='Test category')
+    return Product.objects.bulk_create([
+        Product(category=category, name='Product {}'.format(n), company='Test', price=price)
+        for n in range(count)
+    ])
+
+
+def cart_client(client):
+    """Give `client` a session with an empty cart and return the cart"""
+    session = client.session
+    # As just refreshed, so the next cart request does not save it again
+    session[REFRESHED_KEY] = int(time.time())
+    session.save()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+    return Cart.objects.create(session_key=session.session_key)
+
+
+class CartQueryBudgetTests(TestCase):
+    """GET /api/cart/ runs a fixed number of queries, whatever the cart size"""
+    # Session, cart, then the cart again with its lines, products and
+    # categories (two queries). The product table state for the ETag is
+    # cached.
+    queries = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_products(500)
+
+    def assert_cart_budget(self, size):
+        cart = cart_client(self.client)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2) for product in self.products[:size]
+        ])
+        # Warm the cached catalog validators, which are shared by all carts
+        self.client.get('/api/cart/')
+
+        with self.assertNumQueries(self.queries):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['items']), size)
+
+    def test_one_line(self):
+        self.assert_cart_budget(1)
+
+    def test_fifty_lines(self):
+        self.assert_cart_budget(50)
+
+    def test_five_hundred_lines(self):
+        self.assert_cart_budget(500)
+
+
+class CartBatchTests(TestCase):
+    """A batch change touches the cart once, however many lines it has"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_products(200)
+
+    def test_batch_removal_is_one_change(self):
+        cart = cart_client(self.client)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product) for product in self.products])
+        cart.refresh_from_db()
+        version = cart.version
+
+        operations = [{'op': 'remove', 'product_id': product.pk} for product in self.products]
+        with self.assertNumQueries(11):
+            response = self.client.post('/api/cart/batch/?response=delta', operations, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        cart.refresh_from_db()
+        self.assertEqual(cart.version, version + 1)
+        self.assertEqual((cart.item_count, cart.total_amount), (0, 0))
+        self.assertFalse(cart.items.exists())
+
+
+class EmptyCartBatchTests(TestCase):
+    """An empty batch answers with the current cart and creates nothing"""
+    def test_without_a_cart(self):
+        for url in ('/api/cart/batch/', '/api/cart/batch/?response=delta'):
+            with self.subTest(url=url):
+                response = self.client.post(url, [], content_type='application/json')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((response.json()['version'], response.json()['items']), (0, []))
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_with_a_cart(self):
+        cart = cart_client(self.client)
+        response = self.client.post('/api/cart/batch/', [], content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], cart.pk)
+        cart.refresh_from_db()
+        self.assertEqual(cart.version, 0)
+
+
+class CartQuantityTests(TestCase):
+    """Quantities above CART_MAX_QUANTITY are refused before reaching the cart"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_products(1)[0]
+
+    def test_single_item_add(self):
+        for quantity in (settings.CART_MAX_QUANTITY + 1, 10 ** 12, 1.5):
+            with self.subTest(quantity=quantity):
+                response = self.client.post(
+                    '/api/cart/', {'product_id': self.product.pk, 'quantity': quantity}, content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_single_item_update(self):
+        self.client.post('/api/cart/', {'product_id': self.product.pk}, content_type='application/json')
+        item = CartItem.objects.get()
+        response = self.client.put(
+            '/api/cart/', {'item_id': item.pk, 'quantity': 10 ** 12}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        item.refresh_from_db()
+        self.assertEqual(item.quantity, 1)
+
+    def test_batch(self):
+        operations = [{'op': 'set', 'product_id': self.product.pk, 'quantity': 10 ** 12}]
+        response = self.client.post('/api/cart/batch/', operations, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class CartTotalsTests(TestCase):
+    """Stored cart totals follow price changes and can be reconciled"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_products(3)
+        for n in range(4):
+            cart = Cart.objects.create(session_key='totals{:026d}'.format(n))
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=n + 1) for product in cls.products[:n + 1]
+            ])
+        Cart.objects.refresh_totals()
+
+    def assert_totals_match(self):
+        for cart in Cart.objects.annotate_line_totals():
+            self.assertEqual(
+                (cart.item_count, cart.total_amount),
+                (cart.line_item_count, cart.line_total_amount),
+            )
+
+    def change_price(self, product, price):
+        product.price = price
+        product.save()
+
+    def test_price_change_reprices(self):
+        self.change_price(self.products[0], 250)
+        self.assert_totals_match()
+        self.assertEqual(
+            sorted(Cart.objects.values_list('total_amount', flat=True)),
+            [250, 700, 1350, 1800],
+        )
+
+    def test_reprice_carts(self):
+        Product.objects.filter(pk=self.products[1].pk).update(price=40)
+        self.assertEqual(carts.reprice_carts([self.products[1].pk]), 3)
+        self.assert_totals_match()
+
+    @override_settings(CART_PRICE_CHANGE_POLICY='reconcile')
+    def test_reconcile_carts(self):
+        self.change_price(self.products[0], 250)
+        self.assertEqual(Cart.objects.with_drift().count(), 4)
+
+        call_command('reconcile_carts', '--dry-run', stdout=StringIO())
+        self.assertEqual(Cart.objects.with_drift().count(), 4)
+
+        out = StringIO()
+        call_command('reconcile_carts', '--batch-size', '3', stdout=out)
+        self.assertIn('Repaired 4 carts', out.getvalue())
+        self.assert_totals_match()
+
+
+class ProductImportTests(TestCase):
+    """import_products creates and updates products, skipping bad rows"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = create_products(1)[0]
+
+    def run_import(self, content, *args, suffix='.csv'):
+        with tempfile.NamedTemporaryFile(suffix=suffix) as upload:
+            upload.write(content.encode() if isinstance(content, str) else content)
+            upload.flush()
+            out, err = StringIO(), StringIO()
+            call_command('import_products', upload.name, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_good_rows(self):
+        out, err = self.run_import(
+            '\ufeffname,company,category,price\n'
+            'Product 0,Test,test-category,120.50\n'
+            'Hammer,Acme,test-category,15\n'
+        )
+        self.assertIn('Created 1 products, updated 1', out)
+        self.assertNotIn('! line', err)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, Decimal('120.50'))
+        self.assertEqual(Product.objects.get(name='Hammer').price, 15)
+
+    def test_ndjson(self):
+        out, err = self.run_import('{"id": %d, "price": 80}\n\nnot json\n' % self.product.pk, suffix='.ndjson')
+        self.assertIn('updated 1', out)
+        self.assertIn('! line 3: Invalid JSON', err)
+
+    def test_bad_rows(self):
+        rows = {
+            'NaN': 'Invalid price',
+            '-1': 'Negative price',
+            'inf': 'Invalid price',
+            '123456789': 'Price too large',
+            '1e30': 'Price too large',
+        }
+        content = 'name,company,category,price\n' + ''.join(
+            'Bad {},Acme,test-category,{}\n'.format(n, price) for n, price in enumerate(rows)
+        ) + '{},Acme,test-category,1\n'.format('x' * 201) + 'Saw,{},test-category,1\n'.format('x' * 101)
+        content += 'Saw,Acme,no-such-category,1\n'
+        out, err = self.run_import(content)
+        self.assertIn('8 rows skipped', out)
+        for message in list(rows.values()) + ['Name longer than 200', 'Company longer than 100', 'Unknown category']:
+            self.assertIn(message, err)
+        self.assertEqual(Product.objects.count(), 1)
+
+    def test_dry_run(self):
+        out, err = self.run_import(
+            'name,company,category,price\nProduct 0,Test,test-category,120\nHammer,Acme,test-category,15\n',
+            '--dry-run',
+        )
+        self.assertIn('+ line 3: Hammer - Acme', out)
+        self.assertIn('~ line 2: Product 0 - Test: price 100.00 -> 120.00', out)
+        self.assertIn('Would create 1 products, would update 1', out)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.price, 100)
+        self.assertFalse(Product.objects.filter(name='Hammer').exists())
+
+    def test_undecodable_file(self):
+        with self.assertRaisesMessage(CommandError, 'Cannot decode'):
+            self.run_import('name,company,category,price\nCaf\xe9,Acme,test-category,1\n'.encode('latin-1'))
+        out, err = self.run_import(
+            'name,company,category,price\nCaf\xe9,Acme,test-category,1\n'.encode('latin-1'), '--encoding', 'latin-1'
+        )
+        self.assertIn('Created 1 products', out)
+        self.assertTrue(Product.objects.filter(name='Caf\xe9').exists())
+
+    def test_admin_form_refuses_undecodable_file(self):
+        upload = SimpleUploadedFile('prices.csv', 'name\nCaf\xe9\n'.encode('latin-1'))
+        form = ProductImportForm(files={'file': upload})
+        self.assertFalse(form.is_valid())
+        self.assertIn('is not utf-8 text', form.errors['file'][0])
+
+
+class ProductBulkUpdateTests(TestCase):
+    """Set-based price and flag changes through /api/products/bulk-update/"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_products(4)
+        cls.other = Category.objects.create(name='Other category')
+        Product.objects.filter(pk=cls.products[3].pk).update(category=cls.other, company='Acme', price='10.05')
+        cls.user = get_user_model().objects.create_superuser('test-admin', password='test-admin')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def bulk_update(self, **data):
+        return self.client.post('/api/products/bulk-update/', data, content_type='application/json')
+
+    def prices(self):
+        return [product.price for product in Product.objects.order_by('pk')]
+
+    def test_scope_filters(self):
+        ids = [product.pk for product in self.products]
+        for scope, expected in (
+            ({'ids': ids[:2]}, ids[:2]),
+            ({'category': 'other-category'}, ids[3:]),
+            ({'company': 'acme'}, ids[3:]),
+            ({'category': 'test-category', 'company': 'Test'}, ids[:3]),
+        ):
+            with self.subTest(scope=scope):
+                response = self.bulk_update(is_featured=True, **scope)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()['product_ids'], expected)
+
+    def test_percent_rounds_to_the_cent(self):
+        self.bulk_update(ids=[self.products[3].pk], price_percent='7.5')
+        # 10.05 * 1.075 = 10.80375
+        self.assertEqual(self.prices()[3], Decimal('10.80'))
+
+    def test_amount(self):
+        self.bulk_update(category='test-category', price_amount='-0.01')
+        self.assertEqual(self.prices(), [Decimal('99.99')] * 3 + [Decimal('10.05')])
+
+    def test_prices_stop_at_zero(self):
+        self.bulk_update(company='Acme', price_amount='-50')
+        self.bulk_update(category='test-category', price_percent='-100')
+        self.assertEqual(self.prices(), [0] * 4)
+
+    def test_refuses_prices_beyond_the_column(self):
+        response = self.bulk_update(company='Acme', price_amount='99999990')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.prices()[3], Decimal('10.05'))
+        self.assertFalse(ProductBulkChange.objects.exists())
+
+    @override_settings(STORAGES=ADMIN_STORAGES)
+    def test_admin_action_refuses_prices_beyond_the_column(self):
+        response = self.client.post('/admin/api/product/', {
+            'action': 'adjust_prices',
+            'apply': 'Adjust prices',
+            '_selected_action': [self.products[3].pk],
+            'amount': '99999990',
+        })
+        self.assertContains(response, 'prices must stay below')
+        self.assertEqual(self.prices()[3], Decimal('10.05'))
+
+    def test_records_an_audit_row(self):
+        response = self.bulk_update(category='other-category', price_percent='10', is_bestseller=True)
+        change = ProductBulkChange.objects.get(pk=response.json()['id'])
+        self.assertEqual(
+            (change.user, change.source, change.scope, change.price_percent, change.flags, change.product_ids),
+            (self.user, 'api', {'category': 'other-category'}, 10, {'is_bestseller': True}, [self.products[3].pk]),
+        )
+        self.assertEqual(change.product_count, 1)
+
+
+class ProductExportTests(TestCase):
+    """The catalog export formats, plain and gzipped"""
+    @classmethod
+    def setUpTestData(cls):
+        create_products(3)
+        category = Category.objects.create(name='Power\ttools')
+        cls.product = Product.objects.create(
+            category=category, name='Drill\t18V\n', company='Acme\r\nTools', price='49.90',
+            description='Cordless,\n"two" batteries\tand case', is_active=True,
+        )
+        Product.objects.create(category=category, name='Old drill', company='Acme', price=1, is_active=False)
+        cls.user = get_user_model().objects.create_superuser('test-admin', password='test-admin')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export(self, export_format, **headers):
+        response = self.client.get('/api/products/export/{}/'.format(export_format), **headers)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.export('csv').decode())))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[3]['name'], 'Drill\t18V\n')
+        self.assertEqual(rows[3]['company'], 'Acme\r\nTools')
+        self.assertEqual(rows[3]['category'], 'power-tools')
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export('ndjson').decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual((rows[3]['id'], rows[3]['name'], rows[3]['price']), (self.product.pk, 'Drill\t18V\n', '49.90'))
+
+    def test_merchant_columns_stay_aligned(self):
+        lines = self.export('merchant').decode().split('\n')
+        self.assertEqual(lines.pop(), '')
+        rows = [line.split('\t') for line in lines]
+        # Header and the four active products
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(len(row) == 10 for row in rows))
+        row = dict(zip(rows[0], rows[4]))
+        self.assertEqual(row['title'], 'Drill 18V')
+        self.assertEqual(row['brand'], 'Acme Tools')
+        self.assertEqual(row['product_type'], 'Power tools')
+        self.assertEqual(row['description'], 'Cordless, "two" batteries and case')
+        self.assertEqual(row['price'], '49.90 {}'.format(settings.STORE_CURRENCY))
+
+    def test_gzip(self):
+        for export_format in ('csv', 'ndjson', 'merchant'):
+            with self.subTest(export_format=export_format):
+                self.assertEqual(
+                    gzip.decompress(self.export(export_format, HTTP_ACCEPT_ENCODING='gzip, br')),
+                    self.export(export_format),
+                )
+
+
+class ProductSearchTests(TestCase):
+    """Full-text search over name, company and description (api/search.py)"""
+    def setUp(self):
+        if search.search_products(Product.objects.all(), 'pipe') is None:
+            self.skipTest('No full-text index on this database')
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Plumbing')
+        cls.pipe, cls.pipes, cls.wrench, cls.tape = (
+            Product.objects.create(category=category, price=1, name=name, company=company, description=description)
+            for name, company, description in (
+                ('Steel pipe', 'Mabati', 'Galvanised'),
+                ('PVC pipes', 'Kenpipe', 'Pressure rated'),
+                ('Pipe wrench', 'Stanley', 'Heavy duty'),
+                ('Thread tape', 'Acme', 'Seals pipe threads'),
+            )
+        )
+
+    def search(self, text):
+        return list(search.search_products(Product.objects.all(), text).values_list('pk', flat=True))
+
+    def test_matches_every_term(self):
+        self.assertEqual(set(self.search('steel pipe')), {self.pipe.pk})
+        self.assertEqual(set(self.search('acme')), {self.tape.pk})
+        self.assertEqual(self.search('cement'), [])
+
+    def test_prefix_terms(self):
+        self.assertEqual(set(self.search('pip')), {self.pipe.pk, self.pipes.pk, self.wrench.pk, self.tape.pk})
+        self.assertEqual(set(self.search('wren')), {self.wrench.pk})
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('pipe')[-1], self.tape.pk)
+
+    def test_terms_are_capped(self):
+        text = ' '.join(['steel'] * search.MAX_SEARCH_TERMS + ['cement'])
+        self.assertEqual(search.search_terms(text), ['steel'] * search.MAX_SEARCH_TERMS)
+        self.assertEqual(self.search(text), [self.pipe.pk])
+
+    def test_api(self):
+        response = self.client.get('/api/products/', {'search': 'wrench'})
+        self.assertEqual([product['id'] for product in response.json()['results']], [self.wrench.pk])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.wrench.name = 'Adjustable spanner'
+        self.wrench.save()
+        self.assertEqual(self.search('wrench'), [])
+        self.assertEqual(self.search('spanner'), [self.wrench.pk])
+
+        Product.objects.filter(pk=self.pipes.pk).update(description='Blue')
+        self.assertEqual(self.search('pressure'), [])
+        self.assertEqual(self.search('blue'), [self.pipes.pk])
+
+        pk = self.pipe.pk
+        self.pipe.delete()
+        self.assertEqual(self.search('steel'), [])
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT rowid FROM {fts} WHERE {fts} MATCH %s'.format(fts=search.FTS_TABLE), ['steel']
+                )
+                self.assertNotIn((pk,), cursor.fetchall())
+
+
+class PurgeTests(TestCase):
+    """purge() removes expired sessions and abandoned carts, in batches"""
+    @classmethod
+    def setUpTestData(cls):
+        product = create_products(1)[0]
+        now = timezone.now()
+        old = now - timedelta(days=settings.CART_RETENTION_DAYS + 1)
+        for n in range(5):
+            expired, live = 'expired{:025d}'.format(n), 'live{:028d}'.format(n)
+            Session.objects.create(session_key=expired, session_data='', expire_date=now - timedelta(days=1))
+            Session.objects.create(session_key=live, session_data='', expire_date=now + timedelta(days=1))
+            # Carts without a session row at all are abandoned too
+            for session_key, updated_at in (
+                (expired, old), (live, old), ('gone{:028d}'.format(n), old), ('recent{:026d}'.format(n), now),
+            ):
+                cart = Cart.objects.create(session_key=session_key)
+                CartItem.objects.create(cart=cart, product=product)
+                Cart.objects.filter(pk=cart.pk).update(updated_at=updated_at)
+
+    def assert_purged(self):
+        self.assertFalse(Session.objects.filter(session_key__startswith='expired').exists())
+        self.assertEqual(Session.objects.filter(session_key__startswith='live').count(), 5)
+        self.assertEqual(
+            sorted({key.rstrip('0123456789') for key in Cart.objects.values_list('session_key', flat=True)}),
+            ['live', 'recent'],
+        )
+        self.assertFalse(CartItem.objects.exclude(cart__in=Cart.objects.all()).exists())
+
+    def test_purge(self):
+        batches = []
+        report = purge.purge(batch_size=2, progress=lambda kind, deleted, elapsed: batches.append((kind, deleted)))
+        self.assertEqual((report['sessions'], report['carts'], report['items']), (5, 10, 10))
+        self.assertEqual(batches, [
+            ('sessions', 2), ('sessions', 4), ('sessions', 5),
+            ('carts', 2), ('carts', 4), ('carts', 6), ('carts', 8), ('carts', 10),
+        ])
+        self.assert_purged()
+
+    def test_resumes_after_an_interruption(self):
+        def stop(kind, deleted, elapsed):
+            if kind == 'carts':
+                raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            purge.purge(batch_size=3, progress=stop)
+        # Finished batches stay deleted
+        self.assertEqual(Cart.objects.count(), 17)
+
+        report = purge.purge(batch_size=3)
+        self.assertEqual((report['sessions'], report['carts']), (0, 7))
+        self.assert_purged()
+
+    def test_command(self):
+        out = StringIO()
+        call_command('purge_carts', '--dry-run', stdout=out)
+        self.assertIn('5 expired sessions, 10 abandoned carts', out.getvalue())
+        call_command('purge_carts', '--batch-size', '4', '--pause', '0', stdout=out)
+        self.assertIn('Deleted 5 sessions, 10 carts and 10 cart items', out.getvalue())
+        self.assert_purged()
+
+
+class VirtualCartTests(TestCase):
+    """Visitors who never added anything read an empty cart without writes"""
+    def test_cart_read_without_a_session(self):
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['id'], response.json()['items']), (None, []))
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertFalse(Cart.objects.exists())
+
+
+class SessionRefreshTests(TestCase):
+    """Sessions are saved at most once per SESSION_REFRESH_INTERVAL, and never by the catalog"""
+    @classmethod
+    def setUpTestData(cls):
+        create_products(3)
+
+    def setUp(self):
+        self.cart = cart_client(self.client)
+
+    def session_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, [query['sql'] for query in queries if 'django_session' in query['sql']]
+
+    def test_catalog_reads_never_touch_the_session(self):
+        for url in ('/api/products/', '/api/home/', '/api/categories/', '/api/company-info/'):
+            with self.subTest(url=url):
+                response, queries = self.session_queries(url)
+                self.assertEqual(queries, [])
+                self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_refresh_keeps_the_cookie_age(self):
+        session = self.client.session
+        session[REFRESHED_KEY] = 0
+        session.save()
+
+        response, queries = self.session_queries('/api/cart/')
+        cookie = response.cookies[settings.SESSION_COOKIE_NAME]
+        self.assertEqual(cookie['max-age'], settings.SESSION_COOKIE_AGE)
+        expires = Session.objects.get(pk=session.session_key).expire_date
+        self.assertAlmostEqual(
+            (expires - timezone.now()).total_seconds(), settings.SESSION_COOKIE_AGE, delta=60
+        )
+
+        # Refreshed just now: the next read loads the session only
+        response, queries = self.session_queries('/api/cart/')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_stale_cookie_creates_no_session(self):
+        Session.objects.all().delete()
+        response, queries = self.session_queries('/api/cart/')
+        # Django clears the stale cookie
+        self.assertEqual(response.cookies[settings.SESSION_COOKIE_NAME].value, '')
+        self.assertFalse(Session.objects.exists())
+
+
+class ImageVariantTests(TestCase):
+    """Variants are built after the save commits, not during it"""
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        storages = {**settings.STORAGES, 'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'}}
+        settings_override = override_settings(STORAGES=storages, MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.product = create_products(1)[0]
+
+    def set_thumbnail(self, name, width=600):
+        buffer = BytesIO()
+        Image.new('RGB', (width, 300), 'red').save(buffer, 'PNG')
+        # Capture the scheduled tasks rather than run them on the pool
+        with self.captureOnCommitCallbacks():
+            self.product.thumbnail.save(name, ContentFile(buffer.getvalue()))
+
+    def variant_files(self, entry):
+        return [path for key in ('webp', 'jpeg') for path in entry[key].values()]
+
+    def test_built_after_commit(self):
+        self.set_thumbnail('drill.png')
+        self.assertEqual(Product.objects.get().image_variants, {})
+
+        refresh_variants(Product, self.product.pk)
+        entry = Product.objects.get().image_variants['thumbnail']
+        self.assertEqual(entry['source'], self.product.thumbnail.name)
+        self.assertEqual(sorted(entry['webp']), ['200', '400'])
+        self.assertTrue(all(default_storage.exists(path) for path in self.variant_files(entry)))
+
+    def test_replaced_variants_are_deleted_after_the_new_ones_are_stored(self):
+        self.set_thumbnail('drill.png')
+        refresh_variants(Product, self.product.pk)
+        old = Product.objects.get().image_variants['thumbnail']
+
+        # self.product still holds the image_variants it was loaded with
+        self.set_thumbnail('drill-2.png')
+        refresh_variants(Product, self.product.pk)
+        new = Product.objects.get().image_variants['thumbnail']
+        self.assertEqual(new['source'], self.product.thumbnail.name)
+        self.assertFalse(any(default_storage.exists(path) for path in self.variant_files(old)))
+        self.assertTrue(all(default_storage.exists(path) for path in self.variant_files(new)))
+
+    def test_unused_when_the_image_changed_meanwhile(self):
+        self.set_thumbnail('drill.png')
+        built = []
+
+        def replace_image(name):
+            entry = build_variants(name)
+            built.append(entry)
+            Product.objects.filter(pk=self.product.pk).update(thumbnail='products/other.png')
+            return entry
+
+        with mock.patch('api.variants.build_variants', replace_image):
+            refresh_variants(Product, self.product.pk)
+        self.assertEqual(Product.objects.get().image_variants, {})
+        self.assertFalse(any(default_storage.exists(path) for path in self.variant_files(built[0])))
+
+
+class CountingStorage:
+    """Storage stand-in counting url() calls"""
+    def __init__(self, base):
+        self.base = base
+        self.calls = 0
+
+    def url(self, name):
+        self.calls += 1
+        return self.base + name
+
+
+class ImageURLResolverTests(TestCase):
+    """Image URLs are resolved once per name, storage and host"""
+    def setUp(self):
+        self.storage = CountingStorage('/media/')
+        self.addCleanup(image_urls.clear)
+
+    @override_settings(ALLOWED_HOSTS=['testserver', 'shop.example.com'])
+    def test_hits_and_keys(self):
+        resolver = ImageURLResolver(10)
+        request = RequestFactory().get('/')
+        self.assertEqual(resolver.resolve('a.png', request, self.storage), 'http://testserver/media/a.png')
+        self.assertEqual(resolver.resolve('a.png', request, self.storage), 'http://testserver/media/a.png')
+        self.assertEqual(self.storage.calls, 1)
+
+        other_host = RequestFactory().get('/', HTTP_HOST='shop.example.com')
+        self.assertEqual(resolver.resolve('a.png', other_host, self.storage), 'http://shop.example.com/media/a.png')
+        other_storage = CountingStorage('https://cdn.example.com/')
+        self.assertEqual(resolver.resolve('a.png', request, other_storage), 'https://cdn.example.com/a.png')
+        self.assertEqual(self.storage.calls, 2)
+
+    def test_least_recently_used_goes_first(self):
+        resolver = ImageURLResolver(2)
+        for name in ('a.png', 'b.png', 'a.png', 'c.png', 'a.png', 'b.png'):
+            resolver.resolve(name, None, self.storage)
+        # b.png was evicted by c.png, then resolved again
+        self.assertEqual(self.storage.calls, 4)
+
+    def cached_names(self):
+        return {key[0] for key in image_urls._entries}
+
+    def test_saves_evict_only_replaced_images(self):
+        product = create_products(1)[0]
+        product.thumbnail = 'products/a.png'
+        product.image_1 = 'products/b.png'
+        product.save()
+        for name in ('products/a.png', 'products/b.png'):
+            image_urls.resolve(name, None, self.storage)
+
+        product.price = 120
+        product.save()
+        self.assertEqual(self.cached_names(), {'products/a.png', 'products/b.png'})
+
+        product.thumbnail = 'products/c.png'
+        product.save()
+        self.assertEqual(self.cached_names(), {'products/b.png'})
+
+        product.delete()
+        self.assertEqual(self.cached_names(), set())
+
+
+class ConditionalGetTests(TestCase):
+    """Responses with validators must be revalidated, not cached heuristically"""
+    @classmethod
+    def setUpTestData(cls):
+        create_products(3)
+
+    def test_catalog_and_cart_require_revalidation(self):
+        for url in ('/api/products/', '/api/home/', '/api/categories/', '/api/cart/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('ETag', response)
+                self.assertIn('no-cache', response['Cache-Control'])
+
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, 304)
+                self.assertIn('no-cache', response['Cache-Control'])
+
+
+class CacheStatsTests(TestCase):
+    """Counters are visible in-process through the staff endpoint"""
+    @classmethod
+    def setUpTestData(cls):
+        create_products(3)
+        cls.user = get_user_model().objects.create_superuser('test-admin', password='test-admin')
+
+    def test_counts_catalog_hits_without_a_shared_cache(self):
+        self.client.force_login(self.user)
+        before = self.client.get('/api/cache-stats/').json()['catalog']
+        invalidate_catalog_cache()
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+
+        after = self.client.get('/api/cache-stats/').json()['catalog']
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get('/api/cache-stats/').status_code, 403)
+
+
+class ProductBatchTests(TestCase):
+    """POST takes longer id lists than GET, which must fit in a URL"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.ids = [product.pk for product in create_products(150)]
+
+    def test_get_is_capped(self):
+        ids = ','.join(map(str, self.ids))
+        response = self.client.get('/api/products/batch/', {'ids': ids})
+        self.assertEqual(response.status_code, 400)
+
+    def test_post_takes_long_lists(self):
+        response = self.client.post('/api/products/batch/', {'ids': self.ids}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.json()['results']], self.ids)
+
+    @override_settings(PRODUCT_BATCH_POST_MAX_IDS=100)
+    def test_post_is_capped_separately(self):
+        response = self.client.post('/api/products/batch/', {'ids': self.ids}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_refuses_ids_that_are_not_integer_ids(self):
+        for value in (1.5, '1.5', 2 ** 63, 10 ** 30, True, 0, 'abc'):
+            with self.subTest(value=value):
+                response = self.client.post(
+                    '/api/products/batch/', {'ids': [self.ids[0], value]}, content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/products/batch/', {'ids': '{},{}'.format(self.ids[0], 10 ** 30)})
+        self.assertEqual(response.status_code, 400)
+
+    def test_cart_batch_refuses_ids_that_are_not_integer_ids(self):
+        for value in (1.5, 10 ** 30):
+            with self.subTest(value=value):
+                response = self.client.post(
+                    '/api/cart/batch/', [{'product_id': value}], content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertFalse(Cart.objects.exists())
+
+
+class ConcurrentCartTests(TransactionTestCase):
+    """
+    Clients sharing one session add to the cart at the same time; every
+    add must be counted, without IntegrityErrors or drifting totals
+    """
+    threads = 6
+    adds = 10
+
+    def run_adds(self):
+        products = create_products(3)
+        cart = cart_client(self.client)
+        version = cart.version
+
+        errors = []
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            client = self.client_class()
+            client.cookies = self.client.cookies
+            try:
+                barrier.wait()
+                for _ in range(self.adds):
+                    for product in products:
+                        response = client.post(
+                            '/api/cart/',
+                            {'product_id': product.pk, 'quantity': 1},
+                            content_type='application/json',
+                        )
+                        if response.status_code != 200:
+                            errors.append(response.json())
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Write-behind stores must persist everything before the checks
+        get_cart_store().flush()
+
+        self.assertEqual(errors, [])
+        expected = self.threads * self.adds
+        self.assertEqual(
+            dict(cart.items.values_list('product_id', 'quantity')),
+            {product.pk: expected for product in products},
+        )
+        cart.refresh_from_db()
+        self.assertEqual(cart.item_count, expected * len(products))
+        self.assertEqual(cart.total_amount, expected * len(products) * 100)
+        self.assertEqual(cart.version - version, expected * len(products))
+        self.assertFalse(Cart.objects.with_drift().exists())
+
+    def test_database_store(self):
+        self.run_adds()
+
+    @override_settings(CART_STORAGE_BACKEND='api.cart_storage.CacheCartStore')
+    def test_cache_store(self):
+        self.run_adds()
+
+
+@override_settings(STORAGES=ADMIN_STORAGES)
+class AdminChangelistQueryTests(TestCase):
+    """
+    The product and cart changelists run a fixed number of queries: the
+    same for a single-row search as for a full page
+    """
+    @classmethod
+    def setUpTestData(cls):
+        products = create_products(100)
+        for n in range(100):
+            cart = Cart.objects.create(session_key=cls.session_key(n))
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=n + 1) for product in products[:3]
+            ])
+        cls.user = get_user_model().objects.create_superuser('test-admin', password='test-admin')
+
+    @staticmethod
+    def session_key(n):
+        return 'test{:028d}'.format(n)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assert_changelist_queries(self, url, search, queries):
+        for params in ({'q': search}, {}):
+            with self.subTest(params=params), self.assertNumQueries(queries):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, 200)
+
+    # Every page: session, user, COUNT(*), the page's rows and
+    # CompanyInfoAdmin's add permission check for the sidebar
+
+    def test_product_changelist(self):
+        # Plus the category filter choices
+        self.assert_changelist_queries('/admin/api/product/', 'Product 0', 6)
+
+    def test_cart_changelist(self):
+        self.assert_changelist_queries('/admin/api/cart/', self.session_key(0), 5)
+
+    def test_cartitem_changelist(self):
+        self.assert_changelist_queries('/admin/api/cartitem/', self.session_key(0), 5)
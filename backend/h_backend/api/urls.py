@@ -3,13 +3,19 @@ from .views import (
     CategoryListView,
     ProductListView,
     ProductDetailView,
+    ProductBatchView,
     FeaturedProductsView,
     LatestProductsView,
     BestSellerProductsView,
     SlideListView,
     CompanyInfoView,
     CompanyLogoListView,
+    HomeView,
+    ProductExportView,
+    ProductBulkUpdateView,
+    CacheStatsView,
     CartView,  # NEW
+    CartBatchView,
 )
 
 urlpatterns = [
@@ -19,15 +25,23 @@ urlpatterns = [
     # Products
     path('products/', ProductListView.as_view(), name='product-list'),
     path('products/<int:pk>/', ProductDetailView.as_view(), name='product-detail'),
+    path('products/batch/', ProductBatchView.as_view(), name='product-batch'),
     path('products/featured/', FeaturedProductsView.as_view(), name='featured-products'),
     path('products/latest/', LatestProductsView.as_view(), name='latest-products'),
     path('products/bestsellers/', BestSellerProductsView.as_view(), name='bestseller-products'),
+    path('products/bulk-update/', ProductBulkUpdateView.as_view(), name='product-bulk-update'),
+    path('products/export/<str:export_format>/', ProductExportView.as_view(), name='product-export'),
     
     # Homepage Content
+    path('home/', HomeView.as_view(), name='home'),
     path('slides/', SlideListView.as_view(), name='slide-list'),
     path('company-logos/', CompanyLogoListView.as_view(), name='company-logo-list'),
     path('company-info/', CompanyInfoView.as_view(), name='company-info'),
     
+    # Counters (staff only)
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    
     # Cart (NEW - Anonymous Session-Based Cart)
     path('cart/', CartView.as_view(), name='cart-view'),
+    path('cart/batch/', CartBatchView.as_view(), name='cart-batch'),
 ]
\ No newline at end of file
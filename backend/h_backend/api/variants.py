@@ -0,0 +1,252 @@
+"""
+Responsive image derivatives.
+
+When a model with images is saved, each new image is resized to the
+widths in IMAGE_VARIANT_WIDTHS and stored as WebP and JPEG next to the
+original, under a variants/ folder, on a background thread once the
+save commits. The stored paths are recorded on the row's
+`image_variants` field:
+
+    {
+        "thumbnail": {
+            "source": "products/9.png",
+            "webp": {"200": "products/variants/9_200w.webp", ...},
+            "jpeg": {"200": "products/variants/9_200w.jpg", ...}
+        }
+    }
+
+Images are never upscaled. An image narrower than the smallest width
+gets a single variant at its own width.
+
+Each image also gets a placeholder: its intrinsic size and a ~20px
+JPEG preview as a data URI, recorded on `image_placeholders`. Clients
+can reserve layout space and paint a blurred preview before the real
+image arrives. Placeholders are computed on a background thread after
+the save commits, never on the request path.
+"""
+import base64
+import logging
+import posixpath
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = tuple(getattr(settings, 'IMAGE_VARIANT_WIDTHS', (200, 400, 800)))
+
+# format key -> (extension, Pillow format, save options)
+VARIANT_FORMATS = {
+    'webp': ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+PLACEHOLDER_SIZE = 20
+
+
+def open_image(name, storage=default_storage):
+    """Load a stored image, upright, in RGB or RGBA"""
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    return image
+
+
+def variant_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, 'variants', '{}_{}w.{}'.format(stem, width, extension))
+
+
+def target_widths(width):
+    widths = [w for w in VARIANT_WIDTHS if w < width]
+    return widths or [width]
+
+
+def flatten(image):
+    """JPEG has no alpha channel, so composite transparent images onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_variants(name, storage=default_storage):
+    """Create every derivative of the stored image `name` and return its entry"""
+    image = open_image(name, storage)
+
+    entry = {'source': name}
+    for key, (extension, pil_format, options) in VARIANT_FORMATS.items():
+        entry[key] = {}
+        for width in target_widths(image.width):
+            resized = image.copy()
+            resized.thumbnail((width, image.height), Image.LANCZOS)
+            if pil_format == 'JPEG':
+                resized = flatten(resized)
+
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, **options)
+            path = storage.save(variant_name(name, width, extension), ContentFile(buffer.getvalue()))
+            entry[key][str(resized.width)] = path
+    return entry
+
+
+def delete_variants(entry, storage=default_storage):
+    for key in VARIANT_FORMATS:
+        for path in (entry or {}).get(key, {}).values():
+            try:
+                storage.delete(path)
+            except Exception:
+                logger.warning('Could not delete image variant %s', path, exc_info=True)
+
+
+def stale_fields(instance, force=False):
+    """Image fields of `instance` whose variants are missing or out of date"""
+    variants = instance.image_variants or {}
+    stale = []
+    for field_name in instance.image_variant_fields:
+        name = getattr(instance, field_name).name or ''
+        current = variants.get(field_name)
+        if force or (current or {}).get('source', '') != name:
+            stale.append(field_name)
+    return stale
+
+
+def build_variants(name, storage=default_storage):
+    """
+    Return the variants entry for a stored image, or None when there is
+    no image. Images that cannot be processed (SVG, corrupt files) get an
+    entry without variants, so they are not retried on every save.
+    """
+    if not name:
+        return None
+    try:
+        return generate_variants(name, storage)
+    except Exception:
+        # Derivatives are an optimisation; never fail the save over them
+        logger.warning('Could not create variants for %s', name, exc_info=True)
+        return {'source': name}
+
+
+def refresh_variants(model, pk):
+    """
+    Background task: build missing variants for one row, store them
+    without touching the rest of it, then delete the variants they replace
+    """
+    from .cache import invalidate_catalog_cache, invalidate_home_snapshot
+
+    fields = model.image_variant_fields
+    instance = model.objects.only('pk', 'image_variants', *fields).filter(pk=pk).first()
+    if instance is None:
+        return
+    stale = stale_fields(instance)
+    if not stale:
+        return
+
+    variants = dict(instance.image_variants or {})
+    built, replaced = [], []
+    for field_name in stale:
+        replaced.append(variants.pop(field_name, None))
+        entry = build_variants(getattr(instance, field_name).name)
+        if entry is not None:
+            variants[field_name] = entry
+            built.append(entry)
+
+    # Only store them if the row still has the images they were built
+    # from; a save that changed them has scheduled its own refresh
+    images = {field_name: getattr(instance, field_name).name for field_name in fields}
+    if model.objects.filter(pk=pk, **images).update(image_variants=variants, updated_at=timezone.now()):
+        unused = replaced
+        transaction.on_commit(invalidate_catalog_cache)
+        transaction.on_commit(invalidate_home_snapshot)
+    else:
+        unused = built
+    for entry in unused:
+        delete_variants(entry)
+
+
+# ============================================
+# PLACEHOLDERS
+# ============================================
+
+def generate_placeholder(name, storage=default_storage):
+    """Return the intrinsic size and a tiny preview of a stored image"""
+    image = open_image(name, storage)
+    preview = image.copy()
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+
+    buffer = BytesIO()
+    flatten(preview).save(buffer, 'JPEG', quality=50)
+    return {
+        'source': name,
+        'width': image.width,
+        'height': image.height,
+        'lqip': 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii'),
+    }
+
+
+def build_placeholder(name, storage=default_storage):
+    """
+    Return the placeholder entry for a stored image, or None when there
+    is no image. Unreadable images get an entry without a preview.
+    """
+    if not name:
+        return None
+    try:
+        return generate_placeholder(name, storage)
+    except Exception:
+        logger.warning('Could not create a placeholder for %s', name, exc_info=True)
+        return {'source': name}
+
+
+def stale_placeholder_fields(instance, force=False):
+    placeholders = instance.image_placeholders or {}
+    stale = []
+    for field_name in instance.image_variant_fields:
+        name = getattr(instance, field_name).name or ''
+        if force or (placeholders.get(field_name) or {}).get('source', '') != name:
+            stale.append(field_name)
+    return stale
+
+
+def refresh_placeholders(model, pk):
+    """
+    Background task: compute missing placeholders for one row and store
+    them without touching the rest of it
+    """
+    from .cache import invalidate_catalog_cache, invalidate_home_snapshot
+
+    fields = model.image_variant_fields
+    instance = model.objects.only('pk', 'image_placeholders', *fields).filter(pk=pk).first()
+    if instance is None:
+        return
+    stale = stale_placeholder_fields(instance)
+    if not stale:
+        return
+
+    placeholders = dict(instance.image_placeholders or {})
+    for field_name in stale:
+        entry = build_placeholder(getattr(instance, field_name).name)
+        if entry is None:
+            placeholders.pop(field_name, None)
+        else:
+            placeholders[field_name] = entry
+
+    # update() skips save() and its signals, so move updated_at (the
+    # conditional GET validators are built from it) and refresh the
+    # caches here
+    model.objects.filter(pk=pk).update(image_placeholders=placeholders, updated_at=timezone.now())
+    transaction.on_commit(invalidate_catalog_cache)
+    transaction.on_commit(invalidate_home_snapshot)
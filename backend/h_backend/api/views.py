@@ -1,8 +1,25 @@
-from rest_framework import generics, filters, status
+import re
+
+from rest_framework import generics, status
+from rest_framework.exceptions import NotFound
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import Category, Product, Slide, CompanyInfo, CompanyLogo, Cart, CartItem
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from .bulk import PriceOutOfRange, update_products
+from .cache import CachedCatalogMixin, collect_stats, get_home_snapshot, increment_stat
+from .cart_storage import get_cart_store
+from .exporter import EXPORT_FORMATS, CatalogExport
+from .conditional import ConditionalGetMixin, PRODUCT_VALIDATORS, build_validators, cached_table_state, set_validators
+from .pagination import ProductCursorPagination, wants_cursor_pagination
+from .search import ProductSearchFilter
+from .parsers import CSVParser, read_csv
+from .models import Category, Product, Slide, CompanyInfo, CompanyLogo
 from .serializers import (
     CategorySerializer,
     ProductSerializer,
@@ -10,30 +27,98 @@ from .serializers import (
     SlideSerializer,
     CompanyInfoSerializer,
     CompanyLogoSerializer,
-    CartSerializer,
-    CartItemSerializer,
+    ProductCardSerializer,
+    ProductRowSerializer,
+    CartOperationSerializer,
+    ProductBulkUpdateSerializer,
+    empty_cart_data,
+    model_columns,
+    parse_id,
+    parse_integer,
 )
 
 
-class CategoryListView(generics.ListAPIView):
+class PublicCatalogMixin:
+    """
+    Shared by the read-only catalog views, which serve every visitor the
+    same data. Without authentication classes DRF never resolves
+    request.user, so the session is never loaded and responses carry no
+    Vary: Cookie. CSRF does not apply: DRF views are exempt and these
+    views only answer GET.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+
+class ProductFieldsMixin:
+    """
+    Shared by the product views:
+    ?view=card switches to the compact ProductCardSerializer, and the
+    queryset loads only the columns the requested fields need
+    (see SparseFieldsMixin for ?fields= and ?omit=)
+    """
+    def get_serializer_class(self):
+        if self.request.query_params.get('view') == 'card':
+            return ProductCardSerializer
+        return super().get_serializer_class()
+    
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        columns = model_columns(self.get_serializer())
+        if any(column.startswith('category__') for column in columns):
+            queryset = queryset.select_related('category')
+        else:
+            queryset = queryset.select_related(None)
+        # created_at positions the cursor in cursor pagination
+        return queryset.only('created_at', *columns)
+
+
+class ProductRowListMixin(ProductFieldsMixin):
+    """
+    Serves product lists through ProductRowSerializer, which builds the
+    response straight from values() rows
+    """
+    def list(self, request, *args, **kwargs):
+        rows = ProductRowSerializer(self.get_serializer())
+        # created_at positions the cursor in cursor pagination
+        queryset = rows.values(self.filter_queryset(self.get_queryset()), 'created_at')
+        
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(rows.serialize(page))
+        return Response(rows.serialize(queryset))
+
+
+class CategoryListView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, generics.ListAPIView):
     """
     GET /api/categories/
     Returns all active categories
     """
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    validator_models = (Category,)
 
 
-class ProductListView(generics.ListAPIView):
+class ProductListView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, ProductRowListMixin, generics.ListAPIView):
     """
     GET /api/products/
     GET /api/products/?category=plumbing-piping
     GET /api/products/?search=cement
+    GET /api/products/?pagination=cursor
+    GET /api/products/?view=card
+    GET /api/products/?fields=id,name,price
+    GET /api/products/?omit=description
     
-    Returns all active products with optional filtering
+    Returns all active products with optional filtering.
+    Searches use the full-text index and are ordered by relevance.
+    
+    Pages are numbered by default. With ?pagination=cursor the response
+    has only `next`, `previous` and `results`, and pages stay fast at any
+    depth. Cursor pages are always newest first, including searches.
     """
     serializer_class = ProductListSerializer
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter]
+    validator_models = PRODUCT_VALIDATORS
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter]
     filterset_fields = ['category__slug', 'is_featured', 'is_bestseller']
     search_fields = ['name', 'company', 'description']
     
@@ -46,51 +131,139 @@ class ProductListView(generics.ListAPIView):
             queryset = queryset.filter(category__slug=category_slug)
         
         return queryset
+    
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            if wants_cursor_pagination(self.request):
+                self._paginator = ProductCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
 
 
-class ProductDetailView(generics.RetrieveAPIView):
+class ProductDetailView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, ProductFieldsMixin, generics.RetrieveAPIView):
     """
     GET /api/products/<id>/
     Returns detailed information about a single product
     """
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
+    validator_models = PRODUCT_VALIDATORS
 
 
-class FeaturedProductsView(generics.ListAPIView):
+class ProductBatchView(PublicCatalogMixin, ConditionalGetMixin, ProductFieldsMixin, generics.GenericAPIView):
+    """
+    GET /api/products/batch/?ids=12,3,40
+    POST /api/products/batch/  {"ids": [12, 3, 40]}  (for long lists)
+    
+    Returns the products with the given ids, fetched in one query, in
+    the order requested (repeated ids once):
+        {
+            "results": [{...product 12...}, {"id": 3, "not_found": true}, {...}],
+            "not_found": [3]
+        }
+    Ids of missing or inactive products get a not_found marker.
+    ?view=card, ?fields= and ?omit= work as on the other product views.
+    At most PRODUCT_BATCH_MAX_IDS ids per GET, which must fit in a URL,
+    and PRODUCT_BATCH_POST_MAX_IDS per POST.
+    """
+    queryset = Product.objects.filter(is_active=True)
+    serializer_class = ProductSerializer
+    validator_models = PRODUCT_VALIDATORS
+    
+    def get(self, request):
+        max_ids = getattr(settings, 'PRODUCT_BATCH_MAX_IDS', 100)
+        return self._batch_response(request, request.query_params.getlist('ids'), max_ids)
+    
+    def post(self, request):
+        data = request.data
+        ids = data.get('ids') if isinstance(data, dict) else data
+        max_ids = getattr(settings, 'PRODUCT_BATCH_POST_MAX_IDS', 1000)
+        return self._batch_response(request, ids, max_ids)
+    
+    def _batch_response(self, request, raw_ids, max_ids):
+        ids, error = self._parse_ids(raw_ids, max_ids)
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        
+        products = self.filter_queryset(self.get_queryset()).in_bulk(ids)
+        found = iter(self.get_serializer([products[pk] for pk in ids if pk in products], many=True).data)
+        results = [next(found) if pk in products else {'id': pk, 'not_found': True} for pk in ids]
+        return Response({
+            'results': results,
+            'not_found': [pk for pk in ids if pk not in products],
+        })
+    
+    def _parse_ids(self, raw_ids, max_ids):
+        """
+        Accept a list of ids, or comma-separated strings of them.
+        Returns (unique ids in order, None) or (None, error message).
+        """
+        if isinstance(raw_ids, (str, int)):
+            raw_ids = [raw_ids]
+        if not isinstance(raw_ids, list):
+            return None, 'Expected a list of product ids'
+        
+        ids = []
+        for raw in raw_ids:
+            values = raw.split(',') if isinstance(raw, str) else [raw]
+            for value in values:
+                if isinstance(value, str):
+                    value = value.strip()
+                    if not value:
+                        continue
+                product_id = parse_id(value)
+                if product_id is None:
+                    return None, 'Invalid product id: {!r}'.format(value)
+                ids.append(product_id)
+        
+        ids = list(dict.fromkeys(ids))
+        if not ids:
+            return None, 'ids is required'
+        if len(ids) > max_ids:
+            return None, 'At most {} ids per request'.format(max_ids)
+        return ids, None
+
+
+class FeaturedProductsView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, ProductRowListMixin, generics.ListAPIView):
     """
     GET /api/products/featured/
     Returns only featured products for homepage
     """
     queryset = Product.objects.filter(is_active=True, is_featured=True).select_related('category')
     serializer_class = ProductListSerializer
+    validator_models = PRODUCT_VALIDATORS
 
 
-class LatestProductsView(generics.ListAPIView):
+class LatestProductsView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, ProductRowListMixin, generics.ListAPIView):
     """
     GET /api/products/latest/
     Returns the 8 newest products for homepage
     """
     queryset = Product.objects.filter(is_active=True).select_related('category')[:8]
     serializer_class = ProductListSerializer
+    validator_models = PRODUCT_VALIDATORS
 
 
-class BestSellerProductsView(generics.ListAPIView):
+class BestSellerProductsView(PublicCatalogMixin, ConditionalGetMixin, CachedCatalogMixin, ProductRowListMixin, generics.ListAPIView):
     """
     GET /api/products/bestsellers/
     Returns best selling products for homepage
     """
     queryset = Product.objects.filter(is_active=True, is_bestseller=True).select_related('category')
     serializer_class = ProductListSerializer
+    validator_models = PRODUCT_VALIDATORS
 
 
-class SlideListView(generics.ListAPIView):
+class SlideListView(PublicCatalogMixin, ConditionalGetMixin, generics.ListAPIView):
     """
     GET /api/slides/
     Returns all active slides for the homepage hero slider
     """
     queryset = Slide.objects.filter(is_active=True)
     serializer_class = SlideSerializer
+    validator_models = (Slide,)
     
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -98,49 +271,177 @@ class SlideListView(generics.ListAPIView):
         return context
 
 
-class CompanyInfoView(APIView):
+class CompanyInfoView(PublicCatalogMixin, ConditionalGetMixin, APIView):
     """
     GET /api/company-info/
     Returns company contact information and social media links
     """
+    validator_models = (CompanyInfo,)
+
     def get(self, request):
         company_info = CompanyInfo.load()
         serializer = CompanyInfoSerializer(company_info)
         return Response(serializer.data)
 
 
-class CompanyLogoListView(generics.ListAPIView):
+class CompanyLogoListView(PublicCatalogMixin, ConditionalGetMixin, generics.ListAPIView):
     """
     GET /api/company-logos/
     Returns all active company/partner logos for scrolling section
     """
     queryset = CompanyLogo.objects.filter(is_active=True)
     serializer_class = CompanyLogoSerializer
+    validator_models = (CompanyLogo,)
+
+
+class HomeView(PublicCatalogMixin, ConditionalGetMixin, APIView):
+    """
+    GET /api/home/
+    Returns slides, logos, featured/latest/bestseller products, categories
+    and company info in one response, served from a cached snapshot that
+    is rebuilt only when one of those rows changes
+    """
+    validator_models = PRODUCT_VALIDATORS + (Slide, CompanyLogo, CompanyInfo)
+
+    def get(self, request):
+        return Response(get_home_snapshot(request))
 
 
 # ============================================
-# NEW CART VIEW (PUBLIC - NO AUTHENTICATION)
+# CATALOG EXPORT (STAFF ONLY)
 # ============================================
 
-class CartView(APIView):
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
+class ProductExportView(APIView):
     """
-    Unified Cart View handling all cart operations
-    PUBLIC - No authentication required
+    Download the whole catalog
+    STAFF ONLY
     
-    GET    /api/cart/           - Get current cart
-    POST   /api/cart/           - Add item to cart
-    PUT    /api/cart/           - Update item quantity
-    DELETE /api/cart/           - Remove item from cart
+    GET /api/products/export/csv/       - every product, importable
+    GET /api/products/export/ndjson/    - the same, one JSON object per line
+    GET /api/products/export/merchant/  - Google Merchant feed (TSV)
+    
+    Rows are streamed as they are read (see api/exporter.py), gzipped
+    on the fly when the client accepts it.
+    """
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise NotFound('Unknown export format. Use one of: {}'.format(', '.join(EXPORT_FORMATS)))
+        
+        compress = bool(ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        export = CatalogExport(export_format, build_url=request.build_absolute_uri, compress=compress)
+        response = StreamingHttpResponse(export, content_type=export.content_type)
+        response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+            export.filename('catalog-{:%Y%m%d}'.format(timezone.now()))
+        )
+        if compress:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
+
+# ============================================
+# BULK PRODUCT UPDATES (STAFF ONLY)
+# ============================================
+
+class ProductBulkUpdateView(APIView):
     """
+    Change the price or flags of many products in one UPDATE
+    STAFF ONLY
     
-    # No authentication required - this is a public endpoint
+    POST /api/products/bulk-update/
+    {
+        "category": "cement",            (scope: any of ids, category slug, company)
+        "price_percent": 7.5,            (or "price_amount": -50)
+        "is_featured": true              (and/or is_bestseller, is_active)
+    }
+    
+    Every change is recorded as a ProductBulkChange (see api/bulk.py).
+    """
+    permission_classes = [IsAdminUser]
+    
+    def post(self, request):
+        serializer = ProductBulkUpdateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            change = update_products(
+                serializer.get_queryset(),
+                percent=data.get('price_percent'),
+                amount=data.get('price_amount'),
+                flags=serializer.get_flags(),
+                user=request.user,
+                source='api',
+                scope=serializer.get_scope(),
+            )
+        except PriceOutOfRange as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'id': change.pk,
+            'product_count': change.product_count,
+            'product_ids': change.product_ids,
+        })
+
+
+# ============================================
+# CACHE STATS (STAFF ONLY)
+# ============================================
+
+class CacheStatsView(APIView):
+    """
+    Cache and cart counters, as seen by the worker answering
+    STAFF ONLY
+    
+    GET /api/cache-stats/
+    
+    With the default local-memory cache every worker counts on its own,
+    and only this endpoint can show a worker's counters; with a shared
+    cache (CACHE_LOCATION) they cover every worker, as in cache_stats.
+    """
+    permission_classes = [IsAdminUser]
+    
+    def get(self, request):
+        return Response(collect_stats())
+
+
+# ============================================
+# NEW CART VIEW (PUBLIC - NO AUTHENTICATION)
+# ============================================
+
+class SessionCartMixin:
+    """
+    Shared by the cart views: finds the session's cart in the configured
+    cart store (see api/cart_storage.py) and renders it
+    """
+    # No authentication required - these are public endpoints
     authentication_classes = []
     permission_classes = []
+    # Keep the cart's session alive (see SessionRefreshMiddleware)
+    refresh_session = True
+    
+    @property
+    def store(self):
+        return get_cart_store()
+    
+    def _find_cart(self, request):
+        """
+        Return the current session's cart, or None if there is none yet.
+        Never creates a session or a cart, so reads cause no writes.
+        """
+        session_key = request.session.session_key
+        if not session_key:
+            return None
+        return self.store.find(session_key)
     
     def _get_cart(self, request):
         """
         Private helper method to get or create cart for current session.
         Ensures session exists and returns the associated cart.
+        Only mutations call this, so sessions and carts are created lazily.
         """
         # Ensure session exists and get session key
         if not request.session.session_key:
@@ -149,19 +450,68 @@ class CartView(APIView):
         session_key = request.session.session_key
         
         # Get or create cart for this session
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
+        return self.store.get_or_create(session_key)
+    
+    def _cart_response(self, cart, request, product_ids=()):
+        """
+        Serialize `cart` with its totals and items.
+        With ?response=delta, only return the new totals and version, the
+        current lines for `product_ids` and which of those products are
+        no longer in the cart:
         
-        return cart
+        {"version": 7, "item_count": 12, "total_price": 4300.0,
+         "items": [<line>, ...], "removed": [<product id>, ...]}
+        """
+        if request.query_params.get('response') == 'delta':
+            data = self.store.delta(cart, request, product_ids)
+        else:
+            data = self.store.representation(cart, request)
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class CartView(SessionCartMixin, APIView):
+    """
+    Unified Cart View handling all cart operations
+    PUBLIC - No authentication required
+    
+    GET    /api/cart/           - Get current cart
+    POST   /api/cart/           - Add item to cart
+    PUT    /api/cart/           - Update item quantity
+    DELETE /api/cart/           - Remove item from cart
+    
+    Mutations return the whole cart, or with ?response=delta only the
+    changed lines, totals and cart version
+    """
     
     def get(self, request):
         """
         GET /api/cart/
-        Returns the current cart with all items
+        Returns the current cart with all items, or an empty cart
+        (id null) without creating anything if the visitor has none
+        Answers 304 when the client already has the current cart
         """
         try:
-            cart = self._get_cart(request)
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            cart = self._find_cart(request)
+            
+            if cart is None:
+                # Visitors who never added anything get a virtual empty
+                # cart; count the session and cart rows not written
+                increment_stat('cart:virtual_reads')
+                increment_stat('cart:writes_avoided', 1 if request.session.session_key else 2)
+                states = [(0, None)]
+            else:
+                # Product rows are nested in the cart, so price edits count too
+                states = [self.store.validator_state(cart), cached_table_state(Product)]
+            
+            etag, last_modified = build_validators(request, states)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                if cart is None:
+                    response = Response(empty_cart_data(), status=status.HTTP_200_OK)
+                else:
+                    response = self._cart_response(cart, request)
+            
+            return set_validators(response, etag, last_modified)
         
         except Exception as e:
             return Response(
@@ -190,14 +540,17 @@ class CartView(APIView):
                     {'error': 'product_id is required'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            product_id = parse_id(product_id)
+            if product_id is None:
+                return Response(
+                    {'error': 'product_id must be a positive integer id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            try:
-                quantity = int(quantity)
-                if quantity < 1:
-                    raise ValueError
-            except (ValueError, TypeError):
+            quantity = parse_integer(quantity, 1, settings.CART_MAX_QUANTITY)
+            if quantity is None:
                 return Response(
-                    {'error': 'quantity must be a positive integer'},
+                    {'error': 'quantity must be an integer from 1 to {}'.format(settings.CART_MAX_QUANTITY)},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
@@ -213,21 +566,11 @@ class CartView(APIView):
             # Get or create cart
             cart = self._get_cart(request)
             
-            # Get or create cart item
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-            
-            # If item already exists, increase quantity
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+            # Create the line or increase its quantity
+            self.store.apply(cart, [{'op': 'add', 'product_id': product.pk, 'quantity': quantity}])
             
             # Return updated cart
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return self._cart_response(cart, request, [product.pk])
         
         except Exception as e:
             return Response(
@@ -258,6 +601,12 @@ class CartView(APIView):
                     {'error': 'item_id is required'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            item_id = parse_id(item_id)
+            if item_id is None:
+                return Response(
+                    {'error': 'item_id must be a positive integer id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
             if quantity is None:
                 return Response(
@@ -265,38 +614,31 @@ class CartView(APIView):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            try:
-                quantity = int(quantity)
-                if quantity < 0:
-                    raise ValueError
-            except (ValueError, TypeError):
+            quantity = parse_integer(quantity, 0, settings.CART_MAX_QUANTITY)
+            if quantity is None:
                 return Response(
-                    {'error': 'quantity must be a non-negative integer'},
+                    {'error': 'quantity must be an integer from 0 to {}'.format(settings.CART_MAX_QUANTITY)},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            # Get cart
-            cart = self._get_cart(request)
-            
-            # Find cart item
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-            except CartItem.DoesNotExist:
+            # Get cart; without one there is nothing to change
+            cart = self._find_cart(request)
+            if cart is None:
                 return Response(
                     {'error': 'Cart item not found'},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
             # Update or delete based on quantity
-            if quantity == 0:
-                cart_item.delete()
-            else:
-                cart_item.quantity = quantity
-                cart_item.save()
+            product_id = self.store.set_quantity(cart, item_id, quantity)
+            if product_id is None:
+                return Response(
+                    {'error': 'Cart item not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
             
             # Return updated cart
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return self._cart_response(cart, request, [product_id])
         
         except Exception as e:
             return Response(
@@ -323,26 +665,118 @@ class CartView(APIView):
                     {'error': 'item_id is required'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            item_id = parse_id(item_id)
+            if item_id is None:
+                return Response(
+                    {'error': 'item_id must be a positive integer id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Get cart
-            cart = self._get_cart(request)
+            # Get cart; without one there is nothing to change
+            cart = self._find_cart(request)
+            if cart is None:
+                return Response(
+                    {'error': 'Cart item not found'},
+                    status=status.HTTP_404_NOT_FOUND
+                )
             
             # Find and delete cart item
-            try:
-                cart_item = CartItem.objects.get(id=item_id, cart=cart)
-                cart_item.delete()
-            except CartItem.DoesNotExist:
+            product_id = self.store.remove_item(cart, item_id)
+            if product_id is None:
                 return Response(
                     {'error': 'Cart item not found'},
                     status=status.HTTP_404_NOT_FOUND
                 )
             
             # Return updated cart
-            serializer = CartSerializer(cart, context={'request': request})
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            return self._cart_response(cart, request, [product_id])
         
         except Exception as e:
             return Response(
                 {'error': str(e)},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+            )
+
+
+class CartBatchView(SessionCartMixin, APIView):
+    """
+    Apply many cart changes in one request
+    PUBLIC - No authentication required
+    
+    POST /api/cart/batch/
+    
+    JSON body, either a list of operations or {"operations": [...]}:
+        [
+            {"op": "add", "product_id": 1, "quantity": 2},
+            {"op": "set", "product_id": 2, "quantity": 5},
+            {"op": "remove", "product_id": 3}
+        ]
+    
+    A bill of materials is the same list without "op" (every line is
+    an add), sent as JSON, as a text/csv body with product_id and
+    quantity columns, or as a CSV file upload in the "file" field.
+    
+    All operations are applied in one transaction and the resulting
+    cart is returned once (or only the changed lines, with
+    ?response=delta). Nothing is applied if any line is invalid.
+    """
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+    
+    def post(self, request):
+        rows = self._get_rows(request)
+        if rows is None:
+            return Response(
+                {'error': 'Expected a list of operations or a CSV file'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_lines = getattr(settings, 'CART_BATCH_MAX_LINES', 1000)
+        if len(rows) > max_lines:
+            return Response(
+                {'error': 'A batch can have at most {} lines'.format(max_lines)},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        serializer = CartOperationSerializer(data=rows, many=True)
+        if not serializer.is_valid():
+            return Response(
+                {'error': 'Invalid operations', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        operations = serializer.validated_data
+        if not operations:
+            return self._unchanged_response(request)
+        
+        # Products being added must exist and be for sale
+        wanted = {op['product_id'] for op in operations if op['op'] != 'remove'}
+        found = set(
+            Product.objects.filter(pk__in=wanted, is_active=True).values_list('pk', flat=True)
+        )
+        if wanted - found:
+            return Response(
+                {'error': 'Product not found', 'product_ids': sorted(wanted - found)},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        cart = self._get_cart(request)
+        self.store.apply(cart, operations)
+        return self._cart_response(cart, request, {op['product_id'] for op in operations})
+    
+    def _unchanged_response(self, request):
+        """The current cart for an empty batch, creating no session or cart"""
+        cart = self._find_cart(request)
+        if cart is not None:
+            return self._cart_response(cart, request)
+        data = empty_cart_data()
+        if request.query_params.get('response') == 'delta':
+            data = {key: data[key] for key in ('version', 'item_count', 'total_price', 'items')}
+            data['removed'] = []
+        return Response(data, status=status.HTTP_200_OK)
+    
+    def _get_rows(self, request):
+        if 'file' in request.FILES:
+            return read_csv(request.FILES['file'])
+        data = request.data
+        if isinstance(data, dict):
+            data = data.get('operations', data.get('items'))
+        return data if isinstance(data, list) else None
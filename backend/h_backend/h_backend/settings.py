@@ -69,6 +69,8 @@ MIDDLEWARE = [
     # CORS - MUST be before CommonMiddleware
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    # Pushes back cart session expiry; must follow SessionMiddleware
+    'api.middleware.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -108,6 +110,12 @@ DATABASES = {
     )
 }
 
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Test on a file rather than the default shared in-memory database,
+    # whose "table is locked" errors do not wait for the lock like the
+    # real database does (the concurrent cart tests rely on that)
+    DATABASES['default']['TEST'] = {'NAME': BASE_DIR / 'test_db.sqlite3'}
+
 
 # --- Password Validation ---
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -208,6 +216,54 @@ else:
     }
 
 
+# ============================================
+# CACHE
+# ============================================
+
+# Local memory by default. Set CACHE_LOCATION to a directory to share the
+# cache between worker processes through the file-based backend.
+#
+# Run more than one worker process (e.g. gunicorn --workers 2+) only with
+# a shared cache. Catalog invalidation bumps a generation key in the
+# cache, so with local memory an admin edit only invalidates the worker
+# that handled it. The others keep serving their cached bodies, and
+# because ETags are built from the database (api/conditional.py) those
+# stale bodies go out under fresh ETags that clients then keep. The same
+# goes for changes made by management commands (import_products, the
+# image backfills), which reach no worker at all. Without CACHE_LOCATION
+# the timeouts below are therefore kept short, to bound how long that
+# lasts.
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION')
+
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'h-store',
+        }
+    }
+
+# Seconds a homepage snapshot may live before it is rebuilt regardless
+HOME_SNAPSHOT_TIMEOUT = 60 * 60 * 24 if CACHE_LOCATION else 60
+
+# Seconds a cached catalog response may live before it is rebuilt regardless
+CATALOG_CACHE_TIMEOUT = 60 * 60 if CACHE_LOCATION else 60
+
+# Seconds the table state behind ETag / Last-Modified (api/conditional.py)
+# is reused; bounds how long a worker can miss a change made elsewhere
+CATALOG_STATE_TIMEOUT = 10
+
+# Absolute image URLs kept per worker by api.images.ImageURLResolver
+IMAGE_URL_CACHE_SIZE = 10000
+
+
 # ============================================
 # SECURITY (CORS & CSRF)
 # ============================================
@@ -248,13 +304,80 @@ CSRF_COOKIE_SECURE = False  # Set to True in production with HTTPS
 # SESSION CONFIGURATION (CRITICAL FOR CART)
 # ============================================
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+# With a shared cache (CACHE_LOCATION), cached_db reads sessions from the
+# cache and writes through to the database. The per-process local-memory
+# cache would let a logout in one worker leave the session alive in the
+# others, so without one sessions are read from the database every time.
+# SESSION_ENGINE overrides either default.
+SESSION_ENGINE = os.environ.get(
+    'SESSION_ENGINE',
+    'django.contrib.sessions.backends.cached_db' if CACHE_LOCATION else 'django.contrib.sessions.backends.db',
+)
 SESSION_COOKIE_NAME = 'sessionid'
 SESSION_COOKIE_AGE = 1209600  # 2 weeks
 SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SECURE = False  # Set to True in production with HTTPS
 SESSION_COOKIE_SAMESITE = 'Lax'
-SESSION_SAVE_EVERY_REQUEST = True
+# Sessions are only saved when they change. Views that need the session
+# kept alive (the cart) push its expiry back at most once per
+# SESSION_REFRESH_INTERVAL seconds (see api/middleware.py), so a session
+# still lasts SESSION_COOKIE_AGE from the last visit, give or take that
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_INTERVAL = 60 * 60
+
+
+# ============================================
+# CART
+# ============================================
+
+# Most lines accepted by POST /api/cart/batch/
+CART_BATCH_MAX_LINES = 1000
+
+# Largest quantity one request may add or set on a cart line; keeps
+# quantities and the stored cart totals within their columns
+CART_MAX_QUANTITY = 9999
+
+# Where working carts are kept (see api/cart_storage.py):
+# - api.cart_storage.DatabaseCartStore writes every change to the database
+# - api.cart_storage.CacheCartStore keeps carts in the cache and writes them
+#   to the database in batches; the cache must be shared by all workers
+CART_STORAGE_BACKEND = os.environ.get('CART_STORAGE_BACKEND', 'api.cart_storage.DatabaseCartStore')
+
+# CacheCartStore: seconds from the first pending change to the database
+# write, and the number of pending carts that triggers an earlier write
+CART_WRITE_BEHIND_DELAY = 2
+CART_WRITE_BEHIND_BATCH = 200
+
+# What happens to stored cart totals when a product price changes:
+# 'reprice' recomputes the carts holding the product straight away,
+# 'reconcile' leaves them to the reconcile_carts command
+CART_PRICE_CHANGE_POLICY = 'reprice'
+
+# Carts unchanged for this many days, whose session has expired, are
+# deleted by the purge_carts command / periodic purge (api/purge.py)
+CART_RETENTION_DAYS = 30
+
+# Seconds between purges run inside each web worker (None: only run the
+# purge_carts command, e.g. from cron). Workers sharing the cache run
+# one purge per interval between them.
+PURGE_INTERVAL = int(os.environ['PURGE_INTERVAL']) if os.environ.get('PURGE_INTERVAL') else None
+PURGE_BATCH_SIZE = 1000
+PURGE_PAUSE = 0.1
+
+
+# ============================================
+# CATALOG
+# ============================================
+
+# Most product ids accepted by /api/products/batch/ in one GET (they go
+# in the query string) and in one POST body
+PRODUCT_BATCH_MAX_IDS = 100
+PRODUCT_BATCH_POST_MAX_IDS = 1000
+
+# Storefront the merchant feed links to (category pages live under
+# /products/<slug>), and the currency its prices are given in
+STORE_URL = os.environ.get('STORE_URL', 'https://hardware-store-phi.vercel.app')
+STORE_CURRENCY = 'KES'
 
 
 # ============================================
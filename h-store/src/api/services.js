@@ -53,6 +53,11 @@ export const searchProducts = async (searchTerm) => {
 // ========================================
 // Homepage Content
 // ========================================
+export const getHomeContent = async () => {
+  const response = await api.get('/home/');
+  return response.data;
+};
+
 export const getSlides = async () => {
   const response = await api.get('/slides/');
   return response.data;
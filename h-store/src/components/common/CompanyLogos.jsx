@@ -1,30 +1,7 @@
-import React, { useEffect, useState } from "react";
-
-import { getCompanyLogos } from "../../api/services";
-
-const CompanyLogos = () => {
-  const [logos, setLogos] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
-
-  useEffect(() => {
-    const fetchLogos = async () => {
-      try {
-        setLoading(true);
-        const data = await getCompanyLogos();
-        setLogos(Array.isArray(data) ? data : data.results || []);
-        setError(null);
-      } catch (err) {
-        console.error("Error fetching company logos:", err);
-        setError("Failed to load company logos");
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetchLogos();
-  }, []);
+import React from "react";
 
+// Logos come from the homepage snapshot fetched by Home (GET /api/home/)
+const CompanyLogos = ({ logos = [], loading = false, error = null }) => {
   return (
     <div className="w-full my-32">
       {/* Top Divider */}
@@ -1,43 +1,17 @@
 // src/components/common/FeaturedProducts.jsx
-import React, { useEffect, useState } from "react";
+import React, { useState } from "react";
 
 // 1. Import ProductModal
 import ProductModal from "./ProductModal";
-import { getFeaturedProducts } from "../../api/services";
 
-const FeaturedProducts = () => {
-  const [products, setProducts] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
+// Products come from the homepage snapshot fetched by Home (GET /api/home/)
+const FeaturedProducts = ({ products: featured = [], loading = false, error = null }) => {
+  const products = featured.slice(0, 3);
 
   // 2. Add state for modal control
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [selectedProduct, setSelectedProduct] = useState(null);
 
-  // Fetch featured products (no changes here)
-  useEffect(() => {
-    const fetchFeaturedProducts = async () => {
-      try {
-        setLoading(true);
-        const data = await getFeaturedProducts();
-        let productsArray = Array.isArray(data)
-          ? data
-          : data?.results && Array.isArray(data.results)
-          ? data.results
-          : [];
-        setProducts(productsArray.slice(0, 3));
-        setError(null);
-      } catch (err) {
-        console.error("Error fetching featured products:", err);
-        setError("Failed to load featured products");
-        setProducts([]);
-      } finally {
-        setLoading(false);
-      }
-    };
-    fetchFeaturedProducts();
-  }, []);
-
   // 3. Function to open the modal
   const handleOpenModal = (product) => {
     setSelectedProduct(product);
@@ -2,37 +2,14 @@ import { ChevronLeft, ChevronRight } from 'lucide-react';
 import React, { useCallback, useEffect, useState } from 'react';
 
 import { Link } from 'react-router-dom'; // 1. Import Link
-import { getSlides } from '../../api/services';
 
-const FlexSlider = () => {
+// Slides come from the homepage snapshot fetched by Home (GET /api/home/)
+const FlexSlider = ({ slides = [], loading = false, error = null }) => {
   const [currentSlide, setCurrentSlide] = useState(0);
   const [isAnimating, setIsAnimating] = useState(false);
-  const [slides, setSlides] = useState([]);
-  const [loading, setLoading] = useState(true);
-  const [error, setError] = useState(null);
 
   const interval = 8000;
 
-  // --- Fetching and State Logic (No changes needed) ---
-  useEffect(() => {
-    const fetchSlides = async () => {
-      try {
-        setLoading(true);
-        const data = await getSlides();
-        const slidesData = Array.isArray(data) ? data : (data.results || []);
-        setSlides(slidesData);
-        setError(null);
-      } catch (err) {
-        console.error('Error fetching slides:', err);
-        setError('Failed to load slides');
-        setSlides([]);
-      } finally {
-        setLoading(false);
-      }
-    };
-    fetchSlides();
-  }, []);
-
   const nextSlide = useCallback(() => {
     if (isAnimating || slides.length === 0) return;
     setIsAnimating(true);
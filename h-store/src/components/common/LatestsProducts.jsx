@@ -1,52 +1,17 @@
-import React, { useEffect, useState } from "react";
-import {
-  getBestSellerProducts,
-  getFeaturedProducts,
-  getLatestProducts,
-} from "../../api/services";
+import React, { useState } from "react";
 
 import ProductCard from "../common/ProductCard";
 
-const LatestProducts = () => {
+// Every tab's products come from the homepage snapshot fetched by Home
+// (GET /api/home/), so switching tabs needs no request
+const LatestProducts = ({ latest = [], featured = [], bestsellers = [], loading = false, error = null }) => {
   const [activeTab, setActiveTab] = useState("New Arrivals");
-  const [products, setProducts] = useState([]);
-  const [loading, setLoading] = useState(false);
-  const [error, setError] = useState(null);
 
-  // Fetch products based on active tab
-  useEffect(() => {
-    const fetchProducts = async () => {
-      setLoading(true);
-      setError(null);
-
-      try {
-        let data = [];
-        if (activeTab === "New Arrivals") {
-          data = await getLatestProducts();
-        } else if (activeTab === "Featured") {
-          data = await getFeaturedProducts();
-        } else if (activeTab === "Best Sellers") {
-          data = await getBestSellerProducts();
-        }
-
-        // Handle both array and paginated responses
-        const list = Array.isArray(data)
-          ? data
-          : data?.results && Array.isArray(data.results)
-          ? data.results
-          : [];
-
-        setProducts(list);
-      } catch (err) {
-        console.error("Error loading products:", err);
-        setError("Failed to load products. Please try again later.");
-      } finally {
-        setLoading(false);
-      }
-    };
-
-    fetchProducts();
-  }, [activeTab]);
+  const products = {
+    "New Arrivals": latest,
+    "Featured": featured,
+    "Best Sellers": bestsellers,
+  }[activeTab];
 
   return (
     <div className="w-full max-w-7xl mx-auto px-4 sm:px-6 lg:px-8 my-12">
@@ -7,22 +7,62 @@ import InfoSection from "../components/common/InfoSection";
 import LatestProducts from "../components/common/LatestsProducts";
 import Navbar from "../components/navigation/Navbar";
 // src/pages/Home.jsx
-import React from "react";
+import React, { useEffect, useState } from "react";
 import ThreeColumnSection from "../components/common/ThreeColumnSection";
 import TopBar from "../components/navigation/Topbar";
+import { getHomeContent } from "../api/services";
 
 const Home = () => {
+  // Every homepage section comes from one cached snapshot (GET /api/home/)
+  const [home, setHome] = useState(null);
+  const [loading, setLoading] = useState(true);
+  const [error, setError] = useState(false);
+
+  useEffect(() => {
+    const fetchHomeContent = async () => {
+      try {
+        setLoading(true);
+        setHome(await getHomeContent());
+        setError(false);
+      } catch (err) {
+        console.error("Error fetching homepage content:", err);
+        setError(true);
+      } finally {
+        setLoading(false);
+      }
+    };
+    fetchHomeContent();
+  }, []);
+
   return (
     <div>
       <TopBar />
       <Navbar />
-      <FlexSlider />
+      <FlexSlider
+        slides={home?.slides}
+        loading={loading}
+        error={error ? "Failed to load slides" : null}
+      />
       <FloatingActions />
-      <FeaturedProducts />
-      <LatestProducts />
+      <FeaturedProducts
+        products={home?.featured_products}
+        loading={loading}
+        error={error ? "Failed to load featured products" : null}
+      />
+      <LatestProducts
+        latest={home?.latest_products}
+        featured={home?.featured_products}
+        bestsellers={home?.bestseller_products}
+        loading={loading}
+        error={error ? "Failed to load products. Please try again later." : null}
+      />
       <InfoSection />
       <ThreeColumnSection />
-      <CompanyLogos />
+      <CompanyLogos
+        logos={home?.company_logos}
+        loading={loading}
+        error={error ? "Failed to load company logos" : null}
+      />
       <Footer />
     </div>
   );